@@ -0,0 +1,137 @@
+import os
+import warnings
+import numpy as np
+import pygame
+from typing import Optional
+from settings import *
+from assetManager import asset_manager
+
+
+class AnimationClock:
+    """ Simulation steps since the game started, shared by every animation so an entity only has to remember the time
+        its animation started. Advanced once per simulation step by Level.update.
+    """
+    def __init__(self):
+        self.time = 0
+
+    def tick(self, steps: int = 1):
+        self.time += steps
+
+
+animation_clock = AnimationClock()
+
+
+class FrameTable:
+    """ Frames of one animation with the number of simulation steps each is shown for, precomputed into the frame
+        index shown at every step of the loop
+    """
+    def __init__(self, frames: tuple[pygame.Surface, ...], durations: tuple[int, ...]):
+        if len(frames) != len(durations) or any(duration < 1 for duration in durations):
+            raise ValueError("every frame needs a duration of at least one step")
+
+        self.frames = frames
+        self.durations = durations
+        self.step_frames = tuple(index for index, duration in enumerate(durations) for _ in range(duration))
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def get_frame_index(self, elapsed: int) -> int:
+        """ Index of the frame shown elapsed steps after the animation started, the animation loops """
+        return self.step_frames[elapsed % len(self.step_frames)]
+
+
+class AnimationSet:
+    """ Frame tables keyed by status. Missing or empty animations are reported once instead of failing on every
+        lookup, entities keep their current frame while their status has no animation.
+    """
+    def __init__(self, name: str, tables: dict[str, FrameTable], empty_statuses: tuple[str, ...] = ()):
+        self.name = name
+        self.tables = tables
+        self.reported_statuses = set()
+        for status in empty_statuses:
+            self.report(status, "has no frames")
+
+    def __contains__(self, status: str) -> bool:
+        return status in self.tables
+
+    def report(self, status: str, problem: str):
+        if status not in self.reported_statuses:
+            self.reported_statuses.add(status)
+            warnings.warn(f"animation '{status}' of {self.name} {problem}", RuntimeWarning, stacklevel=3)
+
+    def get_table(self, status: str) -> Optional[FrameTable]:
+        table = self.tables.get(status)
+        if table is None:
+            self.report(status, "does not exist")
+        return table
+
+    def get_step_table(self, statuses: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """ The frame index shown at every step of the loop of each status as a (status, step) array padded with -1,
+            and the loop length of each status (1 for statuses without frames), for animating many entities at once
+        """
+        tables = [self.tables.get(status) for status in statuses]
+        loop_lengths = np.array([len(table.step_frames) if table is not None else 1 for table in tables],
+                                dtype=np.int64)
+        step_table = np.full((len(tables), int(loop_lengths.max(initial=1))), -1, dtype=np.int64)
+        for row, table in enumerate(tables):
+            if table is not None:
+                step_table[row, :len(table.step_frames)] = table.step_frames
+        return step_table, loop_lengths
+
+
+# (root path, size, frame duration, durations) -> AnimationSet
+animation_sets = {}
+
+
+def get_animation_set(root_path: str, size: tuple[int, int] = (TILE_SIZE, TILE_SIZE),
+                      frame_duration: int = ANIMATION_FRAME_DURATION,
+                      durations: Optional[dict[str, tuple[int, ...]]] = None) -> AnimationSet:
+    """ Returns the animation set of the sub folders of root_path (see AssetManager.get_animations), shared by every
+        caller asking for the same one. Frames last frame_duration steps unless durations gives the frame durations
+        of a status.
+    """
+    key = (os.path.normpath(root_path), tuple(size), frame_duration,
+           tuple(sorted(durations.items())) if durations else None)
+    if key not in animation_sets:
+        durations = durations or {}
+        animations = asset_manager.get_animations(root_path, size)
+        tables = {status: FrameTable(frames, durations.get(status, (frame_duration,) * len(frames)))
+                  for status, frames in animations.items() if frames}
+        empty_statuses = tuple(status for status, frames in animations.items() if not frames)
+        animation_sets[key] = AnimationSet(os.path.relpath(root_path, ROOT_DIR), tables, empty_statuses)
+
+    return animation_sets[key]
+
+
+class AnimationController:
+    """ Animation state of one entity: the time its animation started on the shared clock and the frame it shows.
+        Changing status keeps the start time so the new animation continues at the same phase.
+    """
+    def __init__(self, animation_set: AnimationSet, clock: AnimationClock = animation_clock):
+        self.animation_set = animation_set
+        self.clock = clock
+        self.start = clock.time
+        self.status = None
+        self.frame_index = None
+
+    def get_elapsed(self) -> int:
+        return self.clock.time - self.start
+
+    def set_elapsed(self, elapsed: int):
+        """ Restarts the animation as if it started elapsed steps ago, the frame is shown by the next update """
+        self.start = self.clock.time - elapsed
+        self.status = self.frame_index = None
+
+    def update(self, status: str) -> Optional[pygame.Surface]:
+        """ Returns the frame to show if it changed since the last update, None otherwise """
+        table = self.animation_set.get_table(status)
+        if table is None:
+            return None
+
+        frame_index = table.get_frame_index(self.clock.time - self.start)
+        if status == self.status and frame_index == self.frame_index:
+            return None
+
+        self.status, self.frame_index = status, frame_index
+        return table.frames[frame_index]
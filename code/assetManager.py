@@ -0,0 +1,188 @@
+import os
+import weakref
+import pygame
+from collections import defaultdict
+from typing import Optional
+from settings import *
+
+
+def get_surface_bytes(surface: pygame.Surface) -> int:
+    return surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+
+class AssetManager:
+    """ Process wide cache of converted and scaled surfaces. Every image is loaded and scaled once per target size
+        and the same Surface is shared by every sprite using it, so callers must never draw onto a returned surface.
+    """
+    def __init__(self):
+        # (path, size) -> Surface
+        self.images = {}
+        # (folder path, size) -> tuple of animation frames
+        self.animations = {}
+        # (source surface, size) -> Surface, for surfaces that are not loaded from a file
+        self.scaled_surfaces = {}
+        # (tileset image, tile) -> Surface, the tile images of every loaded map (see mapLoader.get_tile_keys)
+        self.tiles = {}
+        # scale -> {surface: Surface shrunk back to the size it had before being scaled up}, for native resolution
+        # rendering. Weakly keyed so a copy is dropped with its surface, e.g. when a level is evicted or reloaded.
+        self.native_surfaces = defaultdict(weakref.WeakKeyDictionary)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_image(self, path: str, size: tuple[int, int] = (TILE_SIZE, TILE_SIZE)) -> pygame.Surface:
+        key = (os.path.normpath(path), tuple(size))
+        if key in self.images:
+            self.hits += 1
+        else:
+            self.misses += 1
+            surf = pygame.image.load(path).convert_alpha()
+            self.images[key] = pygame.transform.scale(surf, size)
+
+        return self.images[key]
+
+    def get_animation(self, folder_path: str, size: tuple[int, int] = (TILE_SIZE, TILE_SIZE)) \
+            -> tuple[pygame.Surface, ...]:
+        """ Returns the frames of the animation stored in folder_path, ordered by file name """
+        key = (os.path.normpath(folder_path), tuple(size))
+        if key in self.animations:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.animations[key] = tuple(self.get_image(os.path.join(folder_path, image), size)
+                                         for image in sorted(os.listdir(folder_path)))
+
+        return self.animations[key]
+
+    def get_animations(self, root_path: str, size: tuple[int, int] = (TILE_SIZE, TILE_SIZE)) \
+            -> dict[str, tuple[pygame.Surface, ...]]:
+        """ Returns every animation stored in a sub folder of root_path, keyed by the sub folder name """
+        return {folder: self.get_animation(os.path.join(root_path, folder), size)
+                for folder in sorted(os.listdir(root_path))}
+
+    def get_scaled_surface(self, surf: pygame.Surface, size: tuple[int, int] = (TILE_SIZE, TILE_SIZE)) \
+            -> pygame.Surface:
+        if surf.get_size() == tuple(size):
+            return surf
+
+        key = (surf, tuple(size))
+        if key in self.scaled_surfaces:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.scaled_surfaces[key] = pygame.transform.scale(surf, size)
+
+        return self.scaled_surfaces[key]
+
+    def get_native_surface(self, surf: pygame.Surface, scale: int = SCALE) -> pygame.Surface:
+        if scale == 1:
+            return surf
+
+        native_surfaces = self.native_surfaces[scale]
+        native_surface = native_surfaces.get(surf)
+        if native_surface is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            width, height = surf.get_size()
+            native_surface = pygame.transform.scale(surf, (max(width // scale, 1), max(height // scale, 1)))
+            native_surfaces[surf] = native_surface
+
+        return native_surface
+
+    def intern_tile(self, tile_key: Optional[tuple[str, str]], surf: pygame.Surface) -> pygame.Surface:
+        """ Returns the shared surface of a map tile, surf becomes that surface if the tile has not been loaded by any
+            map yet. Tiles without a key (e.g. of generated maps) are not shared.
+        """
+        if tile_key is None:
+            return surf
+
+        key = (*tile_key, surf.get_size())
+        if key in self.tiles:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.tiles[key] = surf
+
+        return self.tiles[key]
+
+    def get_tile(self, tile_key: Optional[tuple[str, str]], size: tuple[int, int]) -> Optional[pygame.Surface]:
+        """ The shared surface of a map tile if a map has already loaded it, so it is not converted again """
+        if tile_key is None:
+            return None
+
+        tile = self.tiles.get((*tile_key, tuple(size)))
+        if tile is not None:
+            self.hits += 1
+        return tile
+
+    def preload(self, paths: list[str], size: tuple[int, int] = (TILE_SIZE, TILE_SIZE)):
+        """ Loads images, or every frame of animation folders, ahead of time """
+        for path in paths:
+            if os.path.isdir(path):
+                self.get_animation(path, size)
+            else:
+                self.get_image(path, size)
+
+    def evict(self, path: Optional[str] = None):
+        """ Drops every cached surface loaded from path (a file, an animation folder or a tileset image), or everything
+            if no path is given. Sprites keep the surfaces they already hold.
+        """
+        if path is None:
+            self.images.clear()
+            self.animations.clear()
+            self.scaled_surfaces.clear()
+            self.tiles.clear()
+            self.native_surfaces.clear()
+            return
+
+        path = os.path.normpath(path)
+        for cache in (self.images, self.animations):
+            for key in [key for key in cache if key[0] == path or os.path.dirname(key[0]) == path]:
+                del cache[key]
+
+        # tile keys hold the tileset image relative to the root folder
+        tileset = os.path.relpath(path, ROOT_DIR)
+        for key in [key for key in self.tiles if key[0] == tileset]:
+            del self.tiles[key]
+
+    def get_surfaces(self) -> dict[int, pygame.Surface]:
+        """ Every cached surface keyed by id, animation frames are cached images too """
+        return {id(surf): surf for surf in [*self.images.values(), *self.scaled_surfaces.values(),
+                                            *self.tiles.values(), *self.get_native_surfaces()]}
+
+    def get_native_surfaces(self) -> list[pygame.Surface]:
+        return [surf for native_surfaces in self.native_surfaces.values() for surf in native_surfaces.values()]
+
+    def get_asset_names(self) -> dict[int, str]:
+        """ Image file or tileset every cached surface was loaded from, keyed by surface id """
+        asset_names = {id(image): os.path.relpath(path, ROOT_DIR) for (path, _), image in self.images.items()}
+        asset_names.update((id(tile), tileset) for (tileset, _, _), tile in self.tiles.items())
+        return asset_names
+
+    def get_memory_report(self) -> dict[str, int]:
+        """ Bytes of the cached surfaces per image file and per tileset, surfaces scaled from other surfaces are
+            reported together
+        """
+        asset_names = self.get_asset_names()
+        report = {}
+        for surface_id, surf in self.get_surfaces().items():
+            asset_name = asset_names.get(surface_id, "scaled surfaces")
+            report[asset_name] = report.get(asset_name, 0) + get_surface_bytes(surf)
+
+        return report
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "images": len(self.images),
+            "animations": len(self.animations),
+            "scaled_surfaces": len(self.scaled_surfaces),
+            "tiles": len(self.tiles),
+            "native_surfaces": len(self.get_native_surfaces()),
+            "bytes": sum(get_surface_bytes(surf) for surf in self.get_surfaces().values())
+        }
+
+
+asset_manager = AssetManager()
@@ -0,0 +1,382 @@
+""" Headless, deterministic benchmark suite. Runs the game loop under SDL's dummy video driver for a fixed number of
+    frames with scripted input and reports per-frame percentiles for each stage.
+
+    python benchmark.py [--scenario NAME ...] [--frames N] [--input SCRIPT] [--output results.json]
+    python benchmark.py --compare baseline.json [--threshold 0.15]   exits with 1 if any stage regressed
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from collections import defaultdict
+from typing import Callable, Optional
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import numpy as np
+from settings import *
+from entity import Entity
+from player import Player
+from level import Level, YSortCameraGroup
+from levelHandler import LevelHandler
+from inputReplay import ScriptedInput
+from mapLoader import convert_map_images
+from stressMap import generate_stress_map
+from crowd import Crowd
+from updateScheduler import UpdateScheduler, TIER_COUNTERS
+from navigation import Navigation
+from worldStreamer import ChunkStreamer, StreamedLevel, get_stream_path, write_stream, load_streamed_map
+
+STAGES = ["frame", "update", "collision", "navigation", "streaming", "draw", "transition", "present"]
+PERCENTILES = [50, 90, 99]
+# walk a square, then stand still for a moment
+DEFAULT_SCRIPT = [[60, ["d"]], [60, ["s"]], [60, ["a"]], [60, ["w"]], [30, ["d", "s"]], [30, []]]
+# stage timings faster than this are treated as noise when comparing against a baseline
+MIN_REGRESSION_MS = 0.05
+
+
+class StageTimer:
+    """ Times methods by temporarily wrapping them, nested calls of the same stage are only counted once """
+    def __init__(self):
+        self.frame_totals = defaultdict(float)
+        self.depth = defaultdict(int)
+        self.samples = defaultdict(list)
+        self.patches = []
+
+    def wrap(self, owner, attribute: str, stage: str):
+        method = getattr(owner, attribute)
+
+        def timed(*args, **kwargs):
+            self.depth[stage] += 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.depth[stage] -= 1
+                if self.depth[stage] == 0:
+                    self.frame_totals[stage] += time.perf_counter() - start
+
+        self.patches.append((owner, attribute, owner.__dict__.get(attribute)))
+        setattr(owner, attribute, timed)
+
+    def restore(self):
+        for owner, attribute, original in reversed(self.patches):
+            if original is None:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+        self.patches = []
+
+    def add(self, stage: str, seconds: float):
+        self.frame_totals[stage] += seconds
+
+    def end_frame(self):
+        for stage in STAGES:
+            self.samples[stage].append(self.frame_totals[stage] * 1000)
+        self.frame_totals.clear()
+
+    def summary(self) -> dict:
+        result = {}
+        for stage in STAGES:
+            samples = np.array(self.samples[stage])
+            result[stage] = {f"p{percentile}": round(float(np.percentile(samples, percentile)), 4)
+                             for percentile in PERCENTILES}
+            result[stage]["mean"] = round(float(samples.mean()), 4)
+            result[stage]["max"] = round(float(samples.max()), 4)
+        return result
+
+
+class WanderingEntity(Entity):
+    """ Non-player entity that picks a new random direction every few frames """
+    def __init__(self, pos: tuple[float, float], groups: list[pygame.sprite.Group], obstacle_sprites,
+                 rng: random.Random):
+        super().__init__(pos, TEST_PLAYER_IMAGE_FILE_PATH, groups, obstacle_sprites)
+        self.rng = rng
+        self.frames_until_turn = 0
+
+    def input(self):
+        if self.frames_until_turn <= 0:
+            self.direction.update(self.rng.choice([-1, 0, 1]), self.rng.choice([-1, 0, 1]))
+            if self.direction.x:
+                self.status = "right" if self.direction.x > 0 else "left"
+            elif self.direction.y:
+                self.status = "down" if self.direction.y > 0 else "up"
+            self.frames_until_turn = self.rng.randint(15, 60)
+
+        self.frames_until_turn -= self.update_steps
+
+
+class NavigatingEntity(Entity):
+    """ Non-player entity that walks to random goals along paths from the level's navigation service """
+    def __init__(self, pos: tuple[float, float], groups: list[pygame.sprite.Group], obstacle_sprites,
+                 navigation, map_size: tuple[int, int], rng: random.Random):
+        super().__init__(pos, TEST_PLAYER_IMAGE_FILE_PATH, groups, obstacle_sprites)
+        self.navigation = navigation
+        self.map_size = map_size
+        self.rng = rng
+        self.path_request = None
+
+    def input(self):
+        if self.path_request is not None and self.path_request.done:
+            self.set_path(self.path_request.path or [])
+            self.path_request = None
+
+        if not self.path and self.path_request is None:
+            goal = (self.rng.uniform(0, self.map_size[0]), self.rng.uniform(0, self.map_size[1]))
+            self.path_request = self.navigation.request_path(self.rect.center, goal)
+
+        self.follow_path()
+
+
+class BundledWorld:
+    """ The real game: bundled maps driven by LevelHandler """
+    def __init__(self):
+        self.level_handler = LevelHandler()
+        self.player = self.level_handler.player
+
+    def run_frame(self) -> list[pygame.Rect]:
+        return self.level_handler.run()
+
+    def close(self):
+        self.level_handler.shutdown()
+
+    def teleport_to_transition(self):
+        for transition_sprite in self.level_handler.transition_sprites_group:
+            if transition_sprite.get_new_level_code() is not None:
+                self.player.rect.center = transition_sprite.rect.center
+                return
+
+
+class StressWorld:
+    """ Programmatically generated map with many tiles, obstacles and wandering entities """
+    def __init__(self, width: int, height: int, obstacle_count: int, entity_count: int, seed: int = 0,
+                 crowd_count: int = 0, navigating_count: int = 0):
+        map_data = generate_stress_map(width, height, obstacle_count, seed=seed)
+        convert_map_images(map_data)
+        self.level = Level(map_data.filename, tmx_data=map_data)
+
+        visible_sprites, obstacle_sprites, transition_sprites, spawn_points = self.level.get_level_groups()
+        centre = (width * TILE_SIZE // 2, height * TILE_SIZE // 2)
+        self.player = Player(centre, TEST_PLAYER_IMAGE_FILE_PATH, [visible_sprites], obstacle_sprites,
+                             transition_sprites, spawn_points, 0)
+        self.level.set_player(self.player)
+
+        rng = random.Random(seed)
+        for _ in range(entity_count):
+            position = (rng.uniform(0, width * TILE_SIZE), rng.uniform(0, height * TILE_SIZE))
+            WanderingEntity(position, [visible_sprites], obstacle_sprites, rng)
+
+        map_size = (width * TILE_SIZE, height * TILE_SIZE)
+        for _ in range(navigating_count):
+            position = (rng.uniform(0, map_size[0]), rng.uniform(0, map_size[1]))
+            NavigatingEntity(position, [visible_sprites], obstacle_sprites, self.level.get_navigation(), map_size, rng)
+
+        if crowd_count:
+            self.level.spawn_crowd([(rng.uniform(0, width * TILE_SIZE), rng.uniform(0, height * TILE_SIZE))
+                                    for _ in range(crowd_count)], seed)
+        self.frames = 0
+
+    def run_frame(self) -> list[pygame.Rect]:
+        self.frames += 1
+        return self.level.run()
+
+    def close(self):
+        self.level.shutdown()
+
+    def get_counters(self) -> dict:
+        """ Sprites updated in each tier of the update scheduler (and sprites asleep) per frame, on average """
+        totals = self.level.visible_sprites.update_scheduler.totals
+        return {f"{name} per frame": round(totals[tier] / max(self.frames, 1), 1)
+                for tier, name in TIER_COUNTERS.items()}
+
+
+class StreamingWorld:
+    """ Generated map split into chunks and streamed around the player, who walks diagonally across chunk borders """
+    def __init__(self, size: int, obstacle_count: int, seed: int = 0):
+        map_data = generate_stress_map(size, size, obstacle_count, seed=seed)
+        stream_path = get_stream_path(map_data.filename)
+        write_stream(map_data, stream_path, {})
+        streamed_map = load_streamed_map(stream_path, map_data.filename)
+        convert_map_images(streamed_map)
+        self.level = StreamedLevel(map_data.filename, tmx_data=streamed_map)
+
+        # a little before the corner shared by four chunks
+        start = size * TILE_SIZE // 2 - TILE_SIZE * 8
+        visible_sprites, obstacle_sprites, transition_sprites, spawn_points = self.level.get_level_groups()
+        self.player = Player((start, start), TEST_PLAYER_IMAGE_FILE_PATH, [visible_sprites], obstacle_sprites,
+                             transition_sprites, spawn_points, 0)
+        self.level.set_player(self.player)
+        self.chunk_position = self.level.streamer.get_chunk_position(self.player.rect.center)
+        self.chunk_changes = 0
+        self.max_loaded_chunks = 0
+
+    def run_frame(self) -> list[pygame.Rect]:
+        dirty_rects = self.level.run()
+        chunk_position = self.level.streamer.get_chunk_position(self.player.rect.center)
+        self.chunk_changes += chunk_position != self.chunk_position
+        self.chunk_position = chunk_position
+        self.max_loaded_chunks = max(self.max_loaded_chunks, len(self.level.streamer.chunks))
+        return dirty_rects
+
+    def close(self):
+        self.level.shutdown()
+
+    def get_counters(self) -> dict:
+        return {"chunk changes": self.chunk_changes, "max loaded chunks": self.max_loaded_chunks,
+                "stalls": self.level.streamer.stalls}
+
+
+class Scenario:
+    def __init__(self, name: str, description: str, create_world: Callable,
+                 frame_hook: Optional[Callable] = None, script: Optional[list] = None):
+        self.name = name
+        self.description = description
+        self.create_world = create_world
+        self.frame_hook = frame_hook
+        # key script used instead of the default or --input one
+        self.script = script
+
+
+def transition_hook(world: BundledWorld, frame: int):
+    # walk onto a transition box twice a second
+    if frame % 30 == 0:
+        world.teleport_to_transition()
+
+
+SCENARIOS = {scenario.name: scenario for scenario in [
+    Scenario("bundled_idle", "bundled maps, standing still in the starting level", BundledWorld, script=[[1, []]]),
+    Scenario("bundled_walk", "bundled maps, walking around the starting level", BundledWorld),
+    Scenario("bundled_transitions", "bundled maps, level transition every 30 frames", BundledWorld, transition_hook),
+    Scenario("stress_tiles", "256x256 tile map with 10k collision boxes",
+             lambda: StressWorld(256, 256, 10000, 0)),
+    Scenario("stress_entities", "128x128 tile map with 2k collision boxes and 300 entities",
+             lambda: StressWorld(128, 128, 2000, 300)),
+    Scenario("stress_crowd", "128x128 tile map with 2k collision boxes and a crowd of 2000 entities",
+             lambda: StressWorld(128, 128, 2000, 0, crowd_count=2000)),
+    Scenario("stress_streaming", "512x512 tile map with 10k collision boxes streamed in chunks, walking diagonally",
+             lambda: StreamingWorld(512, 10000), script=[[1, ["d", "s"]]]),
+    Scenario("stress_navigation", "128x128 tile map with 2k collision boxes and 200 entities following paths",
+             lambda: StressWorld(128, 128, 2000, 0, navigating_count=200)),
+]}
+
+
+def run_scenario(scenario: Scenario, frames: int, script: list) -> dict:
+    script = scenario.script or script
+    setup_start = time.perf_counter()
+    world = scenario.create_world()
+    setup_time = time.perf_counter() - setup_start
+
+    world.player.set_input_source(ScriptedInput(script * (frames // sum(step[0] for step in script) + 1)).get_pressed)
+
+    timer = StageTimer()
+    timer.wrap(UpdateScheduler, "update", "update")
+    timer.wrap(Crowd, "update", "update")
+    timer.wrap(Crowd, "resolve_collisions", "collision")
+    timer.wrap(YSortCameraGroup, "custom_draw", "draw")
+    timer.wrap(Entity, "collision", "collision")
+    timer.wrap(Player, "collision", "collision")
+    timer.wrap(LevelHandler, "transition", "transition")
+    timer.wrap(Navigation, "update", "navigation")
+    timer.wrap(ChunkStreamer, "update", "streaming")
+    try:
+        for frame in range(frames):
+            pygame.event.pump()
+            if scenario.frame_hook:
+                scenario.frame_hook(world, frame)
+
+            start = time.perf_counter()
+            dirty_rects = world.run_frame()
+            present_start = time.perf_counter()
+            pygame.display.update(dirty_rects)
+            timer.add("present", time.perf_counter() - present_start)
+            timer.add("frame", time.perf_counter() - start)
+            timer.end_frame()
+    finally:
+        timer.restore()
+
+    result = {"description": scenario.description, "frames": frames, "setup_ms": round(setup_time * 1000, 2),
+              "stages": timer.summary()}
+    if hasattr(world, "get_counters"):
+        result["counters"] = world.get_counters()
+    if hasattr(world, "close"):
+        world.close()
+    return result
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """ Returns a description of every stage whose p50 or p90 is more than threshold slower than the baseline """
+    regressions = []
+    for scenario_name, scenario in results["scenarios"].items():
+        baseline_scenario = baseline["scenarios"].get(scenario_name)
+        if baseline_scenario is None:
+            continue
+
+        for stage, timings in scenario["stages"].items():
+            # stages added after the baseline was recorded
+            if stage not in baseline_scenario["stages"]:
+                continue
+
+            for percentile in ("p50", "p90"):
+                current, previous = timings[percentile], baseline_scenario["stages"][stage][percentile]
+                if current - previous > MIN_REGRESSION_MS and current > previous * (1 + threshold):
+                    regressions.append(f"{scenario_name} {stage} {percentile}: {previous:.3f} ms -> {current:.3f} ms")
+
+    return regressions
+
+
+def print_results(results: dict):
+    for scenario_name, scenario in results["scenarios"].items():
+        print(f"{scenario_name} ({scenario['frames']} frames, setup {scenario['setup_ms']:.1f} ms)")
+        for stage, timings in scenario["stages"].items():
+            print(f"    {stage:>10}: " + "  ".join(f"{key} {value:8.3f}" for key, value in timings.items()))
+        if "counters" in scenario:
+            print("    " + ", ".join(f"{name} {value}" for name, value in scenario["counters"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="defaults to all")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--input", metavar="SCRIPT", help="key script recorded with main.py --record-input")
+    parser.add_argument("--output", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against a stored result file")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before flagging")
+    parser.add_argument("--render-mode", choices=["incremental", "full", "native"],
+                        help="override INCREMENTAL_RENDERING and NATIVE_RESOLUTION_RENDERING to compare the renderers")
+    args = parser.parse_args()
+
+    if args.render_mode:
+        YSortCameraGroup.incremental = args.render_mode == "incremental"
+        YSortCameraGroup.native_resolution = args.render_mode == "native"
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    script = ScriptedInput.load_script(args.input) if args.input else DEFAULT_SCRIPT
+
+    results = {"python": platform.python_version(), "pygame": pygame.version.ver,
+               "incremental_rendering": YSortCameraGroup.incremental,
+               "native_resolution_rendering": YSortCameraGroup.native_resolution, "scenarios": {}}
+    for scenario_name in args.scenario or SCENARIOS:
+        results["scenarios"][scenario_name] = run_scenario(SCENARIOS[scenario_name], args.frames, script)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
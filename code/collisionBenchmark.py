@@ -0,0 +1,80 @@
+""" Compares the spatial hash broadphase used by Entity.collision against the original linear scan over every
+    obstacle. Run from the code directory:  python collisionBenchmark.py [--obstacles 10000]
+"""
+import os
+import argparse
+import random
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+from settings import *
+from entity import Entity
+from hitbox import HitBox
+from spatialHash import SpatialGroup
+
+
+class LinearGroup(pygame.sprite.Group):
+    """ Obstacle group with the original collision behaviour, every member is tested on every move """
+    def collisions(self, rect: pygame.Rect):
+        for sprite in self:
+            if sprite.rect.colliderect(rect):
+                yield sprite
+
+
+def create_obstacles(obstacle_count: int, map_size: int, seed: int) -> list[tuple[tuple[float, float], tuple[float, float]]]:
+    # positions and sizes are in tiled (unscaled) pixels, the same as the Collision_Objects layer
+    rng = random.Random(seed)
+    map_pixels = map_size * ORIGINAL_TILE_SIZE
+    return [((rng.uniform(0, map_pixels), rng.uniform(0, map_pixels)), (rng.uniform(2, 24), rng.uniform(2, 24)))
+            for _ in range(obstacle_count)]
+
+
+def run(obstacle_group: pygame.sprite.Group, obstacles: list, entity_count: int, moves: int, map_size: int,
+        seed: int) -> tuple[float, list[tuple[int, int]]]:
+    for position, size in obstacles:
+        HitBox(position, size, [obstacle_group])
+
+    rng = random.Random(seed)
+    map_pixels = map_size * TILE_SIZE
+    entities = [Entity((rng.uniform(0, map_pixels), rng.uniform(0, map_pixels)), TEST_PLAYER_IMAGE_FILE_PATH, [],
+                       obstacle_group) for _ in range(entity_count)]
+
+    directions = [(rng.choice([-1, 0, 1]), rng.choice([-1, 0, 1])) for _ in range(moves)]
+    start = time.perf_counter()
+    for direction in directions:
+        for entity in entities:
+            entity.direction.update(direction)
+            entity.move(entity.speed)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, [entity.rect.topleft for entity in entities]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--obstacles", type=int, default=10000)
+    parser.add_argument("--entities", type=int, default=20)
+    parser.add_argument("--moves", type=int, default=200)
+    parser.add_argument("--map-size", type=int, default=300, help="map width and height in tiles")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+
+    obstacles = create_obstacles(args.obstacles, args.map_size, args.seed)
+    results = {}
+    for name, group in [("linear scan", LinearGroup()), ("spatial hash", SpatialGroup())]:
+        elapsed, positions = run(group, obstacles, args.entities, args.moves, args.map_size, args.seed)
+        results[name] = positions
+        total_moves = args.entities * args.moves
+        print(f"{name:>12}: {elapsed * 1000:9.2f} ms total, {elapsed / total_moves * 1e6:9.2f} us per move")
+
+    identical = results["linear scan"] == results["spatial hash"]
+    print(f"final positions identical: {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+""" Entity system for large crowds of wandering non-player entities. Positions, directions, speeds and animation state
+    of every member live in NumPy arrays and are updated with batched array operations, only members on screen have
+    their sprite rect and image written back.
+
+    python crowd.py --bench [--entities 1000] [--frames 100]
+"""
+import os
+import time
+import random
+import argparse
+from typing import Optional
+
+import pygame
+import numpy as np
+from settings import *
+from spatialHash import SpatialGroup
+from assetManager import asset_manager
+from animation import animation_clock, get_animation_set
+from profiler import profiler
+
+# statuses set from the heading of a member, the same as the statuses used by the player
+HEADING_STATUSES = ["up", "down", "left", "right"]
+# cell keys pack the column into the high and the row into the low 32 bits
+CELL_ROW_OFFSET = 2 ** 31
+
+
+def round_half_away(values: np.ndarray) -> np.ndarray:
+    """ Rounds like assigning a float to a pygame.Rect attribute """
+    truncated = np.trunc(values)
+    return (truncated + np.sign(values) * (np.abs(values - truncated) >= 0.5)).astype(np.int64)
+
+
+def get_cell_keys(columns: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    return columns * 2 ** 32 + (rows + CELL_ROW_OFFSET)
+
+
+class CrowdMember(pygame.sprite.Sprite):
+    """ Drawable stand in for a crowd member, its rect and image are only kept up to date while it is on screen """
+    def __init__(self, image: pygame.Surface, pos: tuple[float, float], groups: list[pygame.sprite.Group],
+                 index: int):
+        self.image = image
+        self.rect = self.image.get_rect(topleft=pos)
+        super().__init__(groups)
+        self.index = index
+
+
+class ObstacleGrid:
+    """ Snapshot of a group of static collision boxes as arrays, bucketed into a uniform grid so each query only
+        tests the boxes sharing a cell with the queried rects. Boxes are kept in the insertion order of the group.
+    """
+    def __init__(self, rects: np.ndarray, cell_size: int = SPATIAL_HASH_CELL_SIZE):
+        """ rects is an (n, 4) array of (x, y, width, height) without zero sized rects """
+        self.cell_size = cell_size
+        rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+        self.left, self.top = rects[:, 0], rects[:, 1]
+        self.right, self.bottom = rects[:, 0] + rects[:, 2], rects[:, 1] + rects[:, 3]
+
+        # (cell, obstacle) pairs sorted by cell
+        obstacle_indexes, cell_keys = self.get_covered_cells(self.left, self.top, self.right, self.bottom)
+        order = np.argsort(cell_keys, kind="stable")
+        self.cell_obstacles = obstacle_indexes[order]
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(cell_keys[order], return_index=True,
+                                                                        return_counts=True)
+
+    @classmethod
+    def from_sprites(cls, obstacle_sprites: SpatialGroup, cell_size: int = SPATIAL_HASH_CELL_SIZE) -> "ObstacleGrid":
+        sprites = sorted(obstacle_sprites, key=obstacle_sprites.spatial_hash.get_order)
+        # zero sized rects never collide with anything
+        rects = [tuple(sprite.rect) for sprite in sprites if sprite.rect.width and sprite.rect.height]
+        return cls(np.array(rects, dtype=np.int64), cell_size)
+
+    @classmethod
+    def from_map_objects(cls, collision_objects, cell_size: int = SPATIAL_HASH_CELL_SIZE) -> "ObstacleGrid":
+        """ Grid of the collision boxes HitBox creates for the objects of a map's collision layer, in map order """
+        rects = [tuple(pygame.Rect((map_object.x * SCALE, map_object.y * SCALE),
+                                   (map_object.width * SCALE, map_object.height * SCALE)))
+                 for map_object in collision_objects]
+        return cls(np.array([rect for rect in rects if rect[2] and rect[3]], dtype=np.int64), cell_size)
+
+    def __len__(self) -> int:
+        return len(self.left)
+
+    def get_covered_cells(self, left: np.ndarray, top: np.ndarray, right: np.ndarray,
+                          bottom: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """ Returns (rect index, cell key) pairs for every cell each rect overlaps """
+        first_columns, first_rows = left // self.cell_size, top // self.cell_size
+        column_counts = np.maximum(right - 1, left) // self.cell_size - first_columns + 1
+        row_counts = np.maximum(bottom - 1, top) // self.cell_size - first_rows + 1
+
+        rect_indexes = np.repeat(np.arange(len(left)), column_counts * row_counts)
+        # position of every pair within the cells of its rect
+        pair_starts = np.cumsum(column_counts * row_counts) - column_counts * row_counts
+        local_indexes = np.arange(len(rect_indexes)) - pair_starts[rect_indexes]
+        columns = first_columns[rect_indexes] + local_indexes % column_counts[rect_indexes]
+        rows = first_rows[rect_indexes] + local_indexes // column_counts[rect_indexes]
+        return rect_indexes, get_cell_keys(columns, rows)
+
+    def first_collisions(self, left: np.ndarray, top: np.ndarray, right: np.ndarray, bottom: np.ndarray,
+                         after: np.ndarray) -> np.ndarray:
+        """ For every rect returns the index of the first obstacle after the given index colliding with it, or -1 """
+        first = np.full(len(left), len(self), dtype=np.int64)
+        if not len(self) or not len(left):
+            return np.full(len(left), -1, dtype=np.int64)
+
+        rect_indexes, cell_keys = self.get_covered_cells(left, top, right, bottom)
+        cells = np.searchsorted(self.cell_keys, cell_keys).clip(0, len(self.cell_keys) - 1)
+        found = self.cell_keys[cells] == cell_keys
+        rect_indexes, cells = rect_indexes[found], cells[found]
+
+        # expand to (rect, obstacle) candidate pairs
+        counts = self.cell_counts[cells]
+        pair_rects = np.repeat(rect_indexes, counts)
+        pair_starts = np.cumsum(counts) - counts
+        offsets = np.arange(len(pair_rects)) - np.repeat(pair_starts, counts)
+        pair_obstacles = self.cell_obstacles[np.repeat(self.cell_starts[cells], counts) + offsets]
+
+        # same test as pygame.Rect.colliderect
+        hits = (pair_obstacles > after[pair_rects]) & \
+               (left[pair_rects] < self.right[pair_obstacles]) & (right[pair_rects] > self.left[pair_obstacles]) & \
+               (top[pair_rects] < self.bottom[pair_obstacles]) & (bottom[pair_rects] > self.top[pair_obstacles])
+        np.minimum.at(first, pair_rects[hits], pair_obstacles[hits])
+        first[first == len(self)] = -1
+        return first
+
+
+class CrowdSimulation:
+    """ Logical state of a crowd: positions, directions, speeds, statuses and turn timers in arrays, and the obstacles
+        they collide with. Has no sprites or surfaces so it can be stepped in another process (see
+        offscreenSimulation.py). Statuses are indexes into the status table of the crowd.
+    """
+    # arrays copied by get_state and set_state
+    STATE_ARRAYS = ["x", "y", "width", "height", "direction", "speed", "status", "frames_until_turn"]
+
+    def __init__(self, obstacle_grid: ObstacleGrid, idle_statuses: np.ndarray, heading_statuses: np.ndarray,
+                 speed: float = 6, seed: int = 0):
+        self.obstacle_grid = obstacle_grid
+        self.idle_statuses = idle_statuses
+        self.heading_statuses = heading_statuses
+        self.default_speed = speed
+        self.rng = np.random.default_rng(seed)
+
+        self.x = np.zeros(0, dtype=np.int64)
+        self.y = np.zeros(0, dtype=np.int64)
+        self.width = np.zeros(0, dtype=np.int64)
+        self.height = np.zeros(0, dtype=np.int64)
+        self.direction = np.zeros((0, 2), dtype=np.float64)
+        self.speed = np.zeros(0, dtype=np.float64)
+        self.status = np.zeros(0, dtype=np.int64)
+        self.frames_until_turn = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def get_state(self) -> dict:
+        state = {name: getattr(self, name).copy() for name in self.STATE_ARRAYS}
+        state["rng"] = self.rng.bit_generator.state
+        return state
+
+    def set_state(self, state: dict):
+        for name in self.STATE_ARRAYS:
+            setattr(self, name, state[name].copy())
+        self.rng.bit_generator.state = state["rng"]
+
+    def set_directions(self, directions: np.ndarray, indexes: Optional[np.ndarray] = None):
+        """ Sets the direction of members and faces them in it, members that stop keep their status """
+        indexes = np.arange(len(self)) if indexes is None else np.asarray(indexes)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 2)
+        self.direction[indexes] = directions
+
+        # horizontal headings win over vertical ones
+        heading = np.where(directions[:, 0] > 0, 3, np.where(directions[:, 0] < 0, 2,
+                                                             np.where(directions[:, 1] > 0, 1, 0)))
+        moving = np.any(directions != 0, axis=1)
+        self.status[indexes[moving]] = self.heading_statuses[heading[moving]]
+
+    def wander(self, scale: int = 1):
+        """ Every member picks a new random direction every 15 to 60 frames, a step scale frames long counts as scale
+            frames
+        """
+        turning = np.flatnonzero(self.frames_until_turn <= 0)
+        if len(turning):
+            self.set_directions(self.rng.integers(-1, 2, size=(len(turning), 2)), turning)
+            self.frames_until_turn[turning] = self.rng.integers(15, 61, size=len(turning))
+        self.frames_until_turn -= scale
+
+    def update_idle_statuses(self):
+        # idle status, the same as Entity.get_status
+        stopped = ~np.any(self.direction != 0, axis=1)
+        self.status[stopped] = self.idle_statuses[self.status[stopped]]
+
+    def resolve_collisions(self, axis: int):
+        """ Pushes every member moving along axis out of the obstacles it overlaps, one obstacle at a time in group
+            order like Entity.collision
+        """
+        position, size = (self.x, self.width) if axis == 0 else (self.y, self.height)
+        active = np.flatnonzero(self.direction[:, axis] != 0)
+        last_obstacle = np.full(len(active), -1, dtype=np.int64)
+        obstacle_start, obstacle_end = (self.obstacle_grid.left, self.obstacle_grid.right) if axis == 0 else \
+            (self.obstacle_grid.top, self.obstacle_grid.bottom)
+
+        while len(active):
+            x, y = self.x[active], self.y[active]
+            hits = self.obstacle_grid.first_collisions(x, y, x + self.width[active], y + self.height[active],
+                                                       last_obstacle)
+            colliding = hits >= 0
+            active, hits = active[colliding], hits[colliding]
+
+            # moving right or down snaps to the start of the obstacle, left or up to its end
+            forward = self.direction[active, axis] > 0
+            position[active] = np.where(forward, obstacle_start[hits] - size[active], obstacle_end[hits])
+            last_obstacle = hits
+
+    def move(self, scale: int = 1):
+        """ Moves every member by scale steps at once, larger scales trade collision accuracy for fewer steps """
+        # normalise the direction vectors so diagonal speeds have a magnitude of 1, the same as Vector2.normalize
+        length = np.sqrt(self.direction[:, 0] * self.direction[:, 0] + self.direction[:, 1] * self.direction[:, 1])
+        moving = length != 0
+        self.direction[moving] /= length[moving, None]
+
+        self.x += round_half_away(self.direction[:, 0] * self.speed * scale)
+        with profiler.scope("collision"):
+            self.resolve_collisions(0)
+
+        self.y += round_half_away(self.direction[:, 1] * self.speed * scale)
+        with profiler.scope("collision"):
+            self.resolve_collisions(1)
+
+    def step(self, scale: int = 1):
+        """ One simulation step without animation, the same as Crowd.update for off-screen crowds """
+        self.wander(scale)
+        self.update_idle_statuses()
+        self.move(scale)
+
+
+class Crowd(CrowdSimulation):
+    """ Moves, animates and resolves collisions for all of its members at once with the same results as calling
+        Entity.update on each of them. Members share one animation set whose frames all have the member size.
+    """
+    def __init__(self, obstacle_sprites: SpatialGroup, groups: list[pygame.sprite.Group],
+                 animations_path: str = PLAYER_IMAGES_FILE_PATH, speed: float = 6,
+                 frame_duration: int = ANIMATION_FRAME_DURATION, seed: int = 0,
+                 obstacle_grid: Optional[ObstacleGrid] = None):
+        """ obstacle_grid replaces the grid built from obstacle_sprites, e.g. for levels that only hold part of their
+            obstacles in the group
+        """
+        self.groups = groups
+        self.obstacle_sprites = obstacle_sprites
+
+        # statuses are stored as indexes into self.statuses
+        self.animations = asset_manager.get_animations(animations_path, (TILE_SIZE, TILE_SIZE))
+        self.animation_set = get_animation_set(animations_path, (TILE_SIZE, TILE_SIZE), frame_duration)
+        self.statuses = list(self.animations)
+        # frame index shown at every step of the loop of each status, -1 for statuses without frames
+        self.step_table, self.loop_lengths = self.animation_set.get_step_table(self.statuses)
+        super().__init__(obstacle_grid if obstacle_grid is not None else ObstacleGrid.from_sprites(obstacle_sprites),
+                         np.array([self.get_idle_status(status) for status in self.statuses]),
+                         np.array([self.statuses.index(status) for status in HEADING_STATUSES]), speed, seed)
+
+        self.members = []
+        # animation start on the shared animation clock and the frame currently shown
+        self.animation_start = np.zeros(0, dtype=np.int64)
+        self.frame_index = np.zeros(0, dtype=np.int64)
+        # position each member sprite was last written back at
+        self.sprite_x = np.zeros(0, dtype=np.int64)
+        self.sprite_y = np.zeros(0, dtype=np.int64)
+
+    def get_idle_status(self, status: str) -> int:
+        # same as Entity.get_status
+        if all(word not in status for word in ["idle", "attack"]):
+            status += "_idle"
+        return self.statuses.index(status)
+
+    def add(self, positions: list[tuple[float, float]], status: str = "down") -> list[CrowdMember]:
+        table = self.animation_set.get_table(status)
+        image = table.frames[0] if table is not None else pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
+        start = len(self.members)
+        new_members = [CrowdMember(image, position, self.groups, index)
+                       for index, position in enumerate(positions, start=start)]
+        self.members.extend(new_members)
+
+        count = len(new_members)
+        self.x = np.concatenate([self.x, [member.rect.x for member in new_members]]).astype(np.int64)
+        self.y = np.concatenate([self.y, [member.rect.y for member in new_members]]).astype(np.int64)
+        self.width = np.concatenate([self.width, [member.rect.width for member in new_members]]).astype(np.int64)
+        self.height = np.concatenate([self.height, [member.rect.height for member in new_members]]).astype(np.int64)
+        self.direction = np.concatenate([self.direction, np.zeros((count, 2))])
+        self.speed = np.concatenate([self.speed, np.full(count, self.default_speed, dtype=np.float64)])
+        self.animation_start = np.concatenate([self.animation_start, np.full(count, animation_clock.time)])
+        self.frame_index = np.concatenate([self.frame_index, np.zeros(count, dtype=np.int64)])
+        self.status = np.concatenate([self.status, np.full(count, self.statuses.index(status))]).astype(np.int64)
+        self.frames_until_turn = np.concatenate([self.frames_until_turn, np.zeros(count, dtype=np.int64)])
+        self.sprite_x, self.sprite_y = self.x.copy(), self.y.copy()
+        return new_members
+
+    def rebuild_obstacles(self):
+        """ Must be called when the obstacle group changes """
+        self.obstacle_grid = ObstacleGrid.from_sprites(self.obstacle_sprites)
+
+    def animate(self):
+        self.update_idle_statuses()
+        self.update_frame_indexes()
+
+    def update_frame_indexes(self):
+        """ Looks up the frame every member shows at the current time of the animation clock """
+        elapsed = animation_clock.time - self.animation_start
+        self.frame_index = self.step_table[self.status, elapsed % self.loop_lengths[self.status]]
+
+    def write_back(self, view_rect: Optional[pygame.Rect] = None):
+        """ Copies the position and animation frame of the members inside view_rect (every member if it is None) to
+            their sprites. Members whose out of date sprite is inside view_rect are written back as well so that no
+            stale sprite is drawn.
+        """
+        if view_rect is None:
+            indexes = np.arange(len(self))
+        else:
+            view = pygame.Rect(view_rect)
+            inside = (self.x < view.right) & (self.x + self.width > view.left) & \
+                     (self.y < view.bottom) & (self.y + self.height > view.top)
+            sprite_inside = (self.sprite_x < view.right) & (self.sprite_x + self.width > view.left) & \
+                            (self.sprite_y < view.bottom) & (self.sprite_y + self.height > view.top)
+            indexes = np.flatnonzero(inside | sprite_inside)
+
+        self.sprite_x[indexes], self.sprite_y[indexes] = self.x[indexes], self.y[indexes]
+        for index in indexes.tolist():
+            member = self.members[index]
+            # members whose status has no frames keep their image
+            frame_index = self.frame_index[index]
+            if frame_index >= 0:
+                member.image = self.animations[self.statuses[self.status[index]]][frame_index]
+            member.rect.topleft = (int(self.x[index]), int(self.y[index]))
+
+    def update(self, view_rect: Optional[pygame.Rect] = None):
+        with profiler.scope("input"):
+            self.wander()
+
+        with profiler.scope("animation"):
+            self.animate()
+
+        with profiler.scope("movement"):
+            self.move()
+
+        self.write_back(view_rect)
+
+
+def create_world(entity_count: int, obstacle_count: int, map_size: int, seed: int):
+    from hitbox import HitBox
+    from collisionBenchmark import create_obstacles
+
+    obstacle_sprites = SpatialGroup()
+    for position, size in create_obstacles(obstacle_count, map_size, seed):
+        HitBox(position, size, [obstacle_sprites])
+
+    rng = random.Random(seed)
+    map_pixels = map_size * TILE_SIZE
+    positions = [(rng.uniform(0, map_pixels), rng.uniform(0, map_pixels)) for _ in range(entity_count)]
+    return obstacle_sprites, positions
+
+
+def bench(entity_count: int, frames: int, obstacle_count: int, map_size: int, seed: int):
+    from entity import Entity
+
+    obstacle_sprites, positions = create_world(entity_count, obstacle_count, map_size, seed)
+    crowd = Crowd(obstacle_sprites, [], seed=seed)
+    crowd.add(positions)
+    entities = [Entity(position, TEST_PLAYER_IMAGE_FILE_PATH, [], obstacle_sprites) for position in positions]
+    view_rect = pygame.Rect(0, 0, WIDTH, HEIGHT)
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        animation_clock.tick()
+        for entity in entities:
+            entity.direction.update(random.choice([-1, 0, 1]), random.choice([-1, 0, 1]))
+            entity.get_status()
+            entity.animate()
+            entity.move(entity.speed)
+    entity_time = (time.perf_counter() - start) / frames
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        animation_clock.tick()
+        crowd.update(view_rect)
+    crowd_time = (time.perf_counter() - start) / frames
+
+    print(f"{entity_count} entities, {obstacle_count} obstacles")
+    print(f"    Entity.update: {entity_time * 1000:8.3f} ms per frame")
+    print(f"     Crowd.update: {crowd_time * 1000:8.3f} ms per frame ({entity_time / crowd_time:.1f}x)")
+
+
+def main():
+    # only the command line tools default to no window, the game imports this module
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--bench", action="store_true")
+    parser.add_argument("--entities", type=int, default=1000)
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--obstacles", type=int, default=2000)
+    parser.add_argument("--map-size", type=int, default=64, help="map width and height in tiles")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    bench(args.entities, args.frames, args.obstacles, args.map_size, args.seed)
+
+
+if __name__ == "__main__":
+    main()
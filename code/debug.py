@@ -1,12 +1,56 @@
 import pygame
+from settings import FPS, TICK_RATE
 
-pygame.init()
-font = pygame.font.Font(None, 30)
+# created the first time something is drawn, loading the font is one of the slower parts of starting up
+font = None
+
+
+def get_font() -> pygame.font.Font:
+    global font
+    if font is None:
+        pygame.font.init()
+        font = pygame.font.Font(None, 30)
+    return font
 
 
 def debug(info, x=10, y=10):
     display_surface = pygame.display.get_surface()
-    debug_surf = font.render(str(info), True, "White")
+    debug_surf = get_font().render(str(info), True, "White")
     debug_rect = debug_surf.get_rect(topleft=(x, y))
     pygame.draw.rect(display_surface, "Black", debug_rect)
     display_surface.blit(debug_surf, debug_rect)
+    return debug_rect
+
+
+def debug_overlay(profiler, sprite_counts: dict[str, int], x=10, y=10, graph_height=60):
+    """ Draws the profiler statistics and a graph of the recent frame times, returns the area drawn over """
+    line_height = get_font().get_linesize()
+    slowest_stage, slowest_time = profiler.get_slowest_stage()
+    lines = [
+        f"FPS {profiler.get_fps():.1f}  frame {profiler.frame_times.last():.2f} ms "
+        f"(avg {profiler.frame_times.mean():.2f} ms)",
+        f"blits {int(profiler.counters['blits'].last())}  slowest stage {slowest_stage} {slowest_time:.2f} ms",
+        f"updated near {int(profiler.counters['updated near'].last())}  "
+        f"far {int(profiler.counters['updated far'].last())}  asleep {int(profiler.counters['asleep'].last())}",
+        "  ".join(f"{name} {count}" for name, count in sprite_counts.items())
+    ]
+    overlay_rect = pygame.Rect(x, y, 0, 0)
+    for index, line in enumerate(lines):
+        overlay_rect.union_ip(debug(line, x, y + index * line_height))
+
+    # frame time graph, the white line marks the frame budget: the render rate cap, or one simulation step when the
+    # render rate is uncapped
+    display_surface = pygame.display.get_surface()
+    graph_rect = pygame.Rect(x, y + len(lines) * line_height, profiler.history, graph_height)
+    frame_budget = 1000 / (FPS or TICK_RATE)
+    ms_per_pixel = 2 * frame_budget / graph_height
+    pygame.draw.rect(display_surface, "Black", graph_rect)
+    for column, frame_time in enumerate(profiler.frame_times):
+        bar_height = min(graph_height, int(frame_time / ms_per_pixel))
+        colour = "Green" if frame_time <= frame_budget else "Red"
+        pygame.draw.line(display_surface, colour, (graph_rect.left + column, graph_rect.bottom - 1),
+                         (graph_rect.left + column, graph_rect.bottom - bar_height))
+
+    budget_y = graph_rect.bottom - int(frame_budget / ms_per_pixel)
+    pygame.draw.line(display_surface, "White", (graph_rect.left, budget_y), (graph_rect.right, budget_y))
+    return overlay_rect.union(graph_rect)
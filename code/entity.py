@@ -1,25 +1,28 @@
 import os
 import pygame
 from settings import *
-from collections import defaultdict
+from collections import deque
 from utils import get_spawn_point_object_data, get_spawn_point_id
 from spawnPoint import SpawnPoint
+from spatialHash import SpatialGroup
+from assetManager import asset_manager
+from animation import AnimationController, get_animation_set
+from profiler import profiler
+from eventBus import event_bus, ENTITY_MOVED, COLLISION, EntityMoved, Collision
 
 
 class Entity(pygame.sprite.Sprite):
     def __init__(self, pos: tuple[float, float], image_path: str, groups: list[pygame.sprite.Sprite],
-                 obstacle_sprites: pygame.sprite.Group):
+                 obstacle_sprites: SpatialGroup):
 
         super().__init__(groups)
-        # player sprite
-        self.image = pygame.image.load(image_path).convert_alpha()
-        # scale image to match screen size
-        self.image = pygame.transform.scale(self.image, (TILE_SIZE, TILE_SIZE))
+        # player sprite, scaled to match screen size and shared with every entity using the same image
+        self.image = asset_manager.get_image(image_path, (TILE_SIZE, TILE_SIZE))
         self.rect = self.image.get_rect(topleft=pos)
 
         # general setup
-        self.animations = defaultdict(lambda: [])
         self.import_assets()
+        self.animation = AnimationController(self.animation_set)
         self.status = "down"  # status keeps track of the current action and direction of the player
         self.display_surface = pygame.display.get_surface()
 
@@ -30,21 +33,19 @@ class Entity(pygame.sprite.Sprite):
         # movement
         self.direction = pygame.math.Vector2()
         self.speed = 6
-        self.frame_index = 0
-        self.animation_speed = 0.15
 
-        # collisions
+        # collisions, and the obstacles hit on each axis during the last move so only new collisions are published
         self.obstacle_sprites = obstacle_sprites
+        self.touching_obstacles = {"horizontal": set(), "vertical": set()}
+
+        # navigation, world positions to walk through in order
+        self.path = deque()
+        # simulation steps covered by the current update, more than one for entities far from the camera
+        self.update_steps = 1
 
     def import_assets(self):
-        for folder in os.listdir(PLAYER_IMAGES_FILE_PATH):
-            folder_path = os.path.join(PLAYER_IMAGES_FILE_PATH, folder)
-            for image in os.listdir(folder_path):
-                image_path = os.path.join(folder_path, image)
-                surf = pygame.image.load(image_path).convert_alpha()
-                # scale player image up to fit map size
-                surf = pygame.transform.scale(surf, (TILE_SIZE, TILE_SIZE))
-                self.animations[folder].append(surf)
+        # animation frames are loaded and scaled up to fit map size once, then shared between entities
+        self.animation_set = get_animation_set(PLAYER_IMAGES_FILE_PATH, (TILE_SIZE, TILE_SIZE))
 
     def get_status(self):
         # idle status
@@ -53,6 +54,8 @@ class Entity(pygame.sprite.Sprite):
             self.status += "_idle"
 
     def move(self, speed: float):
+        previous_position = self.rect.topleft
+
         # normalise the direction vector so both diagonal speeds always have a magnitude of 1
         if self.direction.magnitude() != 0: self.direction = self.direction.normalize()
 
@@ -68,42 +71,96 @@ class Entity(pygame.sprite.Sprite):
         # check for vertical collision
         self.collision("vertical")
 
+        if self.rect.topleft != previous_position and event_bus.has_subscribers(ENTITY_MOVED):
+            event_bus.publish(ENTITY_MOVED, EntityMoved(self, previous_position, self.rect.topleft))
+
+    def move_steps(self, steps: int):
+        """ Moves as far as in steps simulation steps, in moves no longer than the entity so it cannot pass through
+            an obstacle
+        """
+        distance = self.speed * steps
+        max_distance = min(self.rect.size)
+        while distance > max_distance:
+            self.move(max_distance)
+            distance -= max_distance
+        self.move(distance)
+
+    def set_path(self, path: list[tuple[float, float]]):
+        self.path = deque(path)
+
+    def follow_path(self):
+        """ Points the entity at the next waypoint of its path, waypoints within one step are skipped """
+        while self.path and pygame.math.Vector2(self.path[0]).distance_to(self.rect.center) <= \
+                self.speed * self.update_steps:
+            self.path.popleft()
+
+        if not self.path:
+            self.direction.update(0, 0)
+            return
+
+        self.direction.update(self.path[0][0] - self.rect.centerx, self.path[0][1] - self.rect.centery)
+        if abs(self.direction.x) >= abs(self.direction.y):
+            self.status = "right" if self.direction.x > 0 else "left"
+        else:
+            self.status = "down" if self.direction.y > 0 else "up"
+
     def collision(self, direction: str):
+        # only the obstacles sharing a spatial hash cell with the entity are tested
         def horizontal_collision():
-            for sprite in self.obstacle_sprites:
-                if sprite.rect.colliderect(self.rect):
-                    # player moving to the right
-                    if self.direction.x > 0: self.rect.right = sprite.rect.left
+            for sprite in self.obstacle_sprites.collisions(self.rect):
+                obstacles_hit.append(sprite)
+
+                # player moving to the right
+                if self.direction.x > 0: self.rect.right = sprite.rect.left
 
-                    # player moving to the left
-                    if self.direction.x < 0: self.rect.left = sprite.rect.right
+                # player moving to the left
+                if self.direction.x < 0: self.rect.left = sprite.rect.right
 
         def vertical_collision():
-            for sprite in self.obstacle_sprites:
-                if sprite.rect.colliderect(self.rect):
-                    # player moving to the down
-                    if self.direction.y > 0: self.rect.bottom = sprite.rect.top
+            for sprite in self.obstacle_sprites.collisions(self.rect):
+                obstacles_hit.append(sprite)
 
-                    # player moving to the up
-                    if self.direction.y < 0: self.rect.top = sprite.rect.bottom
+                # player moving to the down
+                if self.direction.y > 0: self.rect.bottom = sprite.rect.top
 
-        collision_type_map = {"horizontal": horizontal_collision, "vertical": vertical_collision}
+                # player moving to the up
+                if self.direction.y < 0: self.rect.top = sprite.rect.bottom
 
-        collision_type_map[direction]()
+        collision_type_map = {"horizontal": horizontal_collision, "vertical": vertical_collision}
+        obstacles_hit = []
 
-    def animate(self):
-        animation = self.animations[self.status]
+        with profiler.scope("collision"):
+            collision_type_map[direction]()
 
-        # loop over frame index
-        self.frame_index += self.animation_speed
-        if self.frame_index >= len(animation): self.frame_index = 0
+        if event_bus.has_subscribers(COLLISION):
+            self.publish_collisions(direction, obstacles_hit)
 
-        # change the current player image
-        self.image = animation[int(self.frame_index)]
-        self.rect = self.image.get_rect(center=self.rect.center)
+    def publish_collisions(self, direction: str, obstacles_hit: list[pygame.sprite.Sprite]):
+        """ Publishes the obstacles that were not already hit on the same axis during the previous move """
+        touching_obstacles = self.touching_obstacles[direction]
+        for obstacle in obstacles_hit:
+            if obstacle not in touching_obstacles:
+                event_bus.publish(COLLISION, Collision(self, obstacle, direction))
+        self.touching_obstacles[direction] = set(obstacles_hit)
 
-    def update(self):
-        self.input()
-        self.get_status()
-        self.animate()
-        self.move(self.speed)
+    def animate(self):
+        # the image and rect only change when the frame shown changes
+        image = self.animation.update(self.status)
+        if image is not None:
+            self.image = image
+            self.rect = self.image.get_rect(center=self.rect.center)
+
+    def update(self, steps: int = 1):
+        """ Advances the entity by steps simulation steps, the update scheduler updates distant entities less often.
+            Animations follow the shared clock so they catch up on their own.
+        """
+        self.update_steps = steps
+        with profiler.scope("input"):
+            self.input()
+            self.get_status()
+
+        with profiler.scope("animation"):
+            self.animate()
+
+        with profiler.scope("movement"):
+            self.move_steps(steps)
@@ -0,0 +1,85 @@
+from collections import deque
+from typing import Any, Callable, NamedTuple, Optional
+
+LEVEL_CHANGED = "level_changed"
+ENTITY_MOVED = "entity_moved"
+COLLISION = "collision"
+WAKE_ENTITY = "wake_entity"
+
+
+class LevelChanged(NamedTuple):
+    player: Any
+    previous_level_code: int
+    level_code: int
+    spawn_point_id: Optional[int]
+
+
+class EntityMoved(NamedTuple):
+    entity: Any
+    previous_position: tuple[int, int]
+    position: tuple[int, int]
+
+
+class Collision(NamedTuple):
+    entity: Any
+    obstacle: Any
+    direction: str
+
+
+class WakeEntity(NamedTuple):
+    entity: Any
+
+
+# event type published on each built-in topic, other topics (e.g. the ones of Observable adapters) are untyped
+TOPIC_TYPES = {LEVEL_CHANGED: LevelChanged, ENTITY_MOVED: EntityMoved, COLLISION: Collision, WAKE_ENTITY: WakeEntity}
+
+
+class EventBus:
+    """ Topic based publish/subscribe. Published events are queued and delivered in one batch by dispatch, events
+        published while dispatching are delivered by the next dispatch. Subscribers are kept in insertion ordered
+        dicts keyed by their callback so subscribing and unsubscribing are O(1).
+    """
+    def __init__(self):
+        self.subscribers = {}
+        self.queue = deque()
+
+    def subscribe(self, topic: str, callback: Callable):
+        self.subscribers.setdefault(topic, {})[callback] = None
+
+    def unsubscribe(self, topic: str, callback: Callable):
+        topic_subscribers = self.subscribers.get(topic)
+        if topic_subscribers is not None:
+            topic_subscribers.pop(callback, None)
+
+    def remove_topic(self, topic: str):
+        """ Unsubscribes every subscriber of a topic """
+        self.subscribers.pop(topic, None)
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self.subscribers.get(topic))
+
+    def publish(self, topic: str, event=None):
+        event_type = TOPIC_TYPES.get(topic)
+        if event_type is not None and not isinstance(event, event_type):
+            raise TypeError(f"'{topic}' events must be {event_type.__name__}, got {type(event).__name__}")
+
+        # nobody is listening, so there is nothing to queue
+        if self.subscribers.get(topic):
+            self.queue.append((topic, event))
+
+    def dispatch(self) -> int:
+        """ Delivers the queued events in the order they were published, returns the number delivered """
+        count = len(self.queue)
+        for _ in range(count):
+            topic, event = self.queue.popleft()
+            # callbacks may unsubscribe while the event is delivered
+            for callback in tuple(self.subscribers.get(topic, ())):
+                callback(event)
+
+        return count
+
+    def clear(self):
+        self.queue.clear()
+
+
+event_bus = EventBus()
@@ -0,0 +1,425 @@
+""" Reloads edited maps, tilesets and the transition mapping while the game runs (main.py --hot-reload). The new map
+    is compared with the loaded Level layer by layer and object by object and only what changed is rebuilt, the player
+    stays in its level at its position.
+
+    python hotReload.py --bench [--map NAME] [--repeat N]   times reloading a copy of a map after one tile edits
+"""
+import os
+import time
+import warnings
+import base64
+import shutil
+import zlib
+import argparse
+import tempfile
+from functools import partial
+from statistics import median
+from typing import Callable, Optional
+from xml.etree import ElementTree
+
+import pygame
+import numpy as np
+from settings import *
+from tile import Tile
+from tileLayer import TileLayer
+from hitbox import HitBox
+from transitionBox import TransitionBox
+from spawnPoint import SpawnPoint
+from level import Level
+from worldStreamer import StreamedLevel
+from mapLoader import load_map, get_map_sources
+from assetManager import asset_manager
+from transitionRegistry import get_transition_registry
+from profiler import profiler
+
+
+def get_object_rect(position: tuple[float, float], size: tuple[float, float]) -> tuple[int, int, int, int]:
+    """ Rect of the HitBox created for a map object """
+    return tuple(pygame.Rect(tuple(coord * SCALE for coord in position),
+                             tuple(dimension * SCALE for dimension in size)))
+
+
+def update_objects(group: pygame.sprite.AbstractGroup, get_key: Callable, new_objects: list[tuple[tuple, Callable]]) \
+        -> int:
+    """ Kills the sprites of a group whose key is not among the (key, create sprite) pairs of new_objects and creates
+        the sprites missing from the group. Keys are compared as a multiset so duplicated objects are kept. Returns the
+        number of sprites killed and created.
+    """
+    missing = {}
+    for key, create in new_objects:
+        missing.setdefault(key, []).append(create)
+
+    changes = 0
+    for sprite in list(group):
+        creators = missing.get(get_key(sprite))
+        if creators:
+            creators.pop()
+        else:
+            sprite.kill()
+            changes += 1
+
+    for creators in missing.values():
+        for create in creators:
+            create()
+            changes += 1
+
+    return changes
+
+
+def reload_objects(level: Level, map_data) -> dict[str, int]:
+    collision_objects = [(get_object_rect((map_object.x, map_object.y), (map_object.width, map_object.height)),
+                          partial(HitBox, (map_object.x, map_object.y), (map_object.width, map_object.height),
+                                  [level.obstacle_sprites]))
+                         for map_object in map_data.get_layer_by_name("Collision_Objects")]
+    transition_objects = [((get_object_rect((map_object.x, map_object.y), (map_object.width, map_object.height)),
+                            map_object.transition_code),
+                           partial(TransitionBox, (map_object.x, map_object.y), (map_object.width, map_object.height),
+                                   [level.transition_sprites], map_object.transition_code))
+                          for map_object in map_data.get_layer_by_name("Transition_Objects")]
+    spawn_points = [((get_object_rect((map_object.x, map_object.y), (1, 1)), map_object.id),
+                     partial(SpawnPoint, (map_object.x, map_object.y), [level.spawn_points], map_object.id))
+                    for map_object in map_data.get_layer_by_name("Spawn_Points")]
+
+    return {"Collision_Objects": update_objects(level.obstacle_sprites, lambda sprite: tuple(sprite.rect),
+                                                collision_objects),
+            "Transition_Objects": update_objects(level.transition_sprites,
+                                                 lambda sprite: (tuple(sprite.rect), sprite.transition_code),
+                                                 transition_objects),
+            "Spawn_Points": update_objects(level.spawn_points,
+                                           lambda sprite: (tuple(sprite.rect), sprite.spawn_point_id), spawn_points)}
+
+
+def get_surface_tokens(surfaces: list[Optional[pygame.Surface]], tokens: dict[int, int]) -> np.ndarray:
+    """ Number of every surface of a surface table, the same surface has the same number in every table numbered
+        with the same tokens dict and empty entries are -1
+    """
+    return np.array([tokens.setdefault(id(surface), len(tokens)) if surface is not None else -1
+                     for surface in surfaces], dtype=np.int64)
+
+
+def reload_floor_layers(level: Level, map_data, surfaces: list[Optional[pygame.Surface]]) -> dict[str, int]:
+    """ Takes the tile ids of the new map and drops the cached floor chunks around the tiles that look different. The
+        ids of the two maps index different surface tables, so the surfaces they draw are compared instead.
+    """
+    new_layers = [TileLayer.from_map_layer(layer, surfaces) for layer in map_data.visible_layers
+                  if hasattr(layer, "data") and layer.name in FLOOR_LAYERS]
+    old_layers = level.floor_layers
+    group = level.visible_sprites
+    if [(layer.name, layer.tile_ids.shape) for layer in old_layers] != \
+            [(layer.name, layer.tile_ids.shape) for layer in new_layers]:
+        # layers were added, removed or resized
+        level.floor_layers = new_layers
+        group.set_floor_layers(new_layers, bake=True)
+        return {layer.name: len(layer) for layer in old_layers + new_layers}
+
+    tokens = {}
+    old_tokens, new_tokens = get_surface_tokens(level.tile_surfaces, tokens), get_surface_tokens(surfaces, tokens)
+    changes = {}
+    # bounding rect of the changed tiles in each floor chunk
+    chunk_rects = {}
+    for old_layer, new_layer in zip(old_layers, new_layers):
+        rows, columns = np.nonzero(old_tokens[old_layer.tile_ids] != new_tokens[new_layer.tile_ids])
+        changes[old_layer.name] = len(rows)
+        for column, row in zip(columns.tolist(), rows.tolist()):
+            tile_rect = pygame.Rect(column * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+            chunk_position = (tile_rect.x // group.chunk_size, tile_rect.y // group.chunk_size)
+            chunk_rects[chunk_position] = chunk_rects.get(chunk_position, tile_rect).union(tile_rect)
+
+        # the layer objects are kept, the camera group holds them
+        old_layer.tile_ids, old_layer.surfaces = new_layer.tile_ids, new_layer.surfaces
+
+    for rect in chunk_rects.values():
+        group.invalidate_floor(rect)
+    return changes
+
+
+def reload_tile_sprites(level: Level, map_data) -> dict[str, int]:
+    """ Replaces the Tile sprites whose image changed, creates the new ones and kills the removed ones. Tiles keep the
+        drawing order of their layer: a replaced tile takes the order of the tile it replaces and new tiles are
+        ordered after the rest of their layer and before the layers above it.
+    """
+    group = level.visible_sprites
+    old_tiles = {}
+    for sprite in group:
+        if isinstance(sprite, Tile):
+            old_tiles.setdefault(sprite.tiled_layer, {})[sprite.rect.topleft] = sprite
+
+    layers = [layer for layer in map_data.visible_layers if hasattr(layer, "data") and layer.name not in FLOOR_LAYERS]
+    layer_orders = {name: [group.get_order(tile) for tile in tiles.values()] for name, tiles in old_tiles.items()}
+    changes = {}
+    for index, layer in enumerate(layers):
+        tiles = old_tiles.pop(layer.name, {})
+        low = max((order for below in layers[:index + 1] for order in layer_orders.get(below.name, ())), default=-1)
+        # below the sprites added after the map as well
+        high = min([order for above in layers[index + 1:] for order in layer_orders.get(above.name, ()) if order > low]
+                   + [low + 1])
+
+        added_tiles = []
+        changes[layer.name] = 0
+        for x, y, surf in layer.tiles():
+            position = (x * TILE_SIZE, y * TILE_SIZE)
+            old_tile = tiles.pop(position, None)
+            image = asset_manager.get_scaled_surface(surf, (TILE_SIZE, TILE_SIZE))
+            if old_tile is not None and old_tile.image is image:
+                continue
+
+            tile = Tile(position, surf, [group], layer.name)
+            if old_tile is not None:
+                group.set_order(tile, group.get_order(old_tile))
+                old_tile.kill()
+            else:
+                added_tiles.append(tile)
+            changes[layer.name] += 1
+
+        for number, tile in enumerate(added_tiles, start=1):
+            group.set_order(tile, low + (high - low) * number / (len(added_tiles) + 1))
+
+        # tiles erased from the layer
+        for old_tile in tiles.values():
+            old_tile.kill()
+        changes[layer.name] += len(tiles)
+
+    # layers removed from the map or hidden
+    for name, tiles in old_tiles.items():
+        for old_tile in tiles.values():
+            old_tile.kill()
+        changes[name] = len(tiles)
+
+    return changes
+
+
+def reload_level(level: Level, map_data=None) -> dict[str, int]:
+    """ Brings a level up to date with its map file (or with map_data), returns the number of tiles and objects
+        changed in each layer that changed
+    """
+    if map_data is None:
+        map_data = load_map(level.map_path)
+
+    surfaces = TileLayer.create_surface_table(map_data.images)
+    changes = reload_floor_layers(level, map_data, surfaces)
+    changes.update(reload_tile_sprites(level, map_data))
+    changes.update(reload_objects(level, map_data))
+
+    level.tmx_data = map_data
+    level.tile_surfaces = surfaces
+    get_transition_registry().register_map(os.path.basename(level.map_path), map_data)
+    if changes["Collision_Objects"]:
+        # rebuilt from the new map the next time a path is needed
+        level.navigation = None
+        if level.crowd is not None:
+            level.crowd.rebuild_obstacles()
+
+    return {name: count for name, count in changes.items() if count}
+
+
+def get_file_signature(path: str) -> Optional[tuple[int, int]]:
+    """ None while the file does not exist, editors may replace a file by deleting and renaming """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class HotReloader:
+    """ Checks the modification time of the level maps, the tilesets and images they use and the transition mapping
+        every interval seconds and reloads the built levels whose files changed. Levels that are not built are simply
+        loaded from the new files when they are needed.
+    """
+    def __init__(self, level_handler, interval: float = HOT_RELOAD_POLL_INTERVAL):
+        self.level_handler = level_handler
+        self.interval = interval
+        self.next_poll = time.perf_counter() + interval
+        # map path -> files it depends on
+        self.map_sources = {}
+        # file -> signature when it was last loaded
+        self.signatures = {TRANSITION_MAPPING_FILE_PATH: get_file_signature(TRANSITION_MAPPING_FILE_PATH)}
+        for map_path in level_handler.levels.level_paths.values():
+            self.watch_map(map_path)
+
+    def watch_map(self, map_path: str):
+        try:
+            sources = get_map_sources(map_path)
+        except (OSError, ElementTree.ParseError):
+            # watched again once it has been saved completely
+            sources = [map_path]
+
+        self.map_sources[map_path] = sources
+        for source in sources:
+            if source not in self.signatures:
+                self.signatures[source] = get_file_signature(source)
+
+    def poll(self):
+        """ Called every simulation step, only looks at the files once per interval """
+        now = time.perf_counter()
+        if now < self.next_poll:
+            return
+        self.next_poll = now + self.interval
+
+        changed_paths = set()
+        for path, signature in self.signatures.items():
+            new_signature = get_file_signature(path)
+            if new_signature != signature:
+                self.signatures[path] = new_signature
+                changed_paths.add(path)
+
+        if changed_paths:
+            with profiler.scope("hot reload"):
+                self.reload(changed_paths)
+
+    def reload(self, changed_paths: set[str]):
+        if TRANSITION_MAPPING_FILE_PATH in changed_paths:
+            try:
+                get_transition_registry().load()
+            except (OSError, ValueError) as error:
+                warnings.warn(f"hot reload: transition mapping not reloaded, {error!r}", RuntimeWarning)
+
+        # tiles cut from a changed tileset image are cut again by the next load
+        for path in changed_paths:
+            if not path.endswith((".tmx", ".tsx", ".ods")):
+                asset_manager.evict(path)
+
+        levels = self.level_handler.levels
+        for level_code, map_path in levels.level_paths.items():
+            if changed_paths.isdisjoint(self.map_sources[map_path]):
+                continue
+
+            # the map may use other tilesets now
+            self.watch_map(map_path)
+            level = levels.levels.get(level_code)
+            if level is not None:
+                self.reload_level(level_code, level)
+
+    def reload_level(self, level_code: int, level: Level):
+        """ Failures are reported as warnings, the time it takes is recorded by the "hot reload" profiler scope """
+        name = os.path.basename(level.map_path)
+        if isinstance(level, StreamedLevel):
+            warnings.warn(f"hot reload: {name} is streamed, rebuild its stream (mapCompiler.py stream) to see the "
+                          f"changes", RuntimeWarning)
+            return
+
+        # the crowd continues in this process with the new obstacles
+        if self.level_handler.offscreen_simulation:
+            self.level_handler.offscreen_simulation.sync(level_code)
+
+        try:
+            map_data = load_map(level.map_path)
+        except Exception as error:
+            # e.g. a file Tiled has not finished writing, it is reloaded when it changes again
+            warnings.warn(f"hot reload: {name} not reloaded, {error!r}", RuntimeWarning)
+            return
+
+        reload_level(level, map_data)
+
+
+def read_layer_data(layer_node: ElementTree.Element) -> np.ndarray:
+    data_node = layer_node.find("data")
+    data = base64.b64decode(data_node.text.strip())
+    if data_node.get("compression") == "zlib":
+        data = zlib.decompress(data)
+    return np.frombuffer(data, dtype=np.uint32).reshape(int(layer_node.get("height")), int(layer_node.get("width")))
+
+
+def write_layer_data(layer_node: ElementTree.Element, gids: np.ndarray):
+    data_node = layer_node.find("data")
+    data = gids.astype(np.uint32).tobytes()
+    if data_node.get("compression") == "zlib":
+        data = zlib.compress(data)
+    data_node.text = base64.b64encode(data).decode()
+
+
+class MapCopy:
+    """ Copy of a map in a temporary folder, with its tilesets referenced by absolute path, to edit like in Tiled """
+    def __init__(self, map_path: str):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, os.path.basename(map_path))
+        self.tree = ElementTree.parse(map_path)
+        for tileset in self.tree.getroot().iter("tileset"):
+            if tileset.get("source"):
+                tileset.set("source", os.path.normpath(os.path.join(os.path.dirname(map_path), tileset.get("source"))))
+        self.save()
+
+    def get_layer(self, name: str) -> ElementTree.Element:
+        return next(node for node in self.tree.getroot() if node.get("name") == name)
+
+    def set_tile(self, layer_name: str, column: int, row: int, gid: int):
+        layer_node = self.get_layer(layer_name)
+        gids = read_layer_data(layer_node).copy()
+        gids[row, column] = gid
+        write_layer_data(layer_node, gids)
+
+    def save(self):
+        self.tree.write(self.path, encoding="UTF-8", xml_declaration=True)
+
+    def remove(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def get_level_state(level: Level) -> dict:
+    """ What a level draws and collides with, to compare a reloaded level with one built from scratch """
+    tokens = {}
+    surface_tokens = get_surface_tokens(level.tile_surfaces, tokens)
+    tiles = sorted((sprite.tiled_layer, sprite.rect.topleft, tokens.setdefault(id(sprite.image), len(tokens)),
+                    sprite.rect.centery) for sprite in level.visible_sprites if isinstance(sprite, Tile))
+    # tiles with the same centery have to be drawn in layer order
+    level.visible_sprites.update_sort_order()
+    draw_order = [(sprite.rect.centery, sprite.tiled_layer) for sprite in level.visible_sprites.sorted_sprites]
+    return {"floor": [(layer.name, surface_tokens[layer.tile_ids].tolist()) for layer in level.floor_layers],
+            "tiles": tiles, "draw order": draw_order,
+            "obstacles": sorted(tuple(sprite.rect) for sprite in level.obstacle_sprites),
+            "transitions": sorted((tuple(sprite.rect), sprite.transition_code) for sprite in level.transition_sprites),
+            "spawn points": sorted((tuple(sprite.rect), sprite.spawn_point_id) for sprite in level.spawn_points)}
+
+
+def bench(map_path: str, repeat: int):
+    """ Times reloading a level after changing one floor tile and one tile of the other layers, against building the
+        level again
+    """
+    map_copy = MapCopy(map_path)
+    try:
+        level = Level(map_copy.path)
+        start = time.perf_counter()
+        Level(map_copy.path)
+        rebuild_time = (time.perf_counter() - start) * 1000
+
+        layer_names = [layer.name for layer in level.tmx_data.visible_layers if hasattr(layer, "data")]
+        gids = {name: read_layer_data(map_copy.get_layer(name)) for name in layer_names}
+        print(f"{os.path.basename(map_path)}: building the level takes {rebuild_time:.1f} ms")
+        for name in layer_names:
+            original = gids[name]
+            row, column = np.argwhere(original != 0)[0]
+            used_gids = np.unique(original[original != 0])
+            other_gid = int(next((gid for gid in used_gids if gid != original[row, column]), original[row, column] + 1))
+
+            times = []
+            for number in range(repeat):
+                map_copy.set_tile(name, column, row, other_gid if number % 2 == 0 else int(original[row, column]))
+                map_copy.save()
+                start = time.perf_counter()
+                changes = reload_level(level)
+                times.append((time.perf_counter() - start) * 1000)
+                if changes != {name: 1}:
+                    print(f"    {name}: expected one changed tile, got {changes}")
+
+            print(f"    one tile of {name:<12} reloaded in {median(times):5.1f} ms median, {max(times):5.1f} ms max")
+    finally:
+        map_copy.remove()
+
+
+def main():
+    # only the command line tools default to no window, the game imports this module
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--bench", action="store_true")
+    parser.add_argument("--map", default=f"{STARTING_LEVEL_CODE}.tmx", help="map file in the maps folder")
+    parser.add_argument("--repeat", type=int, default=20, help="reloads per layer when benchmarking")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    bench(os.path.join(MAPS_FILE_PATH, args.map), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
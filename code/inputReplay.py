@@ -0,0 +1,67 @@
+import json
+import pygame
+from typing import Callable
+
+# keys read by Player.input, only these are recorded
+RECORDED_KEYS = [pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d]
+
+
+class KeyState:
+    """ Stand in for the sequence returned by pygame.key.get_pressed """
+    def __init__(self, pressed_keys: frozenset[int] = frozenset()):
+        self.pressed_keys = pressed_keys
+
+    def __getitem__(self, key: int) -> bool:
+        return key in self.pressed_keys
+
+
+class ScriptedInput:
+    """ Replays a key script, a list of [frame count, [key names]] steps. get_pressed returns the keys of the current
+        frame and moves on to the next frame, the last step is held once the script runs out.
+    """
+    def __init__(self, script: list):
+        self.frames = []
+        for frame_count, key_names in script:
+            key_state = KeyState(frozenset(pygame.key.key_code(key_name) for key_name in key_names))
+            self.frames.extend([key_state] * frame_count)
+
+        self.frame = 0
+
+    @staticmethod
+    def load_script(path: str) -> list:
+        with open(path) as script_file:
+            return json.load(script_file)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def get_pressed(self) -> KeyState:
+        if not self.frames:
+            return KeyState()
+
+        key_state = self.frames[min(self.frame, len(self.frames) - 1)]
+        self.frame += 1
+        return key_state
+
+
+class InputRecorder:
+    """ Wraps an input source and records the movement keys it returns every frame as a key script """
+    def __init__(self, get_pressed: Callable = pygame.key.get_pressed):
+        self.source = get_pressed
+        self.script = []
+
+    def get_pressed(self):
+        keys = self.source()
+        key_names = sorted(pygame.key.name(key) for key in RECORDED_KEYS if keys[key])
+
+        # run length encode consecutive identical frames
+        if self.script and self.script[-1][1] == key_names:
+            self.script[-1][0] += 1
+        else:
+            self.script.append([1, key_names])
+
+        return keys
+
+    def save(self, path: str):
+        with open(path, "w") as script_file:
+            json.dump(self.script, script_file)
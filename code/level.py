@@ -1,27 +1,55 @@
+import os
 import pygame
-from pytmx.util_pygame import load_pygame
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Optional, Union, TYPE_CHECKING
 from settings import *
 from tile import Tile
+from tileLayer import TileLayer
 from player import Player
 from hitbox import HitBox
 from transitionBox import TransitionBox
 from spawnPoint import SpawnPoint
-from debug import debug
+from spatialHash import SpatialGroup
+from transitionRegistry import get_transition_registry
+from assetManager import asset_manager, get_surface_bytes
+from mapLoader import CompiledMap, load_map
+from crowd import Crowd, ObstacleGrid
+from animation import animation_clock
+from navigation import Navigation, load_navigation
+from updateScheduler import UpdateScheduler, needs_update
+from debug import debug, debug_overlay
+from profiler import profiler
+
+if TYPE_CHECKING:
+    import pytmx
 
 
 class Level:
-    def __init__(self, map_path: str, player: Player = None) -> None:
-        # load map
-        self.tmx_data = load_pygame(map_path)
+    def __init__(self, map_path: str, player: Player = None,
+                 tmx_data: Union["pytmx.TiledMap", CompiledMap] = None) -> None:
+        self.map_path = map_path
+        # load map (from its compiled cache when fresh) unless it has already been loaded by the level preloader
+        self.tmx_data = tmx_data if tmx_data is not None else load_map(map_path)
+        # spawn point lookups reuse the loaded map instead of parsing the file again
+        get_transition_registry().register_map(os.path.basename(map_path), self.tmx_data)
 
         # get display surface
         self.display_surface = pygame.display.get_surface()
 
         # sprite groups
         self.visible_sprites = YSortCameraGroup()
-        self.obstacle_sprites = pygame.sprite.Group()
-        self.transition_sprites = pygame.sprite.Group()
-        self.spawn_points = pygame.sprite.Group()
+        # floor layers are stored as tile id arrays instead of sprites, sharing one surface table
+        self.floor_layers = []
+        self.tile_surfaces = TileLayer.create_surface_table(self.tmx_data.images)
+        self.obstacle_sprites = SpatialGroup()
+        self.transition_sprites = SpatialGroup()
+        self.spawn_points = SpatialGroup()
+
+        # non-player entities simulated as one batch, created by spawn_crowd
+        self.crowd = None
+        # path finding, loaded the first time a path is needed
+        self.navigation = None
 
         # initialise map
         self.create_map()
@@ -36,6 +64,11 @@ class Level:
         def create_tile_objects():
             for layer in self.tmx_data.visible_layers:
                 if hasattr(layer, "data"):
+                    # floor tiles are always drawn underneath the sprites so they do not need to be y-sorted
+                    if layer.name in FLOOR_LAYERS:
+                        self.floor_layers.append(TileLayer.from_map_layer(layer, self.tile_surfaces))
+                        continue
+
                     for x, y, surf in layer.tiles():
                         position = (x * TILE_SIZE, y * TILE_SIZE)
                         Tile(position, surf, [self.visible_sprites], layer.name)
@@ -65,57 +98,484 @@ class Level:
         create_transition_objects()
         create_spawn_point_objects()
 
+        self.visible_sprites.set_floor_layers(self.floor_layers, bake=True)
+
+    def shutdown(self):
+        """ Called when the level is dropped, e.g. evicted from the level cache """
+        self.visible_sprites.update_scheduler.shutdown()
+
     def get_level_groups(self) -> list[pygame.sprite.Group]:
         return [self.visible_sprites, self.obstacle_sprites, self.transition_sprites, self.spawn_points]
 
+    def get_layer_surfaces(self) -> dict[str, dict[int, pygame.Surface]]:
+        """ Surfaces drawn by each tile layer, keyed by id so shared surfaces are counted once """
+        layer_surfaces = {layer.name: layer.get_surfaces() for layer in self.floor_layers}
+        for tile in self.visible_sprites:
+            if isinstance(tile, Tile):
+                layer_surfaces.setdefault(tile.tiled_layer, {})[id(tile.image)] = tile.image
+        return layer_surfaces
+
+    def get_surfaces(self) -> dict[int, pygame.Surface]:
+        """ Every surface the level keeps alive: the tile images of its map, whether they are used or not, and the
+            cached floor chunks
+        """
+        surfaces = {id(surface): surface for surface in self.tile_surfaces if surface is not None}
+        for layer_surfaces in self.get_layer_surfaces().values():
+            surfaces.update(layer_surfaces)
+        surfaces.update((id(chunk), chunk) for chunk in self.visible_sprites.floor_chunks.values() if chunk is not None)
+        return surfaces
+
+    def get_array_bytes(self) -> int:
+        return sum(layer.get_bytes() for layer in self.floor_layers)
+
+    def get_surface_bytes(self) -> int:
+        """ Approximate memory used by the tile surfaces, floor layers and cached floor chunks of the level, shared
+            surfaces count once
+        """
+        return sum(get_surface_bytes(surface) for surface in self.get_surfaces().values()) + self.get_array_bytes()
+
+    def get_memory_report(self) -> dict:
+        """ Bytes used by the level per layer (the surfaces it draws and its tile id array), per asset (tileset) and
+            by the cached floor chunks. Tile surfaces are shared with the other layers and levels using them, so they
+            count in every layer and asset using them but only once in the total.
+        """
+        layers = {name: sum(get_surface_bytes(surface) for surface in surfaces.values())
+                  for name, surfaces in self.get_layer_surfaces().items()}
+        for layer in self.floor_layers:
+            layers[layer.name] += layer.get_bytes()
+
+        asset_names = asset_manager.get_asset_names()
+        assets = {}
+        for surface in self.tile_surfaces:
+            if surface is not None:
+                asset_name = asset_names.get(id(surface), "unshared tiles")
+                assets[asset_name] = assets.get(asset_name, 0) + get_surface_bytes(surface)
+
+        floor_chunks = [chunk for chunk in self.visible_sprites.floor_chunks.values() if chunk is not None]
+        return {"layers": layers, "assets": assets,
+                "floor_chunks": sum(get_surface_bytes(chunk) for chunk in floor_chunks),
+                "total": self.get_surface_bytes()}
+
+    def get_spawn_point(self, spawn_point_id: int) -> Optional[SpawnPoint]:
+        for sprite in self.spawn_points:
+            if sprite.get_spawn_point_id() == spawn_point_id:
+                return sprite
+
+        return None
+
     def set_player(self, player: Player):
         self.player = player
 
-    def run(self):
+    def spawn_crowd(self, positions: list[tuple[float, float]], seed: int = 0) -> Crowd:
+        """ Adds wandering non-player entities that are moved together by a Crowd """
+        if self.crowd is None:
+            self.crowd = Crowd(self.obstacle_sprites, [self.visible_sprites], seed=seed,
+                               obstacle_grid=self.get_obstacle_grid())
+        self.crowd.add(positions)
+        return self.crowd
+
+    def get_obstacle_grid(self) -> ObstacleGrid:
+        """ Collision boxes the crowd of the level moves around """
+        return ObstacleGrid.from_sprites(self.obstacle_sprites)
+
+    def get_navigation(self) -> Navigation:
+        if self.navigation is None:
+            self.navigation = load_navigation(self.map_path, self.tmx_data)
+        return self.navigation
+
+    def get_view_rect(self) -> pygame.Rect:
+        """ World area the camera will show on the next draw """
+        view_rect = pygame.Rect((0, 0), self.visible_sprites.view_size)
+        view_rect.center = self.player.rect.center
+        return view_rect
+
+    def get_sprite_counts(self) -> dict[str, int]:
+        return {"visible": len(self.visible_sprites), "floor": sum(len(layer) for layer in self.floor_layers),
+                "obstacles": len(self.obstacle_sprites), "transitions": len(self.transition_sprites),
+                "spawn points": len(self.spawn_points), "crowd": len(self.crowd) if self.crowd is not None else 0}
+
+    def update(self):
+        """ Advances the level by one fixed simulation step """
+        animation_clock.tick()
+        self.visible_sprites.store_previous_rects()
+        if self.navigation is not None:
+            self.navigation.update()
+        # tiles are never visited, sprites far from the camera are updated less often or not at all
+        self.visible_sprites.update_scheduler.update(self.get_view_rect() if self.player is not None else None)
+        if self.crowd is not None:
+            # the camera can trail the player by up to one step while rendering is interpolated
+            self.crowd.update(self.get_view_rect().inflate(INTERPOLATION_MAX_DISTANCE * 2,
+                                                           INTERPOLATION_MAX_DISTANCE * 2))
+
+    def draw_world(self, alpha: float = 1.0) -> list[pygame.Rect]:
+        dirty_rects = []
         try:
-            self.visible_sprites.custom_draw(self.player)
+            with profiler.scope("draw"):
+                dirty_rects = self.visible_sprites.custom_draw(self.player, alpha)
         except Exception as e:
             print(e)
 
-        self.visible_sprites.update()
-        debug(self.player.rect.center)
+        return dirty_rects
+
+    def draw_overlay(self) -> list[pygame.Rect]:
+        if profiler.enabled:
+            overlay_rect = debug_overlay(profiler, self.get_sprite_counts())
+        else:
+            overlay_rect = debug(self.player.rect.center)
+
+        # the overlay is drawn over the level so its area has to be redrawn next frame
+        self.visible_sprites.invalidate(overlay_rect)
+        return [overlay_rect]
+
+    def draw(self, alpha: float = 1.0) -> list[pygame.Rect]:
+        """ Draws the level with moving sprites interpolated alpha of the way from their previous to their current
+            simulation position, returns the screen areas that have to be passed to display.update
+        """
+        return self.draw_world(alpha) + self.draw_overlay()
+
+    def run(self) -> list[pygame.Rect]:
+        """ Draws and then updates the level once, for callers that step the simulation once per frame """
+        dirty_rects = self.draw_world()
+        self.update()
+        return dirty_rects + self.draw_overlay()
 
 
 class YSortCameraGroup(pygame.sprite.Group):
+    # redraw only what changed since the previous frame instead of the whole screen
+    incremental = INCREMENTAL_RENDERING
+    # draw at ORIGINAL_TILE_SIZE and scale the frame up to the window once
+    native_resolution = NATIVE_RESOLUTION_RENDERING
+
     def __init__(self):
+        # persistent draw order: (centery, insertion order) keys kept sorted with bisect, parallel to sorted_sprites.
+        # Tiles never move so only the other (dynamic) sprites are re-positioned when their centery changes.
+        self.sort_keys = []
+        self.sorted_sprites = []
+        self.sprite_keys = {}
+        self.dynamic_sprites = {}
+        # sprites added since the last draw, their rects may not be set yet when add_internal runs
+        self.pending_sprites = {}
+        self.next_order = 0
+        self.max_sprite_height = 0
+        # the sprites with an update method, which Level.update advances instead of calling Group.update
+        self.update_scheduler = UpdateScheduler()
+
         # general setup
         super().__init__()
         self.display_surface = pygame.display.get_surface()
-        self.half_width, self.half_height = self.display_surface.get_width() // 2, self.display_surface.get_height() // 2
+        # the world is drawn to render_surface, which is the display surface unless it is drawn at native resolution.
+        # view_size is the size of the world area shown, in world coordinates.
+        if self.native_resolution:
+            self.render_scale = SCALE
+            self.render_surface = pygame.Surface((WIDTH // SCALE, HEIGHT // SCALE)).convert()
+            self.view_size = (WIDTH, HEIGHT)
+        else:
+            self.render_scale = 1
+            self.render_surface = self.display_surface
+            self.view_size = self.display_surface.get_size()
+        self.half_width, self.half_height = self.view_size[0] // 2, self.view_size[1] // 2
         self.offset = pygame.math.Vector2()
 
-    def custom_draw(self, player: Player):
-        def draw_floor_tiles(tiles: list[pygame.sprite.Sprite]):
-            # draw floor tiles before non-floor tiles (painters algorithm)
-            for tile in tiles:
-                offset = tile.rect.topleft - self.offset
-                self.display_surface.blit(tile.image, offset)
+        # floor layers are pre-rendered into chunks keyed by (chunk column, chunk row), None for chunks without any
+        # floor tiles. Small maps are baked whole and keep every chunk (floor_chunk_limit None), the others bake
+        # chunks when they first come into view and keep the most recently used ones. Chunks are baked at the render
+        # scale.
+        self.chunk_size = FLOOR_CHUNK_SIZE * TILE_SIZE
+        self.floor_layers = []
+        self.floor_chunks = OrderedDict()
+        self.floor_chunk_limit = FLOOR_CHUNK_CACHE_SIZE
+
+        # incremental rendering state: the offset and sprite rects/images of the frame currently on screen and the
+        # screen areas drawn over by something else (e.g. the debug overlay) since then
+        self.full_redraw_requested = True
+        self.previous_offset = (0, 0)
+        self.previous_sprite_states = {}
+        self.invalid_rects = []
+        # world areas whose contents changed (e.g. tiles added or removed by chunk streaming)
+        self.invalid_world_rects = []
+
+        # interpolated rendering: dynamic sprite rects before the last simulation step and the rects they are drawn
+        # at this frame
+        self.previous_rects = {}
+        self.render_rects = {}
+        self.render_margin = 0
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.pending_sprites[sprite] = self.next_order
+        self.next_order += 1
+        if needs_update(sprite):
+            self.update_scheduler.add(sprite)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.update_scheduler.remove(sprite)
+        if self.pending_sprites.pop(sprite, None) is None:
+            self.remove_sorted(sprite)
+            self.dynamic_sprites.pop(sprite, None)
+            # tiles are not tracked between frames, the area of a removed one has to be redrawn
+            if isinstance(sprite, Tile):
+                self.invalidate_world(sprite.rect)
+
+    def get_order(self, sprite) -> float:
+        """ Order the sprite was added in, which decides the drawing order of sprites with the same centery """
+        order = self.pending_sprites.get(sprite)
+        return order if order is not None else self.sprite_keys[sprite][1]
+
+    def set_order(self, sprite, order: float):
+        """ Moves a sprite added since the last draw to another place among the sprites with the same centery, e.g. a
+            reloaded tile back between the layers below and above it
+        """
+        self.pending_sprites[sprite] = order
+
+    def insert_sorted(self, sprite, key: tuple[int, int]):
+        index = bisect_left(self.sort_keys, key)
+        self.sort_keys.insert(index, key)
+        self.sorted_sprites.insert(index, sprite)
+        self.sprite_keys[sprite] = key
+
+    def remove_sorted(self, sprite):
+        index = bisect_left(self.sort_keys, self.sprite_keys.pop(sprite))
+        del self.sort_keys[index]
+        del self.sorted_sprites[index]
+
+    def update_sort_order(self):
+        """ Inserts newly added sprites and re-positions the dynamic sprites whose centery changed """
+        for sprite, order in self.pending_sprites.items():
+            self.insert_sorted(sprite, (sprite.rect.centery, order))
+            self.max_sprite_height = max(self.max_sprite_height, sprite.rect.height)
+            if isinstance(sprite, Tile):
+                self.invalidate_world(sprite.rect)
+            else:
+                self.dynamic_sprites[sprite] = None
+        self.pending_sprites = {}
+
+        for sprite in self.dynamic_sprites:
+            centery, order = self.sprite_keys[sprite]
+            if centery != sprite.rect.centery:
+                self.remove_sorted(sprite)
+                self.insert_sorted(sprite, (sprite.rect.centery, order))
+            self.max_sprite_height = max(self.max_sprite_height, sprite.rect.height)
+
+    def get_sorted_sprites(self, world_area: pygame.Rect) -> list[pygame.sprite.Sprite]:
+        """ Y-sorted sprites overlapping a world area, only the sprites whose centery is within the tallest sprite
+            height of the area are tested
+        """
+        margin = self.max_sprite_height + self.render_margin
+        first = bisect_left(self.sort_keys, (world_area.top - margin,))
+        last = bisect_left(self.sort_keys, (world_area.bottom + margin + 1,))
+        return [sprite for sprite in self.sorted_sprites[first:last]
+                if self.render_rects.get(sprite, sprite.rect).colliderect(world_area)]
+
+    def store_previous_rects(self):
+        """ Called before every simulation step so that the step can be interpolated """
+        self.previous_rects = {sprite: sprite.rect.copy() for sprite in self.dynamic_sprites}
+
+    def update_render_rects(self, alpha: float):
+        """ Places the dynamic sprites alpha of the way between their previous and current rect, sprites that jumped
+            further than INTERPOLATION_MAX_DISTANCE are drawn at their current rect
+        """
+        self.render_rects = {}
+        self.render_margin = 0
+        if alpha >= 1:
+            return
+
+        for sprite, previous_rect in self.previous_rects.items():
+            delta_x, delta_y = previous_rect.x - sprite.rect.x, previous_rect.y - sprite.rect.y
+            if (delta_x or delta_y) and max(abs(delta_x), abs(delta_y)) <= INTERPOLATION_MAX_DISTANCE:
+                self.render_rects[sprite] = sprite.rect.move(round(delta_x * (1 - alpha)),
+                                                             round(delta_y * (1 - alpha)))
+                self.render_margin = max(self.render_margin, abs(delta_y))
+
+    def set_floor_layers(self, layers: list[TileLayer], bake: bool = False):
+        """ Sets the layers drawn underneath the sprites, must be called again whenever their tiles change. With bake
+            every chunk is baked now if the layers span at most FLOOR_CHUNK_BAKE_LIMIT chunks.
+        """
+        self.floor_layers = layers
+        self.floor_chunks = OrderedDict()
+        self.floor_chunk_limit = FLOOR_CHUNK_CACHE_SIZE
+        self.request_full_redraw()
+        if not bake:
+            return
+
+        rows = max((layer.tile_ids.shape[0] for layer in layers), default=0)
+        columns = max((layer.tile_ids.shape[1] for layer in layers), default=0)
+        chunk_rows, chunk_columns = -(-rows // FLOOR_CHUNK_SIZE), -(-columns // FLOOR_CHUNK_SIZE)
+        if chunk_rows * chunk_columns <= FLOOR_CHUNK_BAKE_LIMIT:
+            self.floor_chunk_limit = None
+            for row in range(chunk_rows):
+                for column in range(chunk_columns):
+                    self.get_floor_chunk((column, row))
+
+    def get_floor_chunk(self, chunk_position: tuple[int, int]) -> Optional[pygame.Surface]:
+        """ Returns a chunk_size x chunk_size pre-render of the floor layers, baking it from the tile arrays when it is
+            not cached. Layers are blitted in order so the layer order of the .tmx file is preserved.
+        """
+        if chunk_position in self.floor_chunks:
+            self.floor_chunks.move_to_end(chunk_position)
+            return self.floor_chunks[chunk_position]
+
+        column, row = chunk_position
+        chunk_area = pygame.Rect(column * self.chunk_size, row * self.chunk_size, self.chunk_size, self.chunk_size)
+        chunk = pygame.Surface((self.chunk_size // self.render_scale, self.chunk_size // self.render_scale),
+                               pygame.SRCALPHA)
+        tile_count = sum(layer.draw(chunk, chunk_area, chunk_area.topleft, self.render_scale)
+                         for layer in self.floor_layers)
+        self.floor_chunks[chunk_position] = chunk.convert_alpha() if tile_count else None
+
+        if self.floor_chunk_limit is not None and len(self.floor_chunks) > self.floor_chunk_limit:
+            self.floor_chunks.popitem(last=False)
+        return self.floor_chunks[chunk_position]
 
-        def draw_non_floor_tiles(tiles: list[pygame.sprite.Sprite]):
-            # draw non-floor tiles on top of floor tiles using Y-sort algorithm
-            for tile in sorted(tiles, key=lambda tile: tile.rect.centery):
-                offset = tile.rect.topleft - self.offset
-                self.display_surface.blit(tile.image, offset)
+    def request_full_redraw(self):
+        """ Makes the next custom_draw redraw the whole screen, e.g. after a level transition """
+        self.full_redraw_requested = True
+
+    def invalidate(self, rect: pygame.Rect):
+        """ Marks a screen area that was drawn over outside of custom_draw so it is redrawn on the next frame """
+        self.invalid_rects.append(pygame.Rect(rect))
+
+    def invalidate_world(self, rect: pygame.Rect):
+        """ Marks a world area whose contents changed so it is redrawn on the next frame if it is on screen """
+        self.invalid_world_rects.append(pygame.Rect(rect))
+
+    def invalidate_floor(self, rect: pygame.Rect):
+        """ Drops the cached floor chunks overlapping a world area after the tiles of the floor layers changed there,
+            a baked map bakes them again right away
+        """
+        for chunk_position in list(self.floor_chunks):
+            column, row = chunk_position
+            if rect.colliderect((column * self.chunk_size, row * self.chunk_size, self.chunk_size, self.chunk_size)):
+                del self.floor_chunks[chunk_position]
+                if self.floor_chunk_limit is None:
+                    self.get_floor_chunk(chunk_position)
+        self.invalidate_world(rect)
+
+    def draw_area(self, area: pygame.Rect):
+        """ Draws the floor chunks and then the y-sorted sprites overlapping an area of the render surface (painters
+            algorithm)
+        """
+        offset_x, offset_y = int(self.offset.x), int(self.offset.y)
+        scale = self.render_scale
+        world_area = pygame.Rect(area.x * scale + offset_x, area.y * scale + offset_y, area.width * scale,
+                                 area.height * scale)
+
+        first_column, first_row = world_area.left // self.chunk_size, world_area.top // self.chunk_size
+        last_column, last_row = (world_area.right - 1) // self.chunk_size, (world_area.bottom - 1) // self.chunk_size
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                chunk = self.get_floor_chunk((column, row))
+                if chunk is not None:
+                    self.render_surface.blit(chunk, ((column * self.chunk_size - offset_x) // scale,
+                                                     (row * self.chunk_size - offset_y) // scale))
+                    profiler.count("blits")
+
+        # draw non-floor tiles on top of floor tiles using Y-sort algorithm
+        sprites = self.get_sorted_sprites(world_area)
+        if scale == 1:
+            for sprite in sprites:
+                rect = self.render_rects.get(sprite, sprite.rect)
+                self.render_surface.blit(sprite.image, (rect.x - offset_x, rect.y - offset_y))
+        else:
+            for sprite in sprites:
+                rect = self.render_rects.get(sprite, sprite.rect)
+                self.render_surface.blit(asset_manager.get_native_surface(sprite.image, scale),
+                                         ((rect.x - offset_x) // scale, (rect.y - offset_y) // scale))
+        profiler.count("blits", len(sprites))
+
+    def get_dirty_rects(self, sprite_states: dict) -> list[pygame.Rect]:
+        """ Scrolls the previous frame by the camera movement and returns the screen areas that have to be redrawn:
+            the newly exposed strips, the old and new rects of dynamic sprites that moved, animated, appeared or
+            disappeared and the invalidated screen and world areas.
+        """
+        screen_rect = self.display_surface.get_rect()
+        offset_x, offset_y = int(self.offset.x), int(self.offset.y)
+        delta_x, delta_y = offset_x - self.previous_offset[0], offset_y - self.previous_offset[1]
+        dirty_rects = []
+
+        if delta_x or delta_y:
+            self.display_surface.scroll(-delta_x, -delta_y)
+            if delta_x > 0:
+                dirty_rects.append(pygame.Rect(screen_rect.width - delta_x, 0, delta_x, screen_rect.height))
+            elif delta_x < 0:
+                dirty_rects.append(pygame.Rect(0, 0, -delta_x, screen_rect.height))
+            if delta_y > 0:
+                dirty_rects.append(pygame.Rect(0, screen_rect.height - delta_y, screen_rect.width, delta_y))
+            elif delta_y < 0:
+                dirty_rects.append(pygame.Rect(0, 0, screen_rect.width, -delta_y))
+
+        # invalidated areas were scrolled along with the rest of the previous frame
+        dirty_rects.extend(rect.move(-delta_x, -delta_y) for rect in self.invalid_rects)
+        dirty_rects.extend(rect.move(-offset_x, -offset_y) for rect in self.invalid_world_rects)
+
+        for sprite, (rect, image) in sprite_states.items():
+            previous_state = self.previous_sprite_states.get(sprite)
+            if previous_state is None or previous_state[0] != rect or previous_state[1] is not image:
+                dirty_rects.append(rect.move(-offset_x, -offset_y))
+                if previous_state is not None:
+                    dirty_rects.append(previous_state[0].move(-offset_x, -offset_y))
+
+        for sprite in self.previous_sprite_states.keys() - sprite_states.keys():
+            dirty_rects.append(self.previous_sprite_states[sprite][0].move(-offset_x, -offset_y))
+
+        # merge overlapping rects so no area is drawn twice
+        merged_rects = []
+        for rect in (rect.clip(screen_rect) for rect in dirty_rects):
+            if rect.width and rect.height:
+                index = rect.collidelist(merged_rects)
+                while index != -1:
+                    rect.union_ip(merged_rects.pop(index))
+                    index = rect.collidelist(merged_rects)
+                merged_rects.append(rect)
+
+        return merged_rects
+
+    def custom_draw(self, player: Player, alpha: float = 1.0) -> list[pygame.Rect]:
+        """ Draws the level centred on the player and returns the screen areas that changed """
+        self.update_sort_order()
+        self.update_render_rects(alpha)
 
         # offset
-        self.offset.x = player.rect.centerx - self.half_width
-        self.offset.y = player.rect.centery - self.half_height
+        player_rect = self.render_rects.get(player, player.rect)
+        self.offset.x = player_rect.centerx - self.half_width
+        self.offset.y = player_rect.centery - self.half_height
+        if self.native_resolution:
+            # the camera moves in whole native pixels so the tiles stay on the native pixel grid
+            self.offset.x -= self.offset.x % self.render_scale
+            self.offset.y -= self.offset.y % self.render_scale
 
-        # separate floor tiles and non-floor tiles
-        floor_tiles = [sprite for sprite in self.sprites() if type(sprite) != Player and
-                       sprite.tiled_layer in ["Ground", "Carpet", "Shadows"]]
+        screen_rect = self.display_surface.get_rect()
+        offset = (int(self.offset.x), int(self.offset.y))
+        # tiles never move, adding or removing one invalidates its world area instead. Every native resolution frame
+        # is scaled up to the whole window, so there is nothing to gain from redrawing only what changed.
+        incremental = self.incremental and not self.native_resolution
+        sprite_states = {sprite: (self.render_rects.get(sprite, sprite.rect).copy(), sprite.image)
+                         for sprite in self.dynamic_sprites} if incremental else {}
 
-        non_floor_tiles = [sprite for sprite in self.sprites() if type(sprite) == Player or
-                           sprite.tiled_layer not in ["Ground", "Carpet", "Shadows"]]
+        scroll_distance = max(abs(offset[0] - self.previous_offset[0]), abs(offset[1] - self.previous_offset[1]))
+        if not incremental or self.full_redraw_requested or scroll_distance > INCREMENTAL_MAX_SCROLL:
+            self.render_surface.fill("black")
+            self.draw_area(self.render_surface.get_rect())
+            if self.native_resolution:
+                with profiler.scope("upscale"):
+                    pygame.transform.scale(self.render_surface, screen_rect.size, self.display_surface)
+            dirty_rects = [screen_rect]
+        else:
+            dirty_rects = self.get_dirty_rects(sprite_states)
+            for rect in dirty_rects:
+                self.display_surface.set_clip(rect)
+                self.display_surface.fill("black")
+                self.draw_area(rect)
+            self.display_surface.set_clip(None)
 
-        draw_floor_tiles(floor_tiles)
-        draw_non_floor_tiles(non_floor_tiles)
+        self.full_redraw_requested = False
+        self.previous_offset = offset
+        self.previous_sprite_states = sprite_states
+        self.invalid_rects = []
+        self.invalid_world_rects = []
+        return dirty_rects
 
     def regular_draw(self):
         for sprite in self.sprites():
             self.display_surface.blit(sprite.image, sprite.rect.topleft)
+
@@ -0,0 +1,154 @@
+import os
+import warnings
+import pygame
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional
+from settings import *
+from level import Level
+from mapLoader import convert_map_images
+from assetManager import asset_manager, get_surface_bytes
+from worldStreamer import StreamedLevel, StreamedMap, load_level_data
+from transitionRegistry import get_transition_registry
+
+
+def discover_levels(maps_path: str = MAPS_FILE_PATH) -> dict[int, str]:
+    """ Returns the path of every level map keyed by its level code, level maps are named <level code>.tmx """
+    level_paths = {}
+    for file_name in sorted(os.listdir(maps_path)):
+        name, extension = os.path.splitext(file_name)
+        if extension == ".tmx" and name.isdigit():
+            level_paths[int(name)] = os.path.join(maps_path, file_name)
+
+    return level_paths
+
+
+def create_level(map_path: str, map_data=None) -> Level:
+    """ Builds a streamed level for maps with an up to date stream and a regular one otherwise """
+    if map_data is None:
+        map_data = load_level_data(map_path)
+        convert_map_images(map_data)
+
+    level_type = StreamedLevel if isinstance(map_data, StreamedMap) else Level
+    return level_type(map_path, tmx_data=map_data)
+
+
+class LevelCache:
+    """ Builds levels on first use and keeps the most recently used ones in memory. Levels that are likely to be
+        needed soon can be preloaded, their maps are parsed on a worker thread and the finished Level is built on the
+        main thread by poll.
+    """
+    def __init__(self, level_paths: dict[int, str], max_levels: int = LEVEL_CACHE_MAX_LEVELS,
+                 max_bytes: Optional[int] = LEVEL_CACHE_MAX_BYTES):
+        self.level_paths = level_paths
+        self.max_levels = max_levels
+        self.max_bytes = max_bytes
+
+        # least recently used level first
+        self.levels = OrderedDict()
+        # the level the player is in, never evicted
+        self.current_level_code = None
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="level-preloader")
+        self.pending = {}
+
+    def __contains__(self, level_code: int) -> bool:
+        return level_code in self.levels
+
+    def __getitem__(self, level_code: int) -> Level:
+        return self.get(level_code)
+
+    def enter(self, level_code: int) -> Level:
+        """ Gets the level the player is moving into """
+        self.current_level_code = level_code
+        return self.get(level_code)
+
+    def get(self, level_code: int) -> Level:
+        if level_code in self.levels:
+            self.levels.move_to_end(level_code)
+            return self.levels[level_code]
+
+        if level_code in self.pending:
+            # only blocks if the preload has not finished yet
+            self.finish_preload(level_code)
+        else:
+            self.add(level_code, create_level(self.level_paths[level_code]))
+
+        return self.levels[level_code]
+
+    def add(self, level_code: int, level: Level):
+        self.levels[level_code] = level
+        # the level that has just been added may be the one about to be used so it is not evicted either
+        self.evict(protected_level_codes={self.current_level_code, level_code})
+
+    def evict(self, protected_level_codes: set[int]):
+        def over_budget() -> bool:
+            if len(self.levels) > self.max_levels:
+                return True
+
+            return self.max_bytes is not None and self.get_surface_bytes() > self.max_bytes
+
+        for level_code in list(self.levels):
+            if not over_budget():
+                break
+
+            if level_code not in protected_level_codes:
+                level = self.levels.pop(level_code)
+                level.shutdown()
+                get_transition_registry().unregister_map(os.path.basename(level.map_path))
+
+    def get_surfaces(self) -> dict[int, pygame.Surface]:
+        surfaces = {}
+        for level in self.levels.values():
+            surfaces.update(level.get_surfaces())
+        return surfaces
+
+    def get_surface_bytes(self) -> int:
+        """ Memory used by the cached levels, tile surfaces shared by several levels count once """
+        return sum(get_surface_bytes(surface) for surface in self.get_surfaces().values()) + \
+            sum(level.get_array_bytes() for level in self.levels.values())
+
+    def get_memory_report(self) -> dict:
+        """ Memory report of every cached level and of the asset manager, the total counts shared surfaces once """
+        surfaces = self.get_surfaces()
+        surfaces.update(asset_manager.get_surfaces())
+        return {"levels": {level_code: level.get_memory_report() for level_code, level in self.levels.items()},
+                "assets": asset_manager.get_memory_report(),
+                "total": sum(get_surface_bytes(surface) for surface in surfaces.values()) +
+                sum(level.get_array_bytes() for level in self.levels.values())}
+
+    def preload(self, level_code: int):
+        if level_code in self.levels or level_code in self.pending or level_code not in self.level_paths:
+            return
+
+        self.pending[level_code] = self.executor.submit(load_level_data, self.level_paths[level_code])
+
+    def preload_neighbours(self, level: Level):
+        """ Preloads every level reachable through the transition objects of level """
+        for transition_sprite in level.transition_sprites:
+            level_code = transition_sprite.get_new_level_code()
+            if level_code is not None:
+                self.preload(level_code)
+
+    def finish_preload(self, level_code: int):
+        future: Future = self.pending.pop(level_code)
+        map_data = future.result()
+        convert_map_images(map_data)
+        self.add(level_code, create_level(self.level_paths[level_code], map_data))
+
+    def poll(self):
+        """ Builds at most one finished preload, called once per frame from the main thread """
+        for level_code, future in self.pending.items():
+            if future.done():
+                try:
+                    self.finish_preload(level_code)
+                except Exception as error:
+                    # the level is built synchronously by get if it is ever needed
+                    warnings.warn(f"preloading level {level_code} failed: {error!r}", RuntimeWarning)
+
+                break
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for level in self.levels.values():
+            level.shutdown()
@@ -1,42 +1,76 @@
 import os
+from typing import Optional
 
 import pygame.display
 
 from settings import *
 from level import Level
+from levelCache import LevelCache, discover_levels
 from player import Player
-from observer import Observer
+from eventBus import event_bus, LEVEL_CHANGED, LevelChanged
+from transitionRegistry import get_transition_registry
+from profiler import profiler
+from offscreenSimulation import OffscreenSimulation
+from saveState import Snapshot, restore_player, restore_crowd
+from startupTrace import startup_trace
 
 
-class LevelHandler(Observer):
-    def __init__(self):
+class LevelHandler:
+    def __init__(self, snapshot: Optional[Snapshot] = None, hot_reload: bool = HOT_RELOAD):
         self.display_surface = pygame.display.get_surface()
 
-        self.levels = {
-            0: Level(os.path.join(MAPS_FILE_PATH, "0.tmx")),
-            1: Level(os.path.join(MAPS_FILE_PATH, "1.tmx"))
-        }  # need to automate
+        # load the transition -> spawn point mappings once at startup
+        self.transition_registry = get_transition_registry()
 
-        # initialise current level to the starting level
-        self.current_level_code = 0
-        self.current_level = self.levels[self.current_level_code]
+        # levels are discovered from the maps folder and only built when they are first needed
+        self.levels = LevelCache(discover_levels(MAPS_FILE_PATH))
+        # the crowds of the other built levels keep moving while the player is away
+        self.offscreen_simulation = OffscreenSimulation() if OFFSCREEN_SIMULATION else None
+
+        # initialise current level to the starting level, or to the level the snapshot being resumed was taken in
+        self.current_level_code = snapshot.level_code if snapshot is not None else STARTING_LEVEL_CODE
+        self.current_level = self.levels.enter(self.current_level_code)
+        startup_trace.mark("first level built")
+        # the neighbour levels are preloaded once the first frame has been drawn
+        self.background_loading_started = False
 
         # get the pygame group member objects of the current level
         self.visible_sprites_group, self.obstacle_sprites_group, \
             self.transition_sprites_group, self.spawn_points_group = self.current_level.get_level_groups()
 
         # create the player instance that will be passed between levels
-        player_spawn_position = tuple(map(lambda x: x // 2, self.display_surface.get_size()))
+        # (the centre of the view, which is only the centre of the window when the world is not drawn at native
+        # resolution)
+        player_spawn_position = (WIDTH // 2, HEIGHT // 2)
         player_spawn_image_file_path = os.path.join(PLAYER_IMAGES_FILE_PATH, "down_idle", "down_idle_1.png")
         self.player = Player(player_spawn_position, player_spawn_image_file_path, [self.visible_sprites_group],
                              self.obstacle_sprites_group, self.transition_sprites_group, self.spawn_points_group,
                              self.current_level_code)
+        # the player is restored before joining the level so streamed levels load the chunks around it
+        if snapshot is not None:
+            restore_player(self.player, snapshot.player, snapshot.animation_time)
 
         # pass the player instance to the current level
         self.current_level.set_player(self.player)
-
-        # call super constructor
-        super().__init__(self.player)
+        if snapshot is not None and snapshot.crowd is not None:
+            restore_crowd(self.current_level, snapshot.crowd, snapshot.animation_time)
+
+        # the player publishes a level change when it walks onto a transition
+        event_bus.subscribe(LEVEL_CHANGED, self.on_level_changed)
+
+        # edited maps are reloaded into the built levels without restarting
+        self.hot_reloader = None
+        if hot_reload:
+            from hotReload import HotReloader
+            self.hot_reloader = HotReloader(self)
+
+    def shutdown(self):
+        """ Leaves the event bus and stops the background work, the handler must not be used afterwards """
+        event_bus.unsubscribe(LEVEL_CHANGED, self.on_level_changed)
+        self.player.observable_clear()
+        self.levels.shutdown()
+        if self.offscreen_simulation:
+            self.offscreen_simulation.shutdown()
 
     def transition(self):
         # if player has collided with a transition object
@@ -45,27 +79,48 @@ class LevelHandler(Observer):
             # update current level code
             self.current_level_code = self.player.get_current_level_code()
 
-            # change current level
-            self.current_level = self.levels[self.current_level_code]
+            # change current level, its crowd continues from where the off-screen simulation left it
+            self.current_level = self.levels.enter(self.current_level_code)
+            if self.offscreen_simulation:
+                self.offscreen_simulation.sync(self.current_level_code)
 
-            # draw new map
+            # draw new map, the incrementally rendered frame of the new level is out of date
             self.current_level.visible_sprites.regular_draw()
+            self.current_level.visible_sprites.request_full_redraw()
 
         def update_player_attributes():
             # update group attributes
             self.update_groups()
 
+            # set new player pos, before the player joins the level so streamed levels only load the chunks around
+            # the spawn point
+            self.player.rect.center = self.get_spawn_point(self.player.next_level_spawn_id).rect.center
+
             # move player instance to new level
             self.current_level.set_player(self.player)
 
             # update player object groups
             self.player.set_groups(self.current_level.get_level_groups())
 
-            # set new player pos
-            self.player.rect.center = self.get_spawn_point(self.player.next_level_spawn_id).rect.center
+        with profiler.scope("transition"):
+            transition_map()
+            update_player_attributes()
+            self.preload_neighbour_levels()
+
+    def preload_neighbour_levels(self):
+        if PRELOAD_NEIGHBOUR_LEVELS:
+            self.levels.preload_neighbours(self.current_level)
 
-        transition_map()
-        update_player_attributes()
+    def start_background_loading(self):
+        """ Starts loading what the first frame does not need, called once the first frame has been drawn (and by
+            headless runs before the first step)
+        """
+        if not self.background_loading_started:
+            self.background_loading_started = True
+            self.preload_neighbour_levels()
+
+    def is_background_loading(self) -> bool:
+        return not self.background_loading_started or bool(self.levels.pending)
 
     def update_groups(self):
         # get the pygame group member objects of the current level
@@ -73,16 +128,50 @@ class LevelHandler(Observer):
             self.transition_sprites_group, self.spawn_points_group = self.current_level.get_level_groups()
 
     def get_spawn_point(self, spawn_point_id):
-        for sprite in self.spawn_points_group:
-            if sprite.get_spawn_point_id() == spawn_point_id:
-                return sprite
-
-        return None
+        # streamed levels may have to load the chunk of the spawn point first
+        return self.current_level.get_spawn_point(spawn_point_id)
 
-    # Override
-    def observer_update(self):
-        if self.current_level_code != self.player.get_current_level_code():
+    def on_level_changed(self, event: LevelChanged):
+        if event.player is self.player and self.current_level_code != self.player.get_current_level_code():
             self.transition()
 
-    def run(self):
-        self.current_level.run()
+    def update(self):
+        """ One fixed simulation step, level transitions happen here """
+        # build any level whose map finished loading in the background
+        self.levels.poll()
+        self.poll_hot_reload()
+        self.current_level.update()
+        # level transitions and the other events of the step are handled here
+        event_bus.dispatch()
+        self.update_offscreen_levels()
+
+    def poll_hot_reload(self):
+        if self.hot_reloader:
+            self.hot_reloader.poll()
+
+    def update_offscreen_levels(self):
+        if self.offscreen_simulation:
+            self.offscreen_simulation.update(self.levels.levels, self.current_level_code)
+
+    def draw(self, alpha: float = 1.0) -> list[pygame.Rect]:
+        # a transition requests a full redraw of the new level
+        dirty_rects = self.current_level.draw(alpha)
+        self.start_background_loading()
+        return dirty_rects
+
+    def run(self) -> list[pygame.Rect]:
+        # build any level whose map finished loading in the background
+        self.levels.poll()
+        self.poll_hot_reload()
+
+        # same order as Level.run, with the events of the update dispatched before the overlay is drawn
+        level = self.current_level
+        dirty_rects = level.draw_world()
+        level.update()
+        event_bus.dispatch()
+        self.update_offscreen_levels()
+        dirty_rects += level.draw_overlay()
+        self.start_background_loading()
+
+        # a transition during the update has drawn the new level over the whole screen
+        return dirty_rects if self.current_level is level else [self.display_surface.get_rect()]
@@ -1,31 +1,173 @@
+# imported first so the startup trace covers the other imports
+from startupTrace import startup_trace
 import pygame
 import sys
 import os
+import time
+import argparse
+from typing import Optional, TYPE_CHECKING
 from settings import *
-from level import Level
-from levelHandler import LevelHandler
+from inputReplay import InputRecorder, ScriptedInput
+from profiler import profiler
+
+# the levels and everything they use (numpy, the map loader, crowds, save states) are imported once the window is open
+if TYPE_CHECKING:
+    from saveState import Snapshot
+
+PROFILER_TOGGLE_KEY = pygame.K_F3
+PROFILER_EXPORT_KEY = pygame.K_F4
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, record_input_path: str = None, headless: bool = False, snapshot: Optional["Snapshot"] = None,
+                 native_resolution: bool = NATIVE_RESOLUTION_RENDERING, window_scale: int = WINDOW_SCALE,
+                 hot_reload: bool = HOT_RELOAD, trace_startup: bool = False):
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
         pygame.init()
-        self.main_screen = pygame.display.set_mode((WIDTH, HEIGHT))
+
+        # at native resolution the window can be any whole multiple of the native resolution
+        window_size = (WIDTH // SCALE * window_scale, HEIGHT // SCALE * window_scale) if native_resolution \
+            else (WIDTH, HEIGHT)
+        self.main_screen = pygame.display.set_mode(window_size)
         self.clock = pygame.time.Clock()
+        startup_trace.mark("display")
+
+        from level import YSortCameraGroup
+        from levelHandler import LevelHandler
+        YSortCameraGroup.native_resolution = native_resolution
+        self.level_handler = LevelHandler(snapshot, hot_reload)
+        startup_trace.mark("level handler")
+
+        # headless runs are benchmarks and replays and startup traces only measure, they never overwrite the save
+        self.autosaver = None
+        if AUTOSAVE and not headless and not trace_startup:
+            from saveState import Autosaver
+            self.autosaver = Autosaver()
+        # quit once everything loaded in the background is built and report the startup milestones
+        self.trace_startup = trace_startup
+
+        # record the player's key presses so they can be replayed by benchmark.py
+        self.record_input_path = record_input_path
+        self.input_recorder = None
+        if record_input_path:
+            self.input_recorder = InputRecorder()
+            self.level_handler.player.set_input_source(self.input_recorder.get_pressed)
+
+    def quit(self):
+        if self.input_recorder:
+            self.input_recorder.save(self.record_input_path)
+
+        if self.autosaver:
+            self.autosaver.save(self.level_handler)
+            self.autosaver.flush()
+
+        self.level_handler.shutdown()
+        sys.exit()
+
+    def handle_events(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.quit()
+
+            if event.type == pygame.KEYDOWN and event.key == PROFILER_TOGGLE_KEY:
+                profiler.toggle()
 
-        self.level_handler = LevelHandler()
+            if event.type == pygame.KEYDOWN and event.key == PROFILER_EXPORT_KEY:
+                for path in profiler.export():
+                    print(f"profile written to {path}")
 
     def run(self):
+        """ Fixed timestep loop: the simulation advances in steps of 1 / TICK_RATE seconds however long frames take
+            and every frame is drawn interpolated between the last two steps
+        """
+        tick_duration = 1 / TICK_RATE
+        accumulator = 0.0
+        previous_time = time.perf_counter()
+
         while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    sys.exit()
+            profiler.begin_frame()
+            self.handle_events()
+
+            now = time.perf_counter()
+            accumulator += now - previous_time
+            previous_time = now
+
+            steps = 0
+            while accumulator >= tick_duration and steps < MAX_UPDATES_PER_FRAME:
+                self.level_handler.update()
+                if self.autosaver:
+                    self.autosaver.update(self.level_handler)
+                accumulator -= tick_duration
+                steps += 1
 
-            self.main_screen.fill("black")
-            self.level_handler.run()
-            pygame.display.update()
+            # drop the time that could not be caught up with
+            if accumulator >= tick_duration:
+                accumulator = tick_duration * 0.999
+
+            # only the areas that changed are sent to the display
+            alpha = accumulator / tick_duration if INTERPOLATE_RENDERING else 1.0
+            dirty_rects = self.level_handler.draw(alpha)
+            pygame.display.update(dirty_rects)
+            startup_trace.mark("first frame")
+            if self.trace_startup and not self.level_handler.is_background_loading():
+                startup_trace.mark("background loading finished")
+                startup_trace.report()
+                self.quit()
+            profiler.end_frame()
             self.clock.tick(FPS)
 
+    def run_headless(self, ticks: int):
+        """ Runs the simulation as fast as possible without drawing """
+        self.level_handler.start_background_loading()
+        start = time.perf_counter()
+        for _ in range(ticks):
+            pygame.event.pump()
+            self.level_handler.update()
+        elapsed = time.perf_counter() - start
+
+        print(f"{ticks} ticks ({ticks / TICK_RATE:.1f} s of game time) in {elapsed:.2f} s, "
+              f"{ticks / elapsed:.0f} ticks per second")
+        print(f"player at {self.level_handler.player.rect.center} in level {self.level_handler.current_level_code}")
+
 
 if __name__ == "__main__":
-    game = Game()
-    game.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record-input", metavar="PATH", help="save the key presses as a replayable key script")
+    parser.add_argument("--headless", action="store_true", help="run the simulation only, as fast as possible")
+    parser.add_argument("--ticks", type=int, default=TICK_RATE * 60, help="simulation steps to run headless")
+    parser.add_argument("--input", metavar="SCRIPT", help="replay a key script instead of reading the keyboard")
+    parser.add_argument("--resume", metavar="PATH", nargs="?", const=AUTOSAVE_FILE_PATH,
+                        help="continue from a save state (the autosave if no path is given)")
+    parser.add_argument("--native-resolution", action="store_true", default=NATIVE_RESOLUTION_RENDERING,
+                        help="draw at the original tile size and scale each frame up to the window")
+    parser.add_argument("--window-scale", type=int, default=WINDOW_SCALE,
+                        help="window size in multiples of the native resolution, with --native-resolution")
+    parser.add_argument("--hot-reload", action="store_true", default=HOT_RELOAD,
+                        help="reload maps, tilesets and the transition mapping when they are saved")
+    parser.add_argument("--startup-trace", action="store_true",
+                        help="print the startup milestones and quit once loading has finished (see startupTrace.py)")
+    args = parser.parse_args()
+    startup_trace.mark("imports")
+
+    snapshot = None
+    if args.resume:
+        from saveState import SaveStateError, load_snapshot
+
+        if not os.path.isfile(args.resume):
+            parser.exit(1, f"cannot resume, there is no save state at {args.resume}\n")
+        try:
+            snapshot = load_snapshot(args.resume)
+        except SaveStateError as error:
+            parser.exit(1, f"cannot resume from {args.resume}: {error}\n")
+
+    game = Game(record_input_path=args.record_input, headless=args.headless, snapshot=snapshot,
+                native_resolution=args.native_resolution, window_scale=args.window_scale, hot_reload=args.hot_reload,
+                trace_startup=args.startup_trace)
+    if args.input:
+        game.level_handler.player.set_input_source(ScriptedInput(ScriptedInput.load_script(args.input)).get_pressed)
+
+    if args.headless:
+        game.run_headless(args.ticks)
+    else:
+        game.run()
@@ -0,0 +1,189 @@
+""" Compiles .tmx maps into cache files that load without pytmx parsing or tile scaling.
+
+    python mapCompiler.py build [--force] [maps ...]   compile stale (or all) maps and their navigation data
+    python mapCompiler.py check [maps ...]             report which caches are stale, exits with 1 if any are
+    python mapCompiler.py bench [--repeat N] [maps ...] compare level load times from .tmx and from the cache
+    python mapCompiler.py stream [--force] [maps ...]  split compiled maps into chunks for the streaming world mode
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import pygame
+import pytmx
+import numpy as np
+from settings import *
+from mapLoader import COMPILED_MAP_FORMAT_VERSION, ATLAS_COLUMNS, parse_tmx, get_map_cache_path, \
+    get_source_hashes, get_atlas_rect, get_tile_keys, is_cache_fresh, load_compiled_map
+from navigation import load_navigation
+from worldStreamer import get_stream_path, is_stream_fresh, write_stream
+
+
+def get_map_paths(map_names: list[str]) -> list[str]:
+    if map_names:
+        return [map_name if os.path.isfile(map_name) else os.path.join(MAPS_FILE_PATH, map_name)
+                for map_name in map_names]
+
+    return [os.path.join(MAPS_FILE_PATH, file_name) for file_name in sorted(os.listdir(MAPS_FILE_PATH))
+            if file_name.endswith(".tmx")]
+
+
+def compile_map(map_path: str, cache_path: str):
+    tmx_data = parse_tmx(map_path)
+
+    # only the tiles used by the map go into the atlas, gids are remapped to atlas indexes starting at 1
+    atlas_indexes = {}
+    layers, arrays = [], {}
+    for index, layer in enumerate(tmx_data.layers):
+        if isinstance(layer, pytmx.TiledTileLayer):
+            gids = np.zeros((layer.height, layer.width), dtype=np.uint16)
+            for y, row in enumerate(layer.data):
+                for x, gid in enumerate(row):
+                    if gid and tmx_data.images[gid] is not None:
+                        gids[y, x] = atlas_indexes.setdefault(gid, len(atlas_indexes) + 1)
+
+            arrays[f"layer_{index}"] = gids
+            layers.append({"type": "tile", "name": layer.name, "visible": bool(layer.visible)})
+
+        elif isinstance(layer, pytmx.TiledObjectGroup):
+            objects = [{"id": map_object.id, "name": map_object.name, "type": map_object.type,
+                        "x": map_object.x, "y": map_object.y, "width": map_object.width,
+                        "height": map_object.height, "properties": dict(map_object.properties)}
+                       for map_object in layer]
+            layers.append({"type": "objects", "name": layer.name, "visible": bool(layer.visible),
+                           "objects": objects})
+
+    # tiles are stored with per pixel alpha so colorkeyed tilesets keep their transparency
+    rows = max(1, -(-len(atlas_indexes) // ATLAS_COLUMNS))
+    atlas = pygame.Surface((ATLAS_COLUMNS * TILE_SIZE, rows * TILE_SIZE), pygame.SRCALPHA)
+    opaque = [False] * len(atlas_indexes)
+    gid_tile_keys, tile_keys = get_tile_keys(tmx_data), [None] * len(atlas_indexes)
+    for gid, atlas_index in atlas_indexes.items():
+        atlas_rect = get_atlas_rect(atlas_index - 1)
+        atlas.blit(tmx_data.images[gid], atlas_rect)
+        # same transparency test as pytmx's smart_convert, so the loaded tiles get the same pixel format
+        tile_mask = pygame.mask.from_surface(atlas.subsurface(atlas_rect), 254)
+        opaque[atlas_index - 1] = tile_mask.count() == TILE_SIZE * TILE_SIZE
+        tile_keys[atlas_index - 1] = gid_tile_keys[gid]
+
+    atlas_pixels = np.frombuffer(pygame.image.tobytes(atlas, "RGBA"), dtype=np.uint8)
+    arrays["atlas"] = atlas_pixels.reshape(atlas.get_height(), atlas.get_width(), 4)
+
+    metadata = {"version": COMPILED_MAP_FORMAT_VERSION, "tile_size": TILE_SIZE,
+                "sources": get_source_hashes(map_path), "width": tmx_data.width, "height": tmx_data.height,
+                "tile_count": len(atlas_indexes), "opaque": opaque, "tile_keys": tile_keys, "layers": layers}
+    arrays["metadata"] = np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # write to a temporary file first so a running game never reads a half written cache
+    temporary_path = cache_path + ".tmp"
+    with open(temporary_path, "wb") as cache_file:
+        np.savez(cache_file, **arrays)
+    os.replace(temporary_path, cache_path)
+
+
+def build(map_paths: list[str], force: bool):
+    for map_path in map_paths:
+        cache_path = get_map_cache_path(map_path)
+        if not force and is_cache_fresh(map_path, cache_path):
+            print(f"{os.path.basename(map_path)}: up to date")
+        else:
+            start = time.perf_counter()
+            compile_map(map_path, cache_path)
+            print(f"{os.path.basename(map_path)}: compiled in {(time.perf_counter() - start) * 1000:.1f} ms "
+                  f"-> {os.path.relpath(cache_path, ROOT_DIR)}")
+
+        # navigation data is rebuilt only if the .tmx file changed
+        load_navigation(map_path, load_compiled_map(cache_path, map_path))
+
+
+def stream(map_paths: list[str], force: bool):
+    for map_path in map_paths:
+        stream_path = get_stream_path(map_path)
+        if not force and is_stream_fresh(map_path, stream_path):
+            print(f"{os.path.basename(map_path)}: stream up to date")
+            continue
+
+        start = time.perf_counter()
+        cache_path = get_map_cache_path(map_path)
+        if not is_cache_fresh(map_path, cache_path):
+            compile_map(map_path, cache_path)
+
+        write_stream(load_compiled_map(cache_path, map_path), stream_path, get_source_hashes(map_path))
+        print(f"{os.path.basename(map_path)}: streamed in {(time.perf_counter() - start) * 1000:.1f} ms "
+              f"-> {os.path.relpath(stream_path, ROOT_DIR)}")
+
+
+def check(map_paths: list[str]) -> bool:
+    all_fresh = True
+    for map_path in map_paths:
+        fresh = is_cache_fresh(map_path, get_map_cache_path(map_path))
+        all_fresh = all_fresh and fresh
+        print(f"{os.path.basename(map_path)}: {'fresh' if fresh else 'stale'}")
+
+    return all_fresh
+
+
+def bench(map_paths: list[str], repeat: int):
+    from level import Level
+    from mapLoader import convert_map_images
+
+    def time_level(load) -> tuple[float, float]:
+        # best of repeat runs, (map load and conversion, full level build) in ms
+        load_timings, level_timings = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            map_data = load()
+            convert_map_images(map_data)
+            loaded = time.perf_counter()
+            Level(map_path, tmx_data=map_data)
+            load_timings.append(loaded - start)
+            level_timings.append(time.perf_counter() - start)
+
+        return min(load_timings) * 1000, min(level_timings) * 1000
+
+    for map_path in map_paths:
+        cache_path = get_map_cache_path(map_path)
+        if not is_cache_fresh(map_path, cache_path):
+            compile_map(map_path, cache_path)
+
+        # the staleness check is part of every cached load
+        tmx_load, tmx_level = time_level(lambda: parse_tmx(map_path))
+        cache_load, cache_level = time_level(lambda: is_cache_fresh(map_path, cache_path) and
+                                             load_compiled_map(cache_path, map_path))
+        print(f"{os.path.basename(map_path)}: map load tmx {tmx_load:7.2f} ms, cache {cache_load:7.2f} ms "
+              f"({tmx_load / cache_load:.1f}x) | level build tmx {tmx_level:7.2f} ms, cache {cache_level:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("--force", action="store_true", help="recompile fresh caches too")
+    subparsers.add_parser("check")
+    bench_parser = subparsers.add_parser("bench")
+    bench_parser.add_argument("--repeat", type=int, default=5)
+    stream_parser = subparsers.add_parser("stream")
+    stream_parser.add_argument("--force", action="store_true", help="split fresh streams again too")
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("maps", nargs="*", help="map files or names in the maps folder, defaults to all")
+    args = parser.parse_args()
+
+    map_paths = get_map_paths(args.maps)
+    if args.command == "build":
+        build(map_paths, args.force)
+    elif args.command == "stream":
+        stream(map_paths, args.force)
+    elif args.command == "check":
+        sys.exit(0 if check(map_paths) else 1)
+    else:
+        # converting the tile images needs a display
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.init()
+        pygame.display.set_mode((WIDTH, HEIGHT))
+        bench(map_paths, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import os
+import json
+import hashlib
+import pygame
+import numpy as np
+from typing import Optional, Union, TYPE_CHECKING
+from xml.etree import ElementTree
+from settings import *
+from assetManager import asset_manager
+
+# pytmx is only imported once a .tmx file has to be parsed, maps with a fresh compiled cache never need it
+if TYPE_CHECKING:
+    import pytmx
+
+COMPILED_MAP_FORMAT_VERSION = 2
+COMPILED_MAP_EXTENSION = ".npz"
+# tiles per row of the compiled tile atlas
+ATLAS_COLUMNS = 16
+
+
+def deferred_image_loader(filename: str, colorkey, **kwargs):
+    """ pytmx image loader that is safe to run off the main thread. Tiles are cut out and scaled to TILE_SIZE but
+        not converted to the display format, convert_map_images has to be called on the main thread afterwards.
+    """
+    from pytmx.util_pygame import handle_transformation
+
+    image = pygame.image.load(filename)
+    if colorkey:
+        image.set_colorkey(pygame.Color(f"#{colorkey}"))
+
+    def load_image(rect=None, flags=None):
+        tile = image.subsurface(rect) if rect else image
+        if flags:
+            tile = handle_transformation(tile, flags)
+
+        return pygame.transform.scale(tile, (TILE_SIZE, TILE_SIZE))
+
+    return load_image
+
+
+def parse_tmx(map_path: str) -> "pytmx.TiledMap":
+    """ Parses a .tmx file and prepares its tile images, this does not touch the display so it can run on a worker
+        thread
+    """
+    import pytmx
+
+    return pytmx.TiledMap(map_path, image_loader=deferred_image_loader)
+
+
+def get_tile_keys(tmx_data: "pytmx.TiledMap") -> list[Optional[tuple[str, str]]]:
+    """ Returns the (tileset image, tile) key of every gid of a parsed map, which identifies a tile image independently
+        of the map using it. The tile part is the tile id in the tileset followed by the colorkey and flip flags.
+    """
+    map_folder = os.path.dirname(tmx_data.filename)
+    tile_keys = [None] * len(tmx_data.images)
+    # tileset image of each tileset source, relpath is slow enough to matter when a map is hot reloaded
+    sources = {}
+    for tiled_gid, gids in tmx_data.gidmap.items():
+        # gidmap is a defaultdict, lookups of unused gids leave empty entries behind
+        if not gids:
+            continue
+
+        tileset = tmx_data.get_tileset_from_gid(gids[0][0])
+        if tileset.source not in sources:
+            sources[tileset.source] = os.path.relpath(os.path.normpath(os.path.join(map_folder, tileset.source)),
+                                                      ROOT_DIR)
+        source = sources[tileset.source]
+        tile = str(tiled_gid - tileset.firstgid) + (f"#{tileset.trans}" if tileset.trans else "")
+        for gid, flags in gids:
+            flips = "".join(letter for letter, flag in zip("hvd", flags) if flag)
+            tile_keys[gid] = (source, f"{tile}:{flips}" if flips else tile)
+
+    return tile_keys
+
+
+def convert_map_images(map_data: Union["pytmx.TiledMap", "CompiledMap"]):
+    """ Converts the tile images of a map to the display format and replaces them with the shared surface of the same
+        tile if another map already loaded it, must run on the main thread
+    """
+    if isinstance(map_data, CompiledMap):
+        map_data.convert_images()
+        return
+
+    from pytmx.util_pygame import smart_convert
+
+    tile_keys = get_tile_keys(map_data)
+    for gid, image in enumerate(map_data.images):
+        if image is not None:
+            # tiles already loaded by another map (or by an earlier load of this one) are not converted again
+            shared = asset_manager.get_tile(tile_keys[gid], image.get_size())
+            map_data.images[gid] = shared if shared is not None else \
+                asset_manager.intern_tile(tile_keys[gid], smart_convert(image, None, True))
+
+
+def get_map_cache_path(map_path: str) -> str:
+    """ Maps with the same file name in different folders get different cache files """
+    map_name = os.path.splitext(os.path.basename(map_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(map_path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(MAP_CACHE_FILE_PATH, f"{map_name}_{path_hash}{COMPILED_MAP_EXTENSION}")
+
+
+def get_map_sources(map_path: str) -> list[str]:
+    """ Returns the .tmx file and every tileset and image file it depends on """
+    sources = [map_path]
+
+    def add_images(node: ElementTree.Element, base_path: str):
+        for image in node.iter("image"):
+            sources.append(os.path.normpath(os.path.join(base_path, image.get("source"))))
+
+    map_folder = os.path.dirname(map_path)
+    root = ElementTree.parse(map_path).getroot()
+    for tileset in root.iter("tileset"):
+        if tileset.get("source"):
+            tileset_path = os.path.normpath(os.path.join(map_folder, tileset.get("source")))
+            sources.append(tileset_path)
+            add_images(ElementTree.parse(tileset_path).getroot(), os.path.dirname(tileset_path))
+        else:
+            add_images(tileset, map_folder)
+
+    # image layers
+    for layer in root.iter("imagelayer"):
+        add_images(layer, map_folder)
+
+    return sources
+
+
+def get_file_hash(path: str) -> str:
+    with open(path, "rb") as source_file:
+        return hashlib.sha1(source_file.read()).hexdigest()
+
+
+def get_source_hashes(map_path: str) -> dict[str, str]:
+    return {os.path.relpath(source, ROOT_DIR): get_file_hash(source) for source in get_map_sources(map_path)}
+
+
+class CompiledObject:
+    """ Stand in for pytmx.TiledObject, custom properties are available as attributes """
+    def __init__(self, object_data: dict):
+        self.id = object_data["id"]
+        self.name = object_data["name"]
+        self.type = object_data["type"]
+        self.x, self.y = object_data["x"], object_data["y"]
+        self.width, self.height = object_data["width"], object_data["height"]
+        self.properties = object_data["properties"]
+
+    def __getattr__(self, item):
+        try:
+            return self.__dict__["properties"][item]
+        except KeyError:
+            raise AttributeError(item)
+
+
+class CompiledObjectGroup(list):
+    """ Stand in for pytmx.TiledObjectGroup """
+    def __init__(self, name: str, visible: bool, objects: list[CompiledObject]):
+        super().__init__(objects)
+        self.name = name
+        self.visible = visible
+
+
+class CompiledTileLayer:
+    """ Stand in for pytmx.TiledTileLayer, data holds indexes into the images of the owning CompiledMap """
+    def __init__(self, name: str, visible: bool, data: np.ndarray, images: list[Optional[pygame.Surface]]):
+        self.name = name
+        self.visible = visible
+        self.data = data
+        self.images = images
+        self.width, self.height = data.shape[1], data.shape[0]
+
+    def tiles(self):
+        # same row major order as pytmx
+        for y, x in zip(*np.nonzero(self.data)):
+            yield int(x), int(y), self.images[self.data[y, x]]
+
+
+class CompiledMap:
+    """ Map loaded from a cache file written by mapCompiler, exposes the subset of the pytmx.TiledMap interface that
+        the game uses
+    """
+    def __init__(self, filename: str, width: int, height: int, layers: list, atlas: pygame.Surface,
+                 opaque: list[bool], images: list[Optional[pygame.Surface]],
+                 tile_keys: Optional[list] = None):
+        self.filename = filename
+        self.width, self.height = width, height
+        self.tilewidth = self.tileheight = ORIGINAL_TILE_SIZE
+        self.layers = layers
+        self.atlas = atlas
+        self.opaque = opaque
+        self.images = images
+        # get_tile_keys key of every atlas tile, generated maps have none and their tiles are not shared
+        self.tile_keys = tile_keys if tile_keys is not None else [None] * len(opaque)
+        self.objects_by_id = {map_object.id: map_object for layer in layers
+                              if isinstance(layer, CompiledObjectGroup) for map_object in layer}
+
+    def convert_images(self):
+        """ Converts the atlas once and cuts the tiles out of it, tiles without transparent pixels are converted
+            without per pixel alpha like pytmx does
+        """
+        atlas = self.atlas.convert_alpha()
+        for index, (opaque, tile_key) in enumerate(zip(self.opaque, self.tile_keys)):
+            tile = atlas.subsurface(get_atlas_rect(index))
+            # keys read back from JSON are lists
+            self.images[index + 1] = asset_manager.intern_tile(tuple(tile_key) if tile_key is not None else None,
+                                                               tile.convert() if opaque else tile.copy())
+
+        # the converted tiles are copies, so the atlas is no longer needed
+        self.atlas = None
+
+    @property
+    def visible_layers(self):
+        return (layer for layer in self.layers if layer.visible)
+
+    @property
+    def objects(self):
+        return self.objects_by_id.values()
+
+    def get_layer_by_name(self, name: str):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+
+        raise ValueError(f"layer '{name}' not found")
+
+    def get_object_by_id(self, object_id: int) -> CompiledObject:
+        return self.objects_by_id[object_id]
+
+
+def get_atlas_rect(index: int) -> tuple[int, int, int, int]:
+    row, column = divmod(index, ATLAS_COLUMNS)
+    return column * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE
+
+
+def load_atlas(atlas: np.ndarray, tile_count: int) -> tuple[pygame.Surface, list[Optional[pygame.Surface]]]:
+    """ Returns the atlas surface of RGBA atlas pixels and the images list of a map cut out of it, index 0 is empty """
+    atlas_surface = pygame.image.frombuffer(atlas.tobytes(), (atlas.shape[1], atlas.shape[0]), "RGBA")
+    return atlas_surface, [None] + [atlas_surface.subsurface(get_atlas_rect(index)) for index in range(tile_count)]
+
+
+def read_cache_metadata(cache: np.lib.npyio.NpzFile) -> dict:
+    return json.loads(cache["metadata"].tobytes().decode("utf-8"))
+
+
+def is_cache_fresh(map_path: str, cache_path: str) -> bool:
+    """ A cache is fresh if it was compiled with the current format and tile size from sources with the same
+        contents as the current ones
+    """
+    if not os.path.isfile(cache_path):
+        return False
+
+    try:
+        with np.load(cache_path) as cache:
+            metadata = read_cache_metadata(cache)
+    except (OSError, ValueError, KeyError):
+        return False
+
+    if metadata.get("version") != COMPILED_MAP_FORMAT_VERSION or metadata.get("tile_size") != TILE_SIZE:
+        return False
+
+    try:
+        return metadata["sources"] == get_source_hashes(map_path)
+    except (OSError, ElementTree.ParseError):
+        return False
+
+
+def load_compiled_map(cache_path: str, map_path: str) -> CompiledMap:
+    """ Loads a compiled map, like parse_tmx the images still have to be converted on the main thread """
+    with np.load(cache_path) as cache:
+        metadata = read_cache_metadata(cache)
+        atlas = cache["atlas"]
+        layer_data = {index: cache[f"layer_{index}"] for index, layer in enumerate(metadata["layers"])
+                      if layer["type"] == "tile"}
+
+    atlas_surface, images = load_atlas(atlas, metadata["tile_count"])
+
+    layers = []
+    for index, layer in enumerate(metadata["layers"]):
+        if layer["type"] == "tile":
+            layers.append(CompiledTileLayer(layer["name"], layer["visible"], layer_data[index], images))
+        else:
+            objects = [CompiledObject(object_data) for object_data in layer["objects"]]
+            layers.append(CompiledObjectGroup(layer["name"], layer["visible"], objects))
+
+    return CompiledMap(map_path, metadata["width"], metadata["height"], layers, atlas_surface, metadata["opaque"],
+                       images, metadata["tile_keys"])
+
+
+def load_map_data(map_path: str) -> Union["pytmx.TiledMap", CompiledMap]:
+    """ Loads a map from its compiled cache when it is fresh and from the .tmx file otherwise. Safe to call from a
+        worker thread, the images still have to be converted with convert_map_images.
+    """
+    if USE_MAP_CACHE:
+        cache_path = get_map_cache_path(map_path)
+        if is_cache_fresh(map_path, cache_path):
+            return load_compiled_map(cache_path, map_path)
+
+    return parse_tmx(map_path)
+
+
+def load_map(map_path: str) -> Union["pytmx.TiledMap", CompiledMap]:
+    map_data = load_map_data(map_path)
+    convert_map_images(map_data)
+    return map_data
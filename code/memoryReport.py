@@ -0,0 +1,97 @@
+""" Loads every level and reports the surface memory used per level, per layer and per asset (image file or tileset).
+
+    python memoryReport.py [--output report.json] [--level-budget MB] [--total-budget MB]
+    exits with 1 if a level or the total is over its budget (MEMORY_LEVEL_BUDGET_MB and MEMORY_TOTAL_BUDGET_MB by
+    default)
+"""
+import os
+import sys
+import json
+import argparse
+from typing import Optional
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+from settings import *
+from levelCache import LevelCache, discover_levels
+from assetManager import asset_manager
+
+
+def format_bytes(byte_count: int) -> str:
+    return f"{byte_count / 2 ** 20:8.2f} MiB"
+
+
+def print_report(report: dict):
+    for level_code, level_report in report["levels"].items():
+        print(f"level {level_code}: {format_bytes(level_report['total'])}")
+        for name, byte_count in level_report["layers"].items():
+            print(f"    layer {name:<40} {format_bytes(byte_count)}")
+        for name, byte_count in level_report["assets"].items():
+            print(f"    asset {name:<40} {format_bytes(byte_count)}")
+        print(f"    {'floor chunks':<46} {format_bytes(level_report['floor_chunks'])}")
+
+    print("shared assets:")
+    for name, byte_count in sorted(report["assets"].items()):
+        print(f"    {name:<46} {format_bytes(byte_count)}")
+    print(f"total (shared surfaces counted once): {format_bytes(report['total'])}")
+
+
+def check_budgets(report: dict, level_budget: Optional[float] = None,
+                  total_budget: Optional[float] = None) -> list[str]:
+    """ Returns a description of every budget (in MiB) that is exceeded """
+    failures = []
+    if level_budget is not None:
+        for level_code, level_report in report["levels"].items():
+            if level_report["total"] > level_budget * 2 ** 20:
+                failures.append(f"level {level_code} uses {format_bytes(level_report['total']).strip()}, "
+                                f"budget {level_budget} MiB")
+
+    if total_budget is not None and report["total"] > total_budget * 2 ** 20:
+        failures.append(f"total is {format_bytes(report['total']).strip()}, budget {total_budget} MiB")
+
+    return failures
+
+
+def get_memory_report() -> dict:
+    """ Builds every level through a LevelCache that keeps them all and loads the player animations like the game,
+        the display must exist
+    """
+    level_paths = discover_levels(MAPS_FILE_PATH)
+    levels = LevelCache(level_paths, max_levels=len(level_paths), max_bytes=None)
+    for level_code in level_paths:
+        levels.get(level_code)
+    asset_manager.get_animations(PLAYER_IMAGES_FILE_PATH, (TILE_SIZE, TILE_SIZE))
+
+    report = levels.get_memory_report()
+    levels.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", metavar="PATH", help="write the report as JSON")
+    parser.add_argument("--level-budget", type=float, default=MEMORY_LEVEL_BUDGET_MB, metavar="MB",
+                        help="largest allowed level")
+    parser.add_argument("--total-budget", type=float, default=MEMORY_TOTAL_BUDGET_MB, metavar="MB",
+                        help="largest allowed total")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+
+    report = get_memory_report()
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    failures = check_budgets(report, args.level_budget, args.total_budget)
+    for failure in failures:
+        print(f"OVER BUDGET {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
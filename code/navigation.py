@@ -0,0 +1,489 @@
+import os
+import json
+import math
+import time
+import heapq
+import hashlib
+import numpy as np
+from collections import OrderedDict, deque, defaultdict
+from typing import Generator, Optional
+from settings import *
+from mapLoader import get_file_hash
+
+NAVIGATION_FORMAT_VERSION = 1
+NAVIGATION_CACHE_EXTENSION = ".npz"
+SQRT2 = math.sqrt(2)
+# (column step, row step, cost), diagonal steps may not cut the corner of a blocked tile
+NEIGHBOUR_STEPS = [(1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+                   (1, 1, SQRT2), (1, -1, SQRT2), (-1, 1, SQRT2), (-1, -1, SQRT2)]
+# border segments at least this long get an entrance at both ends instead of one in the middle
+LONG_ENTRANCE_LENGTH = 6
+# a cached route is only reused if the path it gives is at most this much longer than the straight line distance
+# (plus one cluster), otherwise the route of a different start and goal could send an entity on a long detour
+CACHED_PATH_MAX_DETOUR = 1.5
+# queued searches are advanced this many nodes at a time between checks of the time budget
+SEARCH_SLICE_NODES = 32
+
+
+def run_search(search: Generator):
+    """ Runs a search generator to the end and returns its result. Searches yield after expanding each node so
+        Navigation.update can pause them.
+    """
+    while True:
+        try:
+            next(search)
+        except StopIteration as stop:
+            return stop.value
+
+
+def octile_distance(width: int, node: int, goal: int) -> float:
+    row, column = divmod(node, width)
+    goal_row, goal_column = divmod(goal, width)
+    delta_x, delta_y = abs(column - goal_column), abs(row - goal_row)
+    return delta_x + delta_y + (SQRT2 - 2) * min(delta_x, delta_y)
+
+
+class NavigationGrid:
+    """ Walkable tiles of a level, nodes are tile indexes (row * width + column) """
+    def __init__(self, walkable: np.ndarray):
+        self.walkable = walkable
+        self.height, self.width = walkable.shape
+        # nested lists are much faster to index from python than the array
+        self.walkable_rows = walkable.tolist()
+
+    @classmethod
+    def from_collision_objects(cls, width: int, height: int, collision_objects) -> "NavigationGrid":
+        """ Every tile overlapped by a collision box (in tiled pixels, like the Collision_Objects layer) is blocked """
+        walkable = np.ones((height, width), dtype=bool)
+        for collision_object in collision_objects:
+            left, top = collision_object.x * SCALE, collision_object.y * SCALE
+            right, bottom = left + collision_object.width * SCALE, top + collision_object.height * SCALE
+            first_column, first_row = max(int(left // TILE_SIZE), 0), max(int(top // TILE_SIZE), 0)
+            end_column, end_row = math.ceil(right / TILE_SIZE), math.ceil(bottom / TILE_SIZE)
+            walkable[first_row:end_row, first_column:end_column] = False
+
+        return cls(walkable)
+
+    def get_node(self, position: tuple[float, float]) -> int:
+        column = min(max(int(position[0] // TILE_SIZE), 0), self.width - 1)
+        row = min(max(int(position[1] // TILE_SIZE), 0), self.height - 1)
+        return row * self.width + column
+
+    def get_position(self, node: int) -> tuple[int, int]:
+        """ World position of the centre of a tile """
+        row, column = divmod(node, self.width)
+        return column * TILE_SIZE + TILE_SIZE // 2, row * TILE_SIZE + TILE_SIZE // 2
+
+    def is_walkable(self, node: int) -> bool:
+        row, column = divmod(node, self.width)
+        return self.walkable_rows[row][column]
+
+    def get_nearest_walkable(self, node: int, radius: int = 2) -> Optional[int]:
+        """ Entities can stand partly on blocked tiles, their path starts from the closest walkable tile """
+        if self.is_walkable(node):
+            return node
+
+        row, column = divmod(node, self.width)
+        candidates = [(abs(row_step) + abs(column_step), (row + row_step) * self.width + column + column_step)
+                      for row_step in range(-radius, radius + 1) for column_step in range(-radius, radius + 1)
+                      if 0 <= row + row_step < self.height and 0 <= column + column_step < self.width]
+        for _, candidate in sorted(candidates):
+            if self.is_walkable(candidate):
+                return candidate
+
+        return None
+
+    def get_neighbours(self, node: int, bounds: tuple[int, int, int, int]):
+        """ Yields (node, cost) for the walkable neighbours of node inside bounds (first column, first row, end
+            column, end row)
+        """
+        walkable_rows = self.walkable_rows
+        row, column = divmod(node, self.width)
+        first_column, first_row, end_column, end_row = bounds
+        for column_step, row_step, cost in NEIGHBOUR_STEPS:
+            next_column, next_row = column + column_step, row + row_step
+            if first_column <= next_column < end_column and first_row <= next_row < end_row and \
+                    walkable_rows[next_row][next_column]:
+                if column_step and row_step and \
+                        not (walkable_rows[row][next_column] and walkable_rows[next_row][column]):
+                    continue
+                yield next_row * self.width + next_column, cost
+
+    def get_distances(self, start: int, bounds: tuple[int, int, int, int]) -> dict[int, float]:
+        return run_search(self.search_distances(start, bounds))
+
+    def search_distances(self, start: int, bounds: tuple[int, int, int, int]) \
+            -> Generator[None, None, dict[int, float]]:
+        """ Dijkstra from start to every node reachable inside bounds """
+        distances = {start: 0.0}
+        queue = [(0.0, start)]
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if distance > distances[node]:
+                continue
+
+            yield
+
+            for neighbour, cost in self.get_neighbours(node, bounds):
+                new_distance = distance + cost
+                if new_distance < distances.get(neighbour, math.inf):
+                    distances[neighbour] = new_distance
+                    heapq.heappush(queue, (new_distance, neighbour))
+
+        return distances
+
+    def find_path(self, start: int, goal: int, bounds: Optional[tuple[int, int, int, int]] = None) \
+            -> Optional[list[int]]:
+        return run_search(self.search_path(start, goal, bounds))
+
+    def search_path(self, start: int, goal: int, bounds: Optional[tuple[int, int, int, int]] = None) \
+            -> Generator[None, None, Optional[list[int]]]:
+        """ A* between two nodes, staying inside bounds (the whole grid by default) """
+        bounds = bounds or (0, 0, self.width, self.height)
+        costs = {start: 0.0}
+        parents = {start: None}
+        queue = [(octile_distance(self.width, start, goal), 0.0, start)]
+        while queue:
+            _, cost, node = heapq.heappop(queue)
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                return path[::-1]
+
+            if cost > costs[node]:
+                continue
+
+            yield
+
+            for neighbour, step_cost in self.get_neighbours(node, bounds):
+                new_cost = cost + step_cost
+                if new_cost < costs.get(neighbour, math.inf):
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = node
+                    heapq.heappush(queue, (new_cost + octile_distance(self.width, neighbour, goal), new_cost,
+                                           neighbour))
+
+        return None
+
+
+class NavigationHierarchy:
+    """ HPA* abstraction of a NavigationGrid. The grid is split into square clusters, walkable tile pairs on the
+        borders between clusters become entrances and the entrances of each cluster are connected by their shortest
+        distance inside the cluster. Path queries search the small abstract graph and then refine each abstract edge
+        with an A* search bounded to one cluster.
+    """
+    def __init__(self, grid: NavigationGrid, cluster_size: int = NAVIGATION_CLUSTER_SIZE,
+                 edges: Optional[dict[int, list[tuple[int, float]]]] = None):
+        self.grid = grid
+        self.cluster_size = cluster_size
+        self.cluster_columns = -(-grid.width // cluster_size)
+        # abstract graph, entrance node -> [(entrance node, cost)]
+        self.edges = edges if edges is not None else self.build_edges()
+        self.cluster_entrances = defaultdict(list)
+        for node in self.edges:
+            self.cluster_entrances[self.get_cluster(node)].append(node)
+
+    def get_cluster(self, node: int) -> int:
+        row, column = divmod(node, self.grid.width)
+        return (row // self.cluster_size) * self.cluster_columns + column // self.cluster_size
+
+    def get_cluster_bounds(self, cluster: int) -> tuple[int, int, int, int]:
+        cluster_row, cluster_column = divmod(cluster, self.cluster_columns)
+        first_column, first_row = cluster_column * self.cluster_size, cluster_row * self.cluster_size
+        return first_column, first_row, min(first_column + self.cluster_size, self.grid.width), \
+            min(first_row + self.cluster_size, self.grid.height)
+
+    def find_entrances(self) -> list[tuple[int, int]]:
+        """ Returns the (node, node) tile pairs connecting neighbouring clusters """
+        grid, size = self.grid, self.cluster_size
+        walkable = grid.walkable
+        entrances = []
+
+        def add_segments(open_cells: np.ndarray, get_pair):
+            # one entrance in the middle of every run of open border cells, or one at each end of long runs
+            padded = np.concatenate([[False], open_cells, [False]])
+            changes = np.flatnonzero(padded[1:] != padded[:-1])
+            for start, end in zip(changes[::2].tolist(), changes[1::2].tolist()):
+                offsets = [start, end - 1] if end - start >= LONG_ENTRANCE_LENGTH else [(start + end - 1) // 2]
+                entrances.extend(get_pair(offset) for offset in offsets)
+
+        # vertical borders between horizontally neighbouring clusters
+        for column in range(size, grid.width, size):
+            for first_row in range(0, grid.height, size):
+                end_row = min(first_row + size, grid.height)
+                open_cells = walkable[first_row:end_row, column - 1] & walkable[first_row:end_row, column]
+                add_segments(open_cells, lambda offset: ((first_row + offset) * grid.width + column - 1,
+                                                         (first_row + offset) * grid.width + column))
+
+        # horizontal borders between vertically neighbouring clusters
+        for row in range(size, grid.height, size):
+            for first_column in range(0, grid.width, size):
+                end_column = min(first_column + size, grid.width)
+                open_cells = walkable[row - 1, first_column:end_column] & walkable[row, first_column:end_column]
+                add_segments(open_cells, lambda offset: ((row - 1) * grid.width + first_column + offset,
+                                                         row * grid.width + first_column + offset))
+
+        return entrances
+
+    def build_edges(self) -> dict[int, list[tuple[int, float]]]:
+        edges = defaultdict(list)
+        for node, other_node in self.find_entrances():
+            edges[node].append((other_node, 1.0))
+            edges[other_node].append((node, 1.0))
+
+        entrances_by_cluster = defaultdict(list)
+        for node in edges:
+            entrances_by_cluster[self.get_cluster(node)].append(node)
+
+        for cluster, entrances in entrances_by_cluster.items():
+            bounds = self.get_cluster_bounds(cluster)
+            for node in entrances:
+                distances = self.grid.get_distances(node, bounds)
+                edges[node].extend((other_node, distances[other_node]) for other_node in entrances
+                                   if other_node != node and other_node in distances)
+
+        return dict(edges)
+
+    def search_entrance_distances(self, node: int) -> Generator[None, None, dict[int, float]]:
+        """ Distances from a node to the reachable entrances of its cluster """
+        cluster = self.get_cluster(node)
+        distances = yield from self.grid.search_distances(node, self.get_cluster_bounds(cluster))
+        return {entrance: distances[entrance] for entrance in self.cluster_entrances[cluster] if entrance in distances}
+
+    def find_abstract_path(self, start: int, goal: int) -> Optional[list[int]]:
+        return run_search(self.search_abstract_path(start, goal))
+
+    def search_abstract_path(self, start: int, goal: int) -> Generator[None, None, Optional[list[int]]]:
+        """ A* over the entrances, returns the entrances passed through between start and goal """
+        start_edges = yield from self.search_entrance_distances(start)
+        goal_edges = yield from self.search_entrance_distances(goal)
+        width = self.grid.width
+
+        costs = dict(start_edges)
+        parents = dict.fromkeys(start_edges)
+        queue = [(cost + octile_distance(width, node, goal), cost, node) for node, cost in start_edges.items()]
+        heapq.heapify(queue)
+        best_goal_cost, best_goal_parent = math.inf, None
+        while queue:
+            estimate, cost, node = heapq.heappop(queue)
+            if estimate >= best_goal_cost:
+                break
+            if cost > costs[node]:
+                continue
+
+            yield
+
+            if node in goal_edges and cost + goal_edges[node] < best_goal_cost:
+                best_goal_cost, best_goal_parent = cost + goal_edges[node], node
+
+            for neighbour, edge_cost in self.edges[node]:
+                new_cost = cost + edge_cost
+                if new_cost < costs.get(neighbour, math.inf):
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = node
+                    heapq.heappush(queue, (new_cost + octile_distance(width, neighbour, goal), new_cost, neighbour))
+
+        if best_goal_parent is None:
+            return None
+
+        path, node = [], best_goal_parent
+        while node is not None:
+            path.append(node)
+            node = parents[node]
+        return path[::-1]
+
+    def refine(self, start: int, abstract_path: list[int], goal: int) -> Optional[list[int]]:
+        return run_search(self.search_refined_path(start, abstract_path, goal))
+
+    def search_refined_path(self, start: int, abstract_path: list[int], goal: int) \
+            -> Generator[None, None, Optional[list[int]]]:
+        """ Expands an abstract path into tiles, consecutive nodes in different clusters are neighbouring entrance
+            tiles and the others are connected by an A* search inside their cluster
+        """
+        path = [start]
+        for node in [*abstract_path, goal]:
+            previous_node = path[-1]
+            if node == previous_node:
+                continue
+
+            cluster = self.get_cluster(previous_node)
+            if cluster != self.get_cluster(node):
+                path.append(node)
+                continue
+
+            segment = yield from self.grid.search_path(previous_node, node, self.get_cluster_bounds(cluster))
+            if segment is None:
+                return None
+            path.extend(segment[1:])
+
+        return path
+
+    def save(self, path: str, metadata: dict):
+        edge_from = [node for node, node_edges in self.edges.items() for _ in node_edges]
+        edge_to = [other_node for node_edges in self.edges.values() for other_node, _ in node_edges]
+        edge_costs = [cost for node_edges in self.edges.values() for _, cost in node_edges]
+        metadata = {**metadata, "cluster_size": self.cluster_size}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so a running game never reads a half written file
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as navigation_file:
+            np.savez(navigation_file, walkable=self.grid.walkable, nodes=np.array(list(self.edges), dtype=np.int64),
+                     edge_from=np.array(edge_from, dtype=np.int64), edge_to=np.array(edge_to, dtype=np.int64),
+                     edge_costs=np.array(edge_costs, dtype=np.float64),
+                     metadata=np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8))
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> tuple["NavigationHierarchy", dict]:
+        with np.load(path) as navigation_file:
+            metadata = json.loads(navigation_file["metadata"].tobytes().decode("utf-8"))
+            edges = {node: [] for node in navigation_file["nodes"].tolist()}
+            for node, other_node, cost in zip(navigation_file["edge_from"].tolist(),
+                                              navigation_file["edge_to"].tolist(),
+                                              navigation_file["edge_costs"].tolist()):
+                edges[node].append((other_node, cost))
+            grid = NavigationGrid(navigation_file["walkable"])
+
+        return cls(grid, metadata["cluster_size"], edges), metadata
+
+
+class PathRequest:
+    """ Queued path query, path is a list of world positions (tile centres) or None if the goal is unreachable """
+    def __init__(self, start: tuple[float, float], goal: tuple[float, float]):
+        self.start = start
+        self.goal = goal
+        self.path = None
+        self.done = False
+        # paused search answering the request, started by Navigation.update
+        self.search = None
+
+
+class Navigation:
+    """ Path finding service of a level. Queries can be answered immediately with find_path or queued with
+        request_path and answered by update within a per frame time budget, a search that does not finish in time
+        continues on the next update. Abstract paths are cached per (start cluster, goal cluster) pair, most recently
+        used first.
+    """
+    def __init__(self, hierarchy: NavigationHierarchy, cache_size: int = NAVIGATION_PATH_CACHE_SIZE):
+        self.hierarchy = hierarchy
+        self.grid = hierarchy.grid
+        self.cache_size = cache_size
+        self.path_cache = OrderedDict()
+        self.requests = deque()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def search_node_path(self, start: int, goal: int) -> Generator[None, None, Optional[list[int]]]:
+        hierarchy = self.hierarchy
+        start_cluster, goal_cluster = hierarchy.get_cluster(start), hierarchy.get_cluster(goal)
+        if start_cluster == goal_cluster:
+            path = yield from self.grid.search_path(start, goal, hierarchy.get_cluster_bounds(start_cluster))
+            if path is not None:
+                return path
+
+        cache_key = (start_cluster, goal_cluster)
+        abstract_path = self.path_cache.get(cache_key)
+        if abstract_path is not None:
+            # the cached route only fits if start and goal can reach its ends inside their clusters
+            path = yield from hierarchy.search_refined_path(start, abstract_path, goal)
+            max_length = octile_distance(self.grid.width, start, goal) * CACHED_PATH_MAX_DETOUR + hierarchy.cluster_size
+            if path is not None and len(path) - 1 <= max_length:
+                self.path_cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return path
+
+        self.cache_misses += 1
+        abstract_path = yield from hierarchy.search_abstract_path(start, goal)
+        if abstract_path is None:
+            return None
+
+        self.path_cache[cache_key] = abstract_path
+        self.path_cache.move_to_end(cache_key)
+        if len(self.path_cache) > self.cache_size:
+            self.path_cache.popitem(last=False)
+        return (yield from hierarchy.search_refined_path(start, abstract_path, goal))
+
+    def find_path(self, start: tuple[float, float], goal: tuple[float, float]) -> Optional[list[tuple[int, int]]]:
+        """ Returns the world positions of the tile centres leading from start to goal """
+        return run_search(self.search_world_path(start, goal))
+
+    def search_world_path(self, start: tuple[float, float], goal: tuple[float, float]) \
+            -> Generator[None, None, Optional[list[tuple[int, int]]]]:
+        start_node = self.grid.get_nearest_walkable(self.grid.get_node(start))
+        goal_node = self.grid.get_nearest_walkable(self.grid.get_node(goal))
+        if start_node is None or goal_node is None:
+            return None
+
+        path = yield from self.search_node_path(start_node, goal_node)
+        return [self.grid.get_position(node) for node in path] if path is not None else None
+
+    def request_path(self, start: tuple[float, float], goal: tuple[float, float]) -> PathRequest:
+        request = PathRequest(start, goal)
+        self.requests.append(request)
+        return request
+
+    def update(self, budget_ms: float = NAVIGATION_BUDGET_MS) -> int:
+        """ Works on the queued requests in order until the budget is used up, the time is checked every
+            SEARCH_SLICE_NODES expanded nodes. Returns the number of requests answered.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000
+        answered = 0
+        while self.requests and time.perf_counter() < deadline:
+            request = self.requests[0]
+            if request.search is None:
+                request.search = self.search_world_path(request.start, request.goal)
+
+            try:
+                while time.perf_counter() < deadline:
+                    for _ in range(SEARCH_SLICE_NODES):
+                        next(request.search)
+            except StopIteration as stop:
+                self.requests.popleft()
+                request.path, request.search = stop.value, None
+                request.done = True
+                answered += 1
+
+        return answered
+
+
+def get_navigation_cache_path(map_path: str) -> str:
+    """ Maps with the same file name in different folders get different cache files """
+    map_name = os.path.splitext(os.path.basename(map_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(map_path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(NAVIGATION_CACHE_FILE_PATH, f"{map_name}_{path_hash}{NAVIGATION_CACHE_EXTENSION}")
+
+
+def get_navigation_metadata(map_path: str) -> dict:
+    # only the collision objects of the .tmx file affect navigation
+    return {"version": NAVIGATION_FORMAT_VERSION, "tile_size": TILE_SIZE, "source": get_file_hash(map_path)}
+
+
+def build_navigation(tmx_data) -> Navigation:
+    grid = NavigationGrid.from_collision_objects(tmx_data.width, tmx_data.height,
+                                                 tmx_data.get_layer_by_name("Collision_Objects"))
+    return Navigation(NavigationHierarchy(grid))
+
+
+def load_navigation(map_path: str, tmx_data) -> Navigation:
+    """ Loads the navigation data of a map from its cache file when it was built from the current .tmx file,
+        otherwise builds it and writes the cache. Maps without a file (e.g. generated ones) are always built.
+    """
+    if not USE_NAVIGATION_CACHE or not os.path.isfile(map_path):
+        return build_navigation(tmx_data)
+
+    cache_path = get_navigation_cache_path(map_path)
+    metadata = get_navigation_metadata(map_path)
+    if os.path.isfile(cache_path):
+        try:
+            hierarchy, cached_metadata = NavigationHierarchy.load(cache_path)
+            if cached_metadata == {**metadata, "cluster_size": NAVIGATION_CLUSTER_SIZE}:
+                return Navigation(hierarchy)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    navigation = build_navigation(tmx_data)
+    navigation.hierarchy.save(cache_path, metadata)
+    return navigation
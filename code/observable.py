@@ -1,20 +1,39 @@
+from itertools import count
 from typing import TYPE_CHECKING
+from eventBus import EventBus, event_bus
 if TYPE_CHECKING:
     from observer import Observer
 
+# numbers of the observable topics, never reused unlike object ids
+observable_topic_numbers = count()
+
 
 class Observable:
-    def __init__(self):
-        self.observers = []
+    """ Adapter over the event bus, each observable publishes on its own topic and its observers are subscribed to
+        it. observable_notify queues a notification that is delivered with the next dispatch of the bus.
+    """
+    def __init__(self, bus: EventBus = event_bus):
+        self.event_bus = bus
+        self.observable_topic = f"observable_{next(observable_topic_numbers)}"
+        # observer -> callback subscribed to the bus, insertion ordered
+        self.observers = {}
 
     def observable_add(self, new_observer: "Observer"):
-        self.observers.append(new_observer)
+        if new_observer not in self.observers:
+            self.observers[new_observer] = lambda event: new_observer.observer_update()
+            self.event_bus.subscribe(self.observable_topic, self.observers[new_observer])
 
     def observable_remove(self, observer_to_delete: "Observer"):
-        for index, observer in enumerate(self.observers):
-            if id(observer) == id(observer_to_delete):
-                self.observers.pop(index)
+        callback = self.observers.pop(observer_to_delete, None)
+        if callback is not None:
+            self.event_bus.unsubscribe(self.observable_topic, callback)
+
+    def observable_clear(self):
+        """ Unsubscribes every observer, must be called when the observable is torn down because the bus keeps the
+            observers (and through them usually the observable) alive
+        """
+        self.event_bus.remove_topic(self.observable_topic)
+        self.observers.clear()
 
     def observable_notify(self):
-        for observer in self.observers:
-            observer.observer_update()
+        self.event_bus.publish(self.observable_topic, self)
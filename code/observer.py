@@ -4,6 +4,7 @@ if TYPE_CHECKING:
 
 
 class Observer:
+    """ Adapter over the event bus, observer_update is called when the observed Observable notifies """
     def __init__(self, observable: "Observable"):
         self.observable = observable
         self.observable.observable_add(self)
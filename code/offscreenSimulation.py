@@ -0,0 +1,239 @@
+""" Simulates the crowds of the built levels the player is not in, in worker processes. Each level is pinned to one
+    worker, which keeps the level's CrowdSimulation between jobs, so a job only sends back the members that changed.
+    When the player enters a level its state is copied back into the level's Crowd.
+
+    python offscreenSimulation.py --bench [--levels N] [--crowd N] [--steps N]
+"""
+import os
+import time
+import argparse
+from concurrent.futures import Future
+from types import SimpleNamespace
+from typing import Optional, TYPE_CHECKING
+
+import pygame
+import numpy as np
+from settings import *
+from crowd import Crowd, CrowdSimulation, create_world
+
+# multiprocessing is only imported when the first worker is started
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+# crowds simulated by this worker process, keyed by level code
+worker_crowds = {}
+
+
+def encode_delta(indexes: np.ndarray, simulation: CrowdSimulation) -> bytes:
+    """ Member count, then the indexes, x and y positions and statuses of the changed members """
+    return b"".join([np.uint32(len(indexes)).tobytes(), indexes.astype(np.uint32).tobytes(),
+                     simulation.x[indexes].astype(np.int32).tobytes(), simulation.y[indexes].astype(np.int32).tobytes(),
+                     simulation.status[indexes].astype(np.uint8).tobytes()])
+
+
+def apply_delta(crowd: CrowdSimulation, delta: bytes):
+    count = int(np.frombuffer(delta, dtype=np.uint32, count=1)[0])
+    offset = 4
+    indexes = np.frombuffer(delta, dtype=np.uint32, count=count, offset=offset)
+    offset += indexes.nbytes
+    crowd.x[indexes] = np.frombuffer(delta, dtype=np.int32, count=count, offset=offset)
+    offset += count * 4
+    crowd.y[indexes] = np.frombuffer(delta, dtype=np.int32, count=count, offset=offset)
+    offset += count * 4
+    crowd.status[indexes] = np.frombuffer(delta, dtype=np.uint8, count=count, offset=offset)
+
+
+def start_crowd(level_code: int, simulation: CrowdSimulation):
+    worker_crowds[level_code] = simulation
+
+
+def step_crowd(level_code: int, steps: int, scale: int) -> bytes:
+    simulation = worker_crowds[level_code]
+    x, y, status = simulation.x.copy(), simulation.y.copy(), simulation.status.copy()
+    for _ in range(steps):
+        simulation.step(scale)
+    return encode_delta(np.flatnonzero((simulation.x != x) | (simulation.y != y) | (simulation.status != status)),
+                        simulation)
+
+
+def stop_crowd(level_code: int) -> dict:
+    return worker_crowds.pop(level_code).get_state()
+
+
+def discard_crowd(level_code: int):
+    worker_crowds.pop(level_code, None)
+
+
+class SimulatedLevel:
+    def __init__(self, level, executor: "ProcessPoolExecutor"):
+        self.level = level
+        self.executor = executor
+        # members when the simulation started, members added since then are not simulated
+        self.count = len(level.crowd)
+        # steps of the main simulation not yet sent to the worker, the running job and the off-screen steps submitted
+        self.pending_steps = 0
+        self.future: Optional[Future] = None
+        self.steps = 0
+
+
+class OffscreenSimulation:
+    """ Steps the crowds of every built level except the current one at a reduced rate: one off-screen step covers
+        interval steps of the main simulation. A level whose job is still running when the next one is due falls
+        behind and catches up with a longer job, the main thread never waits for the workers except in sync.
+    """
+    def __init__(self, workers: Optional[int] = OFFSCREEN_SIMULATION_WORKERS,
+                 interval: int = OFFSCREEN_SIMULATION_INTERVAL):
+        self.worker_count = workers or max((os.cpu_count() or 1) - 1, 1)
+        self.interval = interval
+        # single process executors, created when a level first needs one so games without off-screen crowds never
+        # start a process
+        self.executors = []
+        self.simulated = {}
+
+    def get_executor(self) -> "ProcessPoolExecutor":
+        """ The worker simulating the fewest levels """
+        if len(self.executors) < self.worker_count:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawned workers do not inherit the display, the loader threads or the locks they hold
+            self.executors.append(ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")))
+
+        level_counts = {executor: 0 for executor in self.executors}
+        for simulated in self.simulated.values():
+            level_counts[simulated.executor] += 1
+        return min(self.executors, key=level_counts.get)
+
+    def start(self, level_code: int, level):
+        crowd = level.crowd
+        simulation = CrowdSimulation(crowd.obstacle_grid, crowd.idle_statuses, crowd.heading_statuses,
+                                     crowd.default_speed)
+        simulation.set_state(crowd.get_state())
+
+        simulated = SimulatedLevel(level, self.get_executor())
+        simulated.executor.submit(start_crowd, level_code, simulation)
+        self.simulated[level_code] = simulated
+
+    def discard(self, level_code: int):
+        simulated = self.simulated.pop(level_code)
+        simulated.executor.submit(discard_crowd, level_code)
+
+    def update(self, levels: dict, current_level_code: int):
+        """ Called after every step of the main simulation with the built levels keyed by level code """
+        for level_code in [level_code for level_code, simulated in self.simulated.items()
+                           if levels.get(level_code) is not simulated.level]:
+            # the level was evicted from the level cache
+            self.discard(level_code)
+
+        for level_code, level in levels.items():
+            if level_code == current_level_code or level.crowd is None or not len(level.crowd):
+                continue
+
+            simulated = self.simulated.get(level_code)
+            if simulated is None:
+                self.start(level_code, level)
+                continue
+
+            if len(level.crowd) != simulated.count:
+                # members were added, restart with all of them
+                self.sync(level_code)
+                self.start(level_code, level)
+                continue
+
+            simulated.pending_steps += 1
+            if simulated.future is not None:
+                if not simulated.future.done():
+                    continue
+                apply_delta(level.crowd, simulated.future.result())
+                simulated.future = None
+
+            if simulated.pending_steps >= self.interval:
+                steps, simulated.pending_steps = divmod(simulated.pending_steps, self.interval)
+                simulated.future = simulated.executor.submit(step_crowd, level_code, steps, self.interval)
+                simulated.steps += steps
+
+    def sync(self, level_code: int) -> int:
+        """ Stops simulating a level and copies its state back into its crowd, called before the player enters it.
+            Returns the number of off-screen steps it was simulated for.
+        """
+        simulated = self.simulated.pop(level_code, None)
+        if simulated is None:
+            return 0
+
+        crowd = simulated.level.crowd
+        state = simulated.executor.submit(stop_crowd, level_code).result()
+        for name in CrowdSimulation.STATE_ARRAYS:
+            getattr(crowd, name)[:simulated.count] = state[name]
+        crowd.rng.bit_generator.state = state["rng"]
+        crowd.update_frame_indexes()
+        crowd.write_back()
+        return simulated.steps
+
+    def wait(self):
+        """ Waits until the workers have finished the jobs submitted so far, including starting up """
+        for executor in self.executors:
+            executor.submit(int).result()
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_crowd_level(crowd_count: int, seed: int) -> SimpleNamespace:
+    """ Stand in for a Level with a crowd on a generated map """
+    obstacle_sprites, positions = create_world(crowd_count, crowd_count * 2, 128, seed)
+    crowd = Crowd(obstacle_sprites, [], seed=seed)
+    crowd.add(positions)
+    return SimpleNamespace(crowd=crowd)
+
+
+def bench(level_count: int, crowd_count: int, steps: int):
+    """ Time to advance every level by steps off-screen steps, in this process and with 1 to N workers """
+    levels = {level_code: create_crowd_level(crowd_count, level_code) for level_code in range(1, level_count + 1)}
+
+    start = time.perf_counter()
+    for level in levels.values():
+        simulation = CrowdSimulation(level.crowd.obstacle_grid, level.crowd.idle_statuses, level.crowd.heading_statuses)
+        simulation.set_state(level.crowd.get_state())
+        for _ in range(steps):
+            simulation.step(OFFSCREEN_SIMULATION_INTERVAL)
+    serial_time = time.perf_counter() - start
+    print(f"{level_count} levels of {crowd_count} members, {steps} off-screen steps each")
+    print(f"    main process: {serial_time * 1000:8.1f} ms")
+
+    worker_counts = sorted({1, *(count for count in (2, 4, 8) if count < level_count),
+                            min(level_count, max((os.cpu_count() or 1) - 1, 1))})
+    for worker_count in worker_counts:
+        simulation = OffscreenSimulation(workers=worker_count)
+        for level_code, level in levels.items():
+            simulation.start(level_code, level)
+        simulation.wait()
+
+        start = time.perf_counter()
+        futures = [simulated.executor.submit(step_crowd, level_code, steps, simulation.interval)
+                   for level_code, simulated in simulation.simulated.items()]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+        simulation.shutdown()
+        print(f"    {worker_count:2} workers:  {elapsed * 1000:8.1f} ms ({serial_time / elapsed:.1f}x)")
+
+
+def main():
+    # only the command line tools default to no window, the game imports this module
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--bench", action="store_true")
+    parser.add_argument("--levels", type=int, default=4)
+    parser.add_argument("--crowd", type=int, default=2000, help="crowd members per level when benchmarking")
+    parser.add_argument("--steps", type=int, default=100, help="off-screen steps per level when benchmarking")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    bench(args.levels, args.crowd, args.steps)
+
+
+if __name__ == "__main__":
+    main()
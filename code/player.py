@@ -1,16 +1,20 @@
 import os
 import pygame
+from typing import Callable
 from settings import *
 from utils import get_spawn_point_id
 from entity import Entity
 from observable import Observable
 from observer import Observer
+from spatialHash import SpatialGroup
+from profiler import profiler
+from eventBus import event_bus, LEVEL_CHANGED, LevelChanged
 
 
 class Player(Entity, Observable):
     def __init__(self, pos: tuple[float, float], image_path: str, groups: list[pygame.sprite.Sprite],
-                 obstacle_sprites: pygame.sprite.Group, transition_sprites: pygame.sprite.Group,
-                 spawn_points: pygame.sprite.Group, initial_level_code: int, **kwargs):
+                 obstacle_sprites: SpatialGroup, transition_sprites: SpatialGroup,
+                 spawn_points: SpatialGroup, initial_level_code: int, **kwargs):
 
         Entity.__init__(self, pos, image_path, groups, obstacle_sprites)
         Observable.__init__(self)
@@ -25,6 +29,9 @@ class Player(Entity, Observable):
         # temp
         self.next_level_spawn_id = None
 
+        # function returning the pressed keys, replaced to replay recorded or scripted input
+        self.get_pressed = kwargs.get("input_source", pygame.key.get_pressed)
+
         # add observers
         self.__set_observers(kwargs.get("observers", None))
 
@@ -48,8 +55,11 @@ class Player(Entity, Observable):
         self.transition_sprites = new_transition_sprites_group
         self.spawn_points = new_spawn_point_group
 
+    def set_input_source(self, get_pressed: Callable):
+        self.get_pressed = get_pressed
+
     def input(self):
-        keys = pygame.key.get_pressed()
+        keys = self.get_pressed()
         up, down, left, right = keys[pygame.K_w], keys[pygame.K_s], keys[pygame.K_a], keys[pygame.K_d]
 
         if up:
@@ -79,33 +89,38 @@ class Player(Entity, Observable):
 
     # Override
     def move(self, speed: float):
-        # check for collision with a TransitionBox object
+        previous_position = self.rect.topleft
+
+        # check for collision with a TransitionBox object, publishes a level change
         self.collision("transition")
 
         # call move method from entity class
         super(Player, self).move(speed)
 
-        self.observable_notify()
+        # observers are only notified when the player actually moved
+        if self.rect.topleft != previous_position:
+            self.observable_notify()
 
     # Override
     def collision(self, direction: str):
         def transition_collision():
-            for transition_sprite in self.transition_sprites:
-                if transition_sprite.rect.colliderect(self.rect):
-                    self.current_level_code = transition_sprite.get_new_level_code()
+            previous_level_code = self.current_level_code
+            for transition_sprite in self.transition_sprites.query_rect(self.rect):
+                new_level_code = transition_sprite.get_new_level_code()
+                # transitions without a destination are not implemented yet
+                if new_level_code is not None:
+                    self.current_level_code = new_level_code
                     self.next_level_spawn_id = get_spawn_point_id(transition_sprite.get_transition_code())
 
+            if self.current_level_code != previous_level_code:
+                event_bus.publish(LEVEL_CHANGED, LevelChanged(self, previous_level_code, self.current_level_code,
+                                                              self.next_level_spawn_id))
+
         collision_type_map = {
                          "transition": transition_collision,
                          "horizontal": lambda: super(Player, self).collision("horizontal"),
                          "vertical": lambda: super(Player, self).collision("vertical")
                          }
 
-        collision_type_map[direction]()
-
-    # Override
-    def update(self):
-        self.input()
-        self.get_status()
-        self.animate()
-        self.move(self.speed)
+        with profiler.scope("collision"):
+            collision_type_map[direction]()
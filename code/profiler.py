@@ -0,0 +1,163 @@
+import os
+import csv
+import json
+import time
+from array import array
+from collections import deque
+from contextlib import nullcontext
+from settings import *
+
+PROFILE_STAGES = ["input", "movement", "collision", "animation", "draw", "transition"]
+PROFILE_COUNTERS = ["blits", "updated near", "updated far", "asleep"]
+# shared do-nothing scope returned while profiling is disabled
+DISABLED_SCOPE = nullcontext()
+
+
+class RingBuffer:
+    """ Fixed size history of floats, the oldest value is overwritten once the buffer is full """
+    def __init__(self, size: int):
+        self.values = array("d", [0.0] * size)
+        self.size = size
+        self.count = 0
+
+    def append(self, value: float):
+        self.values[self.count % self.size] = value
+        self.count += 1
+
+    def __len__(self) -> int:
+        return min(self.count, self.size)
+
+    def __iter__(self):
+        """ Iterates from the oldest to the newest value """
+        start = self.count - len(self)
+        return (self.values[index % self.size] for index in range(start, self.count))
+
+    def last(self) -> float:
+        return self.values[(self.count - 1) % self.size] if self.count else 0.0
+
+    def mean(self) -> float:
+        return sum(self) / len(self) if self.count else 0.0
+
+
+class ProfileScope:
+    """ Times a named stage, re-entering the same stage (e.g. Player.collision calling Entity.collision) only counts
+        the outermost call
+    """
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.depth = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.depth += 1
+        if self.depth == 1:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            self.profiler.record(self.name, self.start, time.perf_counter())
+
+
+class Profiler:
+    """ Per-stage frame profiler. Stage times and counters are summed per frame and kept in ring buffers of the last
+        history frames, individual scope timings are kept for Chrome trace export.
+    """
+    def __init__(self, enabled: bool = False, history: int = PROFILER_HISTORY,
+                 trace_events: int = PROFILER_TRACE_EVENTS):
+        self.enabled = enabled
+        self.history = history
+        self.scopes = {}
+
+        self.frame_times = RingBuffer(history)
+        self.frame_intervals = RingBuffer(history)
+        self.stage_times = {stage: RingBuffer(history) for stage in PROFILE_STAGES}
+        self.counters = {counter: RingBuffer(history) for counter in PROFILE_COUNTERS}
+        self.trace = deque(maxlen=trace_events)
+
+        self.frame_start = None
+        self.current_stage_times = dict.fromkeys(PROFILE_STAGES, 0.0)
+        self.current_counters = dict.fromkeys(PROFILE_COUNTERS, 0)
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.frame_start = None
+
+    def scope(self, name: str):
+        if not self.enabled:
+            return DISABLED_SCOPE
+
+        if name not in self.scopes:
+            self.scopes[name] = ProfileScope(self, name)
+        return self.scopes[name]
+
+    def record(self, name: str, start: float, end: float):
+        self.current_stage_times[name] = self.current_stage_times.get(name, 0.0) + (end - start) * 1000
+        self.trace.append((name, start, end))
+
+    def count(self, name: str, amount: int = 1):
+        if self.enabled:
+            self.current_counters[name] = self.current_counters.get(name, 0) + amount
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_intervals.append((now - self.frame_start) * 1000)
+        self.frame_start = now
+
+    def end_frame(self):
+        if not self.enabled or self.frame_start is None:
+            return
+
+        end = time.perf_counter()
+        self.frame_times.append((end - self.frame_start) * 1000)
+        self.trace.append(("frame", self.frame_start, end))
+
+        for stage, buffer in self.stage_times.items():
+            buffer.append(self.current_stage_times.get(stage, 0.0))
+        for counter, buffer in self.counters.items():
+            buffer.append(self.current_counters.get(counter, 0))
+
+        self.current_stage_times = dict.fromkeys(PROFILE_STAGES, 0.0)
+        self.current_counters = dict.fromkeys(PROFILE_COUNTERS, 0)
+
+    def get_fps(self) -> float:
+        mean_interval = self.frame_intervals.mean()
+        return 1000 / mean_interval if mean_interval else 0.0
+
+    def get_slowest_stage(self) -> tuple[str, float]:
+        """ Stage with the highest mean time over the history, as (name, ms) """
+        return max(((stage, buffer.mean()) for stage, buffer in self.stage_times.items()), key=lambda item: item[1])
+
+    def export_csv(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["frame", "frame_ms", *(f"{stage}_ms" for stage in PROFILE_STAGES), *PROFILE_COUNTERS])
+            first_frame = self.frame_times.count - len(self.frame_times)
+            columns = [self.frame_times, *self.stage_times.values(), *self.counters.values()]
+            for frame, row in enumerate(zip(*columns), start=first_frame):
+                writer.writerow([frame, *(round(value, 4) for value in row)])
+
+    def export_chrome_trace(self, path: str):
+        """ Writes the recorded scopes in the Chrome trace event format (chrome://tracing, Perfetto) """
+        events = [{"name": name, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6, "pid": 0, "tid": 0}
+                  for name, start, end in self.trace]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+    def export(self, folder: str = PROFILE_EXPORT_FILE_PATH) -> tuple[str, str]:
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        csv_path = os.path.join(folder, f"profile-{timestamp}.csv")
+        trace_path = os.path.join(folder, f"trace-{timestamp}.json")
+        self.export_csv(csv_path)
+        self.export_chrome_trace(trace_path)
+        return csv_path, trace_path
+
+
+profiler = Profiler(enabled=os.environ.get(PROFILE_ENV_VAR, "") not in ("", "0"))
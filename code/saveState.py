@@ -0,0 +1,294 @@
+""" Save state snapshots: the current level code, the player's position, direction, status and animation frame and the
+    crowd of the current level, packed into a small versioned binary format. Restoring a snapshot only builds the level
+    it was taken in.
+
+    python saveState.py --info PATH               print the contents of a snapshot file
+    python saveState.py --bench [--crowd N]       time capturing, encoding and writing snapshots
+"""
+import os
+import time
+import warnings
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import NamedTuple, Optional
+
+import pygame
+import numpy as np
+from settings import *
+from animation import animation_clock
+
+SAVE_STATE_MAGIC = b"RPGS"
+SAVE_STATE_FORMAT_VERSION = 2
+# magic, format version, saved at (unix time), animation clock time, level code, has crowd
+HEADER = struct.Struct("<4sHdqi?")
+# rect x, rect y, direction x, direction y, animation start
+PLAYER = struct.Struct("<iiddq")
+# member count, status count, PCG64 state and increment, has_uint32, uinteger
+CROWD = struct.Struct("<IB16s16sBI")
+# crowd arrays in the order they are written, with the types they are stored as
+CROWD_ARRAYS = [("x", np.int32), ("y", np.int32), ("direction", np.float64), ("speed", np.float64),
+                ("animation_start", np.int64), ("status", np.uint8), ("frames_until_turn", np.int32)]
+
+
+class SaveStateError(ValueError):
+    pass
+
+
+class PlayerState(NamedTuple):
+    position: tuple[int, int]
+    direction: tuple[float, float]
+    status: str
+    animation_start: int
+
+
+class CrowdState(NamedTuple):
+    statuses: tuple[str, ...]
+    # Crowd array name -> copy of the array
+    arrays: dict
+    rng_state: dict
+
+
+class Snapshot(NamedTuple):
+    level_code: int
+    player: PlayerState
+    crowd: Optional[CrowdState]
+    saved_at: float
+    # animation starts are times of the animation clock, they are moved to the clock of the resumed game
+    animation_time: int
+
+
+def capture(level_handler) -> Snapshot:
+    """ Copies the state of the game, cheap enough to run on the main thread between two simulation steps """
+    player = level_handler.player
+    player_state = PlayerState(player.rect.topleft, (player.direction.x, player.direction.y), player.status,
+                               player.animation.start)
+
+    crowd = level_handler.current_level.crowd
+    crowd_state = None
+    if crowd is not None:
+        crowd_state = CrowdState(tuple(crowd.statuses), {name: getattr(crowd, name).copy() for name, _ in CROWD_ARRAYS},
+                                 crowd.rng.bit_generator.state)
+
+    return Snapshot(level_handler.current_level_code, player_state, crowd_state, time.time(), animation_clock.time)
+
+
+def pack_string(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return struct.pack("<B", len(encoded)) + encoded
+
+
+def unpack_string(data: bytes, offset: int) -> tuple[str, int]:
+    length = data[offset]
+    return data[offset + 1:offset + 1 + length].decode("utf-8"), offset + 1 + length
+
+
+def encode(snapshot: Snapshot) -> bytes:
+    player = snapshot.player
+    chunks = [HEADER.pack(SAVE_STATE_MAGIC, SAVE_STATE_FORMAT_VERSION, snapshot.saved_at, snapshot.animation_time,
+                          snapshot.level_code, snapshot.crowd is not None),
+              PLAYER.pack(*player.position, *player.direction, player.animation_start), pack_string(player.status)]
+
+    crowd = snapshot.crowd
+    if crowd is not None:
+        if crowd.rng_state["bit_generator"] != "PCG64":
+            raise SaveStateError(f"cannot save the state of a {crowd.rng_state['bit_generator']} generator")
+
+        rng_state = crowd.rng_state
+        chunks.append(CROWD.pack(len(crowd.arrays["x"]), len(crowd.statuses),
+                                 rng_state["state"]["state"].to_bytes(16, "little"),
+                                 rng_state["state"]["inc"].to_bytes(16, "little"), rng_state["has_uint32"],
+                                 rng_state["uinteger"]))
+        chunks.extend(pack_string(status) for status in crowd.statuses)
+        chunks.extend(crowd.arrays[name].astype(dtype).tobytes() for name, dtype in CROWD_ARRAYS)
+
+    return b"".join(chunks)
+
+
+def decode(data: bytes) -> Snapshot:
+    try:
+        magic, version, saved_at, animation_time, level_code, has_crowd = HEADER.unpack_from(data)
+        if magic != SAVE_STATE_MAGIC:
+            raise SaveStateError("not a save state")
+        if version != SAVE_STATE_FORMAT_VERSION:
+            raise SaveStateError(f"save state format {version} is not supported, expected {SAVE_STATE_FORMAT_VERSION}")
+
+        x, y, direction_x, direction_y, animation_start = PLAYER.unpack_from(data, HEADER.size)
+        status, offset = unpack_string(data, HEADER.size + PLAYER.size)
+        player = PlayerState((x, y), (direction_x, direction_y), status, animation_start)
+
+        crowd = None
+        if has_crowd:
+            count, status_count, state, increment, has_uint32, uinteger = CROWD.unpack_from(data, offset)
+            offset += CROWD.size
+            statuses = []
+            for _ in range(status_count):
+                status, offset = unpack_string(data, offset)
+                statuses.append(status)
+
+            arrays = {}
+            for name, dtype in CROWD_ARRAYS:
+                shape = (count, 2) if name == "direction" else (count,)
+                array = np.frombuffer(data, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+                offset += array.nbytes
+                arrays[name] = array.astype(np.float64 if array.dtype.kind == "f" else np.int64)
+
+            rng_state = {"bit_generator": "PCG64", "state": {"state": int.from_bytes(state, "little"),
+                                                             "inc": int.from_bytes(increment, "little")},
+                         "has_uint32": has_uint32, "uinteger": uinteger}
+            crowd = CrowdState(tuple(statuses), arrays, rng_state)
+
+    except (struct.error, ValueError, UnicodeDecodeError) as e:
+        if isinstance(e, SaveStateError):
+            raise
+        raise SaveStateError(f"corrupt save state: {e}") from e
+
+    return Snapshot(level_code, player, crowd, saved_at, animation_time)
+
+
+def write_snapshot(path: str, snapshot: Snapshot):
+    data = encode(snapshot)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so a crash while saving never leaves a half written save behind
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as save_file:
+        save_file.write(data)
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(path: str) -> Snapshot:
+    with open(path, "rb") as save_file:
+        return decode(save_file.read())
+
+
+def restore_player(player, player_state: PlayerState, animation_time: int):
+    """ Puts the player back in the state it was captured in, before it joins its level """
+    player.status = player_state.status
+    player.direction.update(player_state.direction)
+    player.animation.set_elapsed(animation_time - player_state.animation_start)
+    image = player.animation.update(player.status)
+    if image is not None:
+        player.image = image
+    player.rect = player.image.get_rect(topleft=player_state.position)
+
+
+def restore_crowd(level, crowd_state: CrowdState, animation_time: int):
+    """ Recreates the crowd of a level from a snapshot, replacing the crowd it already has """
+    if level.crowd is not None:
+        for member in level.crowd.members:
+            member.kill()
+        level.crowd = None
+
+    crowd = level.spawn_crowd(list(zip(crowd_state.arrays["x"].tolist(), crowd_state.arrays["y"].tolist())))
+    if tuple(crowd.statuses) != crowd_state.statuses:
+        raise SaveStateError("the crowd animations changed since the save state was taken")
+
+    for name, _ in CROWD_ARRAYS:
+        setattr(crowd, name, crowd_state.arrays[name].copy())
+    crowd.animation_start += animation_clock.time - animation_time
+    crowd.update_frame_indexes()
+    crowd.sprite_x, crowd.sprite_y = crowd.x.copy(), crowd.y.copy()
+    crowd.rng.bit_generator.state = crowd_state.rng_state
+    crowd.write_back()
+
+
+class Autosaver:
+    """ Captures a snapshot every interval simulation steps and writes it on a worker thread. A save is skipped while
+        the previous one is still being written.
+    """
+    def __init__(self, path: str = AUTOSAVE_FILE_PATH, interval: int = AUTOSAVE_INTERVAL * TICK_RATE):
+        self.path = path
+        self.interval = interval
+        self.ticks = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autosave")
+        self.pending: Optional[Future] = None
+        self.skipped = 0
+
+    def update(self, level_handler):
+        """ Called after every simulation step """
+        self.ticks += 1
+        if self.ticks >= self.interval:
+            self.ticks = 0
+            self.save(level_handler)
+
+    def save(self, level_handler) -> bool:
+        if self.pending is not None:
+            if not self.pending.done():
+                self.skipped += 1
+                return False
+
+            self.report_error()
+
+        self.pending = self.executor.submit(write_snapshot, self.path, capture(level_handler))
+        return True
+
+    def report_error(self):
+        # a failed autosave must not stop the game
+        error = self.pending.exception()
+        if error is not None:
+            warnings.warn(f"autosave failed: {error!r}", RuntimeWarning)
+
+    def flush(self):
+        """ Waits for the save being written, e.g. before quitting """
+        if self.pending is not None:
+            self.report_error()
+            self.pending = None
+
+
+def create_level_handler(crowd_count: int, snapshot: Optional[Snapshot] = None):
+    from levelHandler import LevelHandler
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    level_handler = LevelHandler(snapshot)
+    if snapshot is None and crowd_count:
+        rng = np.random.default_rng(0)
+        map_size = (level_handler.current_level.tmx_data.width * TILE_SIZE,
+                    level_handler.current_level.tmx_data.height * TILE_SIZE)
+        level_handler.current_level.spawn_crowd([tuple(rng.uniform(0, map_size)) for _ in range(crowd_count)])
+    return level_handler
+
+
+def bench(crowd_count: int, repeat: int = 100):
+    level_handler = create_level_handler(crowd_count)
+    path = os.path.join(SAVE_FILE_PATH, "bench.sav")
+    timings = {"capture": [], "encode": [], "write": []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        snapshot = capture(level_handler)
+        captured = time.perf_counter()
+        data = encode(snapshot)
+        encoded = time.perf_counter()
+        write_snapshot(path, snapshot)
+        timings["capture"].append(captured - start)
+        timings["encode"].append(encoded - captured)
+        timings["write"].append(time.perf_counter() - encoded)
+    os.remove(path)
+
+    print(f"crowd of {crowd_count}, {len(data)} bytes")
+    for stage, samples in timings.items():
+        print(f"{stage:>8}: median {np.median(samples) * 1000:.3f} ms, max {max(samples) * 1000:.3f} ms")
+    print("only capture runs on the main thread, encoding and writing happen on the autosave thread")
+
+
+def main():
+    # only the command line tools default to no window, the game imports this module
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--info", metavar="PATH")
+    mode.add_argument("--bench", action="store_true")
+    parser.add_argument("--crowd", type=int, default=200, help="crowd members in the starting level")
+    args = parser.parse_args()
+
+    if args.info:
+        snapshot = load_snapshot(args.info)
+        print(f"saved {time.ctime(snapshot.saved_at)} in level {snapshot.level_code}")
+        print(f"player {snapshot.player}")
+        print(f"crowd of {len(snapshot.crowd.arrays['x'])}" if snapshot.crowd is not None else "no crowd")
+    else:
+        bench(args.crowd)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,112 @@ MAX_SCREEN_WIDTH = 16
 MAX_SCREEN_HEIGHT = 12
 WIDTH, HEIGHT = TILE_SIZE * MAX_SCREEN_WIDTH, TILE_SIZE * MAX_SCREEN_HEIGHT
 
+# FPS caps the render rate (0 for uncapped), the simulation always advances TICK_RATE steps per second
 FPS = 60
+TICK_RATE = 60
+# most simulation steps run before a frame is drawn, beyond this the game slows down instead of falling further behind
+MAX_UPDATES_PER_FRAME = 5
+# draw moving sprites between their previous and current simulation positions, sprites that jumped further than
+# INTERPOLATION_MAX_DISTANCE pixels in one step (e.g. level transitions) are drawn at their current position
+INTERPOLATE_RENDERING = True
+INTERPOLATION_MAX_DISTANCE = TILE_SIZE
+# simulation steps each animation frame is shown for (about 0.15 frames per step at TICK_RATE 60)
+ANIMATION_FRAME_DURATION = 7
+
+# tiled layers that are always drawn underneath the y-sorted sprites
+FLOOR_LAYERS = ["Ground", "Carpet", "Shadows"]
+# width and height (in tiles) of the pre-rendered floor chunks
+FLOOR_CHUNK_SIZE = 8
+# floor chunks kept rendered, a 1280x960 screen shows at most 9 chunks of 8x8 tiles
+FLOOR_CHUNK_CACHE_SIZE = 24
+# maps with at most this many floor chunks have all of them baked when the level is built, which takes no more memory
+# than a full cache. Larger and streamed maps bake chunks when they come into view and keep FLOOR_CHUNK_CACHE_SIZE.
+FLOOR_CHUNK_BAKE_LIMIT = FLOOR_CHUNK_CACHE_SIZE
+# width and height (in pixels) of the spatial hash cells used for collision queries
+SPATIAL_HASH_CELL_SIZE = TILE_SIZE * 2
+
+# reuse the previous frame and only redraw what changed, falling back to a full redraw when the camera moves further
+# than INCREMENTAL_MAX_SCROLL pixels in one frame
+INCREMENTAL_RENDERING = True
+INCREMENTAL_MAX_SCROLL = TILE_SIZE
+# draw the world at ORIGINAL_TILE_SIZE into a WIDTH // SCALE x HEIGHT // SCALE surface and scale that up to the window
+# once per frame (incremental rendering is not used then). The window is WINDOW_SCALE times the native resolution.
+NATIVE_RESOLUTION_RENDERING = False
+WINDOW_SCALE = SCALE
+
+# number of built levels kept in memory and an optional budget (in bytes) for their surfaces
+LEVEL_CACHE_MAX_LEVELS = 4
+LEVEL_CACHE_MAX_BYTES = None
+# surface memory budgets (in MiB) of one built level and of every level and asset together, see memoryReport.py.
+# A level baked whole holds up to FLOOR_CHUNK_BAKE_LIMIT floor chunks (1.56 MiB each at 8x8 tiles of 80 px).
+MEMORY_LEVEL_BUDGET_MB = 48
+MEMORY_TOTAL_BUDGET_MB = 64
+# parse the maps reachable from the current level on a worker thread
+PRELOAD_NEIGHBOUR_LEVELS = True
+STARTING_LEVEL_CODE = 0
+
+# streamed maps are split into STREAM_CHUNK_SIZE x STREAM_CHUNK_SIZE tile chunks (a multiple of FLOOR_CHUNK_SIZE).
+# Chunks up to STREAM_RADIUS chunks from the player's chunk are loaded in the background and chunks further than
+# STREAM_EVICT_RADIUS are evicted, at most STREAM_MAX_CHUNKS_PER_UPDATE loaded chunks join the level per update
+STREAM_CHUNK_SIZE = 32
+STREAM_RADIUS = 1
+STREAM_EVICT_RADIUS = 2
+STREAM_MAX_CHUNKS_PER_UPDATE = 1
+
+# navigation: HPA* clusters of NAVIGATION_CLUSTER_SIZE x NAVIGATION_CLUSTER_SIZE tiles, abstract paths cached per
+# cluster pair and queued path requests answered for at most NAVIGATION_BUDGET_MS per update
+NAVIGATION_CLUSTER_SIZE = 10
+NAVIGATION_PATH_CACHE_SIZE = 256
+NAVIGATION_BUDGET_MS = 2.0
+
+# crowds of the built levels the player is not in are simulated in worker processes (all cores but one when
+# OFFSCREEN_SIMULATION_WORKERS is None), one off-screen step covering OFFSCREEN_SIMULATION_INTERVAL steps
+OFFSCREEN_SIMULATION = True
+OFFSCREEN_SIMULATION_WORKERS = None
+OFFSCREEN_SIMULATION_INTERVAL = 4
+
+# main.py --hot-reload reloads edited maps, tilesets and the transition mapping in place, the files are checked every
+# HOT_RELOAD_POLL_INTERVAL seconds
+HOT_RELOAD = False
+HOT_RELOAD_POLL_INTERVAL = 0.5
+
+# python startupTrace.py fails when the median time from launching the game to its first frame is over this
+STARTUP_BUDGET_MS = 1000
+
+# sprites with an update method are updated every step within UPDATE_NEAR_DISTANCE pixels of the view, once every
+# UPDATE_FAR_INTERVAL steps (covering the steps they missed) up to UPDATE_SLEEP_DISTANCE, and not at all beyond it
+# unless they were woken for UPDATE_WAKE_STEPS steps by a WAKE_ENTITY event
+UPDATE_NEAR_DISTANCE = TILE_SIZE * 2
+UPDATE_SLEEP_DISTANCE = TILE_SIZE * 16
+UPDATE_FAR_INTERVAL = 4
+UPDATE_WAKE_STEPS = TICK_RATE
+
+# frames of timing history kept by the profiler, and scope timings kept for trace export
+PROFILER_HISTORY = 240
+PROFILER_TRACE_EVENTS = 50000
+# profiling starts enabled when this environment variable is set (and not "0"), F3 toggles it and F4 exports
+PROFILE_ENV_VAR = "RPG2D_PROFILE"
+
 MAPS_FILE_PATH = os.path.join(ROOT_DIR, "maps")
 PLAYER_IMAGES_FILE_PATH = os.path.join(ROOT_DIR, "graphics", "player")
 DATA_FILE_PATH = os.path.join(ROOT_DIR, 'data')
+CACHE_FILE_PATH = os.path.join(ROOT_DIR, ".cache")
+TRANSITION_MAPPING_FILE_PATH = os.path.join(DATA_FILE_PATH, "transition_spawn_point_mappings.ods")
+TRANSITION_CACHE_FILE_PATH = os.path.join(CACHE_FILE_PATH, "transition_spawn_point_mappings.json")
+USE_TRANSITION_CACHE = True
+# compiled maps written by mapCompiler.py, used instead of the .tmx files while they are up to date
+MAP_CACHE_FILE_PATH = os.path.join(CACHE_FILE_PATH, "maps")
+USE_MAP_CACHE = True
+# navigation data built from the Collision_Objects of each map, rebuilt when the .tmx file changes
+NAVIGATION_CACHE_FILE_PATH = os.path.join(CACHE_FILE_PATH, "navigation")
+USE_NAVIGATION_CACHE = True
+# chunked maps written by mapCompiler.py stream, levels are streamed instead of loaded whole while they are up to date
+STREAM_CACHE_FILE_PATH = os.path.join(CACHE_FILE_PATH, "streams")
+USE_STREAMING = True
+PROFILE_EXPORT_FILE_PATH = os.path.join(CACHE_FILE_PATH, "profiles")
+# the game is saved every AUTOSAVE_INTERVAL seconds of game time on a worker thread, main.py --resume loads the save
+SAVE_FILE_PATH = os.path.join(ROOT_DIR, "saves")
+AUTOSAVE_FILE_PATH = os.path.join(SAVE_FILE_PATH, "autosave.sav")
+AUTOSAVE = True
+AUTOSAVE_INTERVAL = 5
 TEST_PLAYER_IMAGE_FILE_PATH = os.path.join(ROOT_DIR, "rawAssets", "man.png")
@@ -0,0 +1,116 @@
+import pygame
+from collections import defaultdict
+from itertools import count
+from settings import *
+
+
+class SpatialHash:
+    """ Uniform grid index over axis aligned rects. Every item is stored in each cell its rect overlaps, so a query
+        only has to look at the items sharing a cell with the query rect instead of every item in the index.
+    """
+    def __init__(self, cell_size: int = SPATIAL_HASH_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.item_rects = {}
+        # insertion order of every item, queries return their results in this order
+        self.item_order = {}
+        self.order_counter = count()
+
+    def __len__(self) -> int:
+        return len(self.item_rects)
+
+    def __contains__(self, item) -> bool:
+        return item in self.item_rects
+
+    def get_cells(self, rect: pygame.Rect):
+        first_column, first_row = rect.left // self.cell_size, rect.top // self.cell_size
+        last_column = max(rect.right - 1, rect.left) // self.cell_size
+        last_row = max(rect.bottom - 1, rect.top) // self.cell_size
+
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                yield column, row
+
+    def insert(self, item, rect: pygame.Rect):
+        if item in self.item_rects:
+            self.remove(item)
+
+        self.item_rects[item] = pygame.Rect(rect)
+        self.item_order[item] = next(self.order_counter)
+        for cell in self.get_cells(rect):
+            self.cells[cell].append(item)
+
+    def remove(self, item):
+        rect = self.item_rects.pop(item)
+        del self.item_order[item]
+        for cell in self.get_cells(rect):
+            self.cells[cell].remove(item)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def update(self, item, rect: pygame.Rect):
+        """ Re-indexes an item that has moved, keeping its original insertion order """
+        order = self.item_order[item]
+        self.insert(item, rect)
+        self.item_order[item] = order
+
+    def get_order(self, item) -> int:
+        return self.item_order[item]
+
+    def query_rect(self, rect: pygame.Rect) -> list:
+        """ Returns every item whose rect collides with rect, in insertion order """
+        candidates = set()
+        for cell in self.get_cells(rect):
+            candidates.update(self.cells.get(cell, ()))
+
+        hits = [item for item in candidates if self.item_rects[item].colliderect(rect)]
+        hits.sort(key=self.item_order.__getitem__)
+        return hits
+
+    def query_point(self, point: tuple[float, float]) -> list:
+        """ Returns every item whose rect contains point, in insertion order """
+        cell = (int(point[0] // self.cell_size), int(point[1] // self.cell_size))
+        hits = [item for item in self.cells.get(cell, ()) if self.item_rects[item].collidepoint(point)]
+        hits.sort(key=self.item_order.__getitem__)
+        return hits
+
+
+class SpatialGroup(pygame.sprite.Group):
+    """ Sprite group that keeps a SpatialHash of its members' rects up to date as sprites are added and removed.
+        Members are expected to be static, sprites that move must be re-indexed with update_sprite.
+    """
+    def __init__(self, *sprites, cell_size: int = SPATIAL_HASH_CELL_SIZE):
+        self.spatial_hash = SpatialHash(cell_size)
+        super().__init__(*sprites)
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.spatial_hash.insert(sprite, sprite.rect)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.spatial_hash.remove(sprite)
+
+    def update_sprite(self, sprite: pygame.sprite.Sprite):
+        self.spatial_hash.update(sprite, sprite.rect)
+
+    def query_rect(self, rect: pygame.Rect) -> list[pygame.sprite.Sprite]:
+        return self.spatial_hash.query_rect(rect)
+
+    def query_point(self, point: tuple[float, float]) -> list[pygame.sprite.Sprite]:
+        return self.spatial_hash.query_point(point)
+
+    def collisions(self, rect: pygame.Rect):
+        """ Yields the members colliding with rect in the same order as testing every member of the group in turn.
+            The caller may move rect between yields, the remaining members are then tested against its new position.
+        """
+        last_order = -1
+        while True:
+            for sprite in self.query_rect(rect):
+                if self.spatial_hash.get_order(sprite) > last_order:
+                    break
+            else:
+                return
+
+            last_order = self.spatial_hash.get_order(sprite)
+            yield sprite
@@ -0,0 +1,94 @@
+""" Startup timeline of the game. main.py --startup-trace prints the time from the start of the process to each
+    startup milestone as JSON and exits once the levels loaded in the background are built. Running this module starts
+    the game that way in fresh processes and reports the median time of each startup phase.
+
+    python startupTrace.py [--runs N] [--budget MS] [--output PATH]
+    exits with 1 if the median time to the first frame is over the budget (STARTUP_BUDGET_MS by default)
+"""
+import os
+import sys
+import json
+import time
+
+# start of the line main.py --startup-trace prints its milestones on
+STARTUP_TRACE_PREFIX = "startup trace: "
+
+
+class StartupTrace:
+    """ Wall clock times of the startup milestones in ms since this module was imported, which main.py does before
+        anything else. Wall clock time so the launching process can add the time the interpreter took to start.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.marks = {}
+
+    def mark(self, name: str):
+        """ Records the first time a milestone is reached, later calls are ignored """
+        if name not in self.marks:
+            self.marks[name] = (time.time() - self.start) * 1000
+
+    def report(self):
+        print(STARTUP_TRACE_PREFIX + json.dumps({"start": self.start, "marks": self.marks}), flush=True)
+
+
+startup_trace = StartupTrace()
+
+
+def run_game(main_path: str, video_driver: str) -> dict[str, float]:
+    """ Starts the game in a new process and returns the time from launching it to each milestone in ms """
+    import subprocess
+
+    environment = dict(os.environ, SDL_VIDEODRIVER=video_driver, PYGAME_HIDE_SUPPORT_PROMPT="1")
+    launch_time = time.time()
+    result = subprocess.run([sys.executable, main_path, "--startup-trace"], capture_output=True, text=True,
+                            env=environment, cwd=os.path.dirname(main_path))
+    lines = [line for line in result.stdout.splitlines() if line.startswith(STARTUP_TRACE_PREFIX)]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"main.py --startup-trace failed:\n{result.stdout}{result.stderr}")
+
+    trace = json.loads(lines[-1][len(STARTUP_TRACE_PREFIX):])
+    interpreter_time = (trace["start"] - launch_time) * 1000
+    return {"interpreter": interpreter_time,
+            **{name: interpreter_time + elapsed for name, elapsed in trace["marks"].items()}}
+
+
+def print_report(milestones: dict[str, float]):
+    """ Each phase is the time from the previous milestone """
+    previous = 0.0
+    for name, elapsed in milestones.items():
+        print(f"    {name:<30} {elapsed - previous:8.1f} ms  (at {elapsed:8.1f} ms)")
+        previous = elapsed
+
+
+def main():
+    # only imported when the trace is run, main.py imports this module before anything else
+    import argparse
+    from statistics import median
+    from settings import STARTUP_BUDGET_MS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="game starts, the median of each milestone is reported")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS, metavar="MS",
+                        help="longest allowed time to the first frame")
+    parser.add_argument("--video-driver", default="dummy", help="SDL video driver of the game processes")
+    parser.add_argument("--output", metavar="PATH", help="write every run as JSON")
+    args = parser.parse_args()
+
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    runs = [run_game(main_path, args.video_driver) for _ in range(args.runs)]
+    milestones = {name: median(run[name] for run in runs) for name in runs[-1]}
+    print(f"startup, median of {args.runs} runs:")
+    print_report(milestones)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(runs, output_file, indent=2)
+
+    first_frame = milestones["first frame"]
+    if first_frame > args.budget:
+        print(f"OVER BUDGET first frame after {first_frame:.1f} ms, budget {args.budget} ms")
+        sys.exit(1)
+    print(f"first frame after {first_frame:.1f} ms, budget {args.budget} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import random
+import pygame
+import numpy as np
+from settings import *
+from mapLoader import CompiledMap, CompiledTileLayer, CompiledObject, CompiledObjectGroup, get_atlas_rect, \
+    ATLAS_COLUMNS
+
+# number of distinct tile images in a generated map
+STRESS_TILE_COUNT = 32
+
+
+def generate_stress_map(width: int, height: int, obstacle_count: int, tall_tile_ratio: float = 0.05,
+                        seed: int = 0) -> CompiledMap:
+    """ Generates a map in memory with a full Ground layer, a sparse Shadows layer, a sparse layer of y-sorted tiles
+        and obstacle_count random collision boxes. Like maps loaded by mapLoader, its images still have to be
+        converted with convert_map_images.
+    """
+    rng = np.random.default_rng(seed)
+
+    rows = -(-STRESS_TILE_COUNT // ATLAS_COLUMNS)
+    atlas = pygame.Surface((ATLAS_COLUMNS * TILE_SIZE, rows * TILE_SIZE), pygame.SRCALPHA)
+    opaque = []
+    for index in range(STRESS_TILE_COUNT):
+        # the first half of the tiles are opaque floor tiles, the rest have transparent borders
+        colour = [int(channel) for channel in rng.integers(0, 256, 3)]
+        tile_rect = pygame.Rect(get_atlas_rect(index))
+        if index < STRESS_TILE_COUNT // 2:
+            atlas.fill(colour, tile_rect)
+        else:
+            atlas.fill(colour, tile_rect.inflate(-TILE_SIZE // 4, -TILE_SIZE // 4))
+        opaque.append(index < STRESS_TILE_COUNT // 2)
+
+    images = [None] + [atlas.subsurface(get_atlas_rect(index)) for index in range(STRESS_TILE_COUNT)]
+    floor_tiles, tall_tiles = (1, STRESS_TILE_COUNT // 2 + 1), (STRESS_TILE_COUNT // 2 + 1, STRESS_TILE_COUNT + 1)
+
+    ground = rng.integers(*floor_tiles, size=(height, width), dtype=np.uint16)
+    shadows = np.where(rng.random((height, width)) < 0.1, rng.integers(*tall_tiles, size=(height, width)), 0)
+    obstacles = np.where(rng.random((height, width)) < tall_tile_ratio, rng.integers(*tall_tiles, size=(height, width)),
+                         0)
+
+    # collision boxes are in tiled (unscaled) pixels like the ones in the .tmx files
+    random_generator = random.Random(seed)
+    map_width, map_height = width * ORIGINAL_TILE_SIZE, height * ORIGINAL_TILE_SIZE
+    collision_objects = [CompiledObject({"id": object_id, "name": "obstacle", "type": None,
+                                         "x": random_generator.uniform(0, map_width),
+                                         "y": random_generator.uniform(0, map_height),
+                                         "width": random_generator.uniform(2, 24),
+                                         "height": random_generator.uniform(2, 24), "properties": {}})
+                         for object_id in range(1, obstacle_count + 1)]
+
+    layers = [
+        CompiledTileLayer("Ground", True, ground, images),
+        CompiledTileLayer("Shadows", True, shadows.astype(np.uint16), images),
+        CompiledTileLayer("Obstacles", True, obstacles.astype(np.uint16), images),
+        CompiledObjectGroup("Collision_Objects", False, collision_objects),
+        CompiledObjectGroup("Transition_Objects", True, []),
+        CompiledObjectGroup("Spawn_Points", True, []),
+    ]
+
+    return CompiledMap(f"stress_{width}x{height}_{obstacle_count}.tmx", width, height, layers, atlas, opaque, images)
@@ -1,5 +1,6 @@
 import pygame
 from settings import *
+from assetManager import asset_manager
 
 
 class Tile(pygame.sprite.Sprite):
@@ -8,5 +9,6 @@ class Tile(pygame.sprite.Sprite):
 
         super().__init__(groups)
         self.tiled_layer = tiled_layer
-        self.image = pygame.transform.scale(surf, (TILE_SIZE, TILE_SIZE))
+        # tiles using the same tile image share one scaled surface
+        self.image = asset_manager.get_scaled_surface(surf, (TILE_SIZE, TILE_SIZE))
         self.rect = self.image.get_rect(topleft=pos)
@@ -0,0 +1,94 @@
+import pygame
+import numpy as np
+from typing import Optional
+from settings import *
+from assetManager import asset_manager
+
+
+class TileLayer:
+    """ Tile map layer stored as a 2D array of tile ids, id 0 is empty and every other id indexes a surface table
+        shared by all layers of a map. Used for the floor layers, which are drawn underneath every sprite and never
+        need y-sorting.
+    """
+    def __init__(self, name: str, tile_ids: np.ndarray, surfaces: list[Optional[pygame.Surface]],
+                 origin: tuple[int, int] = (0, 0)):
+        self.name = name
+        self.tile_ids = tile_ids
+        self.surfaces = surfaces
+        self.height, self.width = tile_ids.shape
+        # (column, row) of the first tile, layers of streamed maps only cover part of the map
+        self.origin = origin
+        # scale -> (surface table, the table shrunk by scale), rebuilt only when the surface table is replaced
+        self.scaled_surface_tables = {}
+
+    @staticmethod
+    def create_surface_table(images: list[Optional[pygame.Surface]]) -> list[Optional[pygame.Surface]]:
+        """ Scales the tile images of a map (usually a no-op, maps are loaded at TILE_SIZE) sharing them with the
+            sprites using the same images
+        """
+        return [asset_manager.get_scaled_surface(image, (TILE_SIZE, TILE_SIZE)) if image is not None else None
+                for image in images]
+
+    @classmethod
+    def from_map_layer(cls, layer, surfaces: list[Optional[pygame.Surface]]) -> "TileLayer":
+        """ Works for both pytmx.TiledTileLayer (data holds gids) and CompiledTileLayer (data holds image indexes),
+            in both cases the ids index the images of the map
+        """
+        tile_ids = np.asarray(layer.data, dtype=np.uint16 if len(surfaces) <= 2 ** 16 else np.uint32)
+        return cls(layer.name, tile_ids, surfaces)
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.tile_ids))
+
+    def get_index_range(self, world_area: pygame.Rect) -> tuple[int, int, int, int]:
+        """ Returns the (first column, first row, end column, end row) indexes of the tiles overlapping a world area,
+            clipped to the layer
+        """
+        origin_column, origin_row = self.origin
+        first_column = max(world_area.left // TILE_SIZE - origin_column, 0)
+        first_row = max(world_area.top // TILE_SIZE - origin_row, 0)
+        end_column = min((world_area.right - 1) // TILE_SIZE + 1 - origin_column, self.width)
+        end_row = min((world_area.bottom - 1) // TILE_SIZE + 1 - origin_row, self.height)
+        return first_column, first_row, end_column, end_row
+
+    def get_scaled_surfaces(self, scale: int) -> list[Optional[pygame.Surface]]:
+        """ The surface table shrunk by scale, for drawing at native resolution """
+        if scale == 1:
+            return self.surfaces
+
+        surfaces, scaled_surfaces = self.scaled_surface_tables.get(scale, (None, None))
+        if surfaces is not self.surfaces:
+            scaled_surfaces = [asset_manager.get_native_surface(surface, scale) if surface is not None else None
+                               for surface in self.surfaces]
+            self.scaled_surface_tables[scale] = (self.surfaces, scaled_surfaces)
+
+        return scaled_surfaces
+
+    def draw(self, surface: pygame.Surface, world_area: pygame.Rect, offset: tuple[int, int], scale: int = 1) -> int:
+        """ Blits the tiles overlapping world_area to surface, shifted by -offset and shrunk by scale. Returns the
+            number of blits.
+        """
+        first_column, first_row, end_column, end_row = self.get_index_range(world_area)
+        if first_column >= end_column or first_row >= end_row:
+            return 0
+
+        window = self.tile_ids[first_row:end_row, first_column:end_column]
+        rows, columns = np.nonzero(window)
+        surfaces = self.get_scaled_surfaces(scale)
+        tile_size = TILE_SIZE // scale
+        offset_x = (offset[0] - (self.origin[0] + first_column) * TILE_SIZE) // scale
+        offset_y = (offset[1] - (self.origin[1] + first_row) * TILE_SIZE) // scale
+        surface.blits([(surfaces[tile_id], (column * tile_size - offset_x, row * tile_size - offset_y))
+                       for row, column, tile_id in zip(rows.tolist(), columns.tolist(), window[rows, columns].tolist())],
+                      doreturn=False)
+        return len(rows)
+
+    def get_surfaces(self) -> dict[int, pygame.Surface]:
+        """ Surfaces of the tiles used by the layer, keyed by id """
+        surfaces = (self.surfaces[tile_id] for tile_id in np.unique(self.tile_ids).tolist() if tile_id)
+        return {id(surface): surface for surface in surfaces}
+
+    def get_bytes(self) -> int:
+        """ Memory used by the tile id array, the shared surfaces are counted by their owner """
+        return self.tile_ids.nbytes
+
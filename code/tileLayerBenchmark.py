@@ -0,0 +1,100 @@
+""" Compares the memory use and load time of the floor layers stored as TileLayer arrays against the previous
+    approach of one Tile sprite per floor tile with every floor chunk baked up front. Run from the code directory:
+    python tileLayerBenchmark.py [--size 256]
+"""
+import os
+import gc
+import time
+import argparse
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+from settings import *
+from tile import Tile
+from tileLayer import TileLayer
+from assetManager import get_surface_bytes
+from mapLoader import convert_map_images
+from stressMap import generate_stress_map
+
+
+def load_sprite_floor(map_data) -> list:
+    """ One Tile sprite per floor tile in a group, baked into chunks covering the whole map """
+    chunk_size = FLOOR_CHUNK_SIZE * TILE_SIZE
+    tiles = pygame.sprite.Group()
+    for layer in map_data.visible_layers:
+        if hasattr(layer, "data") and layer.name in FLOOR_LAYERS:
+            for x, y, surf in layer.tiles():
+                Tile((x * TILE_SIZE, y * TILE_SIZE), surf, [tiles], layer.name)
+
+    chunks = {}
+    for tile in tiles:
+        chunk_position = (tile.rect.x // chunk_size, tile.rect.y // chunk_size)
+        if chunk_position not in chunks:
+            chunks[chunk_position] = pygame.Surface((chunk_size, chunk_size), pygame.SRCALPHA)
+        chunks[chunk_position].blit(tile.image, (tile.rect.x % chunk_size, tile.rect.y % chunk_size))
+
+    return [tiles, {position: chunk.convert_alpha() for position, chunk in chunks.items()}]
+
+
+def load_array_floor(map_data) -> list:
+    """ Tile id arrays, chunks are only baked once they come into view """
+    surfaces = TileLayer.create_surface_table(map_data.images)
+    return [[TileLayer.from_map_layer(layer, surfaces) for layer in map_data.visible_layers
+             if hasattr(layer, "data") and layer.name in FLOOR_LAYERS]]
+
+
+def measure(name: str, load, map_data) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    floor = load(map_data)
+    load_time = time.perf_counter() - start
+    python_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # pixel data is allocated by SDL so it is not seen by tracemalloc
+    chunks = floor[1] if len(floor) > 1 else {}
+    surface_bytes = sum(get_surface_bytes(chunk) for chunk in chunks.values())
+    print(f"{name:>14}: load {load_time * 1000:9.1f} ms   python objects {python_bytes / 2 ** 20:8.1f} MiB   "
+          f"chunk surfaces {surface_bytes / 2 ** 20:8.1f} MiB")
+    return {"load_ms": load_time * 1000, "python_bytes": python_bytes, "surface_bytes": surface_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=256, help="map width and height in tiles")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+
+    map_data = generate_stress_map(args.size, args.size, 0)
+    convert_map_images(map_data)
+    print(f"{args.size}x{args.size} map, floor layers {', '.join(FLOOR_LAYERS)}")
+
+    sprites = measure("sprite per tile", load_sprite_floor, map_data)
+    arrays = measure("TileLayer", load_array_floor, map_data)
+    saved_bytes = sprites["python_bytes"] + sprites["surface_bytes"] - arrays["python_bytes"]
+    print(f"TileLayer saves {sprites['load_ms'] - arrays['load_ms']:.0f} ms of load time and "
+          f"{saved_bytes / 2 ** 20:.0f} MiB")
+
+    # the chunks the TileLayers do not bake up front are baked while drawing instead
+    chunk_size = FLOOR_CHUNK_SIZE * TILE_SIZE
+    layers = load_array_floor(map_data)[0]
+    chunk_count = (-(-WIDTH // chunk_size) + 1) * (-(-HEIGHT // chunk_size) + 1)
+    start = time.perf_counter()
+    for index in range(chunk_count):
+        chunk_area = pygame.Rect(index * chunk_size, 0, chunk_size, chunk_size)
+        chunk = pygame.Surface(chunk_area.size, pygame.SRCALPHA)
+        for layer in layers:
+            layer.draw(chunk, chunk_area, chunk_area.topleft)
+        chunk.convert_alpha()
+    print(f"baking the {chunk_count} chunks of one screen from TileLayers takes "
+          f"{(time.perf_counter() - start) * 1000:.1f} ms, cached chunks use at most "
+          f"{FLOOR_CHUNK_CACHE_SIZE * chunk_size ** 2 * 4 / 2 ** 20:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import pygame
 from settings import *
 from hitbox import HitBox
-from utils import get_spawn_point_object_data
+from transitionRegistry import get_transition_registry
 
 
 class TransitionBox(HitBox):
@@ -13,6 +13,7 @@ class TransitionBox(HitBox):
         return self.transition_code
 
     def get_new_level_code(self):
-        new_level_code = get_spawn_point_object_data(self.transition_code)[0]
+        # None for transitions that have not been implemented yet
+        new_level_code = get_transition_registry().get_level_code(self.transition_code)
         return new_level_code
 
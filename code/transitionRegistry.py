@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+from typing import NamedTuple, Optional
+from settings import *
+
+# transition code used in the .tmx files for transitions that have not been implemented yet
+UNIMPLEMENTED_TRANSITION_CODE = -1
+SPAWN_POINT_MAPPING_SHEET = "spawn_point_mapping"
+SPAWN_POINT_MAPPING_HEADER = ["Code", "Spawn Point Name", "File", "Local Spawn Point ID"]
+CACHE_FORMAT_VERSION = 1
+
+
+class SpawnPointMapping(NamedTuple):
+    code: int
+    spawn_point_name: str
+    map_file: str
+    spawn_point_id: int
+
+    @property
+    def level_code(self) -> int:
+        return int(self.map_file.split('.')[0])
+
+
+class TransitionRegistry:
+    """ Compiled, in memory version of the transition -> spawn point mapping spreadsheet. The spreadsheet is read
+        and validated once, lookups afterwards are plain dict accesses and spawn point objects are resolved from the
+        maps that are already loaded instead of re-parsing the .tmx file.
+    """
+    def __init__(self, mapping_path: str = TRANSITION_MAPPING_FILE_PATH,
+                 cache_path: Optional[str] = TRANSITION_CACHE_FILE_PATH):
+        self.mapping_path = mapping_path
+        self.cache_path = cache_path
+        self.mappings = {}
+        # map data of the built levels keyed by .tmx file name, dropped when a level is evicted
+        self.maps = {}
+
+    def load(self):
+        records = self.load_cache()
+        if records is None:
+            records = self.read_mapping_file()
+            self.write_cache(records)
+
+        self.mappings = {}
+        for record in records:
+            mapping = SpawnPointMapping(*record)
+            self.mappings[mapping.code] = mapping
+
+    def read_mapping_file(self) -> list[list]:
+        from pyexcel_ods import get_data
+
+        sheets = get_data(self.mapping_path)
+        if SPAWN_POINT_MAPPING_SHEET not in sheets:
+            raise ValueError(f"{self.mapping_path} has no '{SPAWN_POINT_MAPPING_SHEET}' sheet")
+
+        header, *rows = sheets[SPAWN_POINT_MAPPING_SHEET]
+        if header[:len(SPAWN_POINT_MAPPING_HEADER)] != SPAWN_POINT_MAPPING_HEADER:
+            raise ValueError(f"unexpected '{SPAWN_POINT_MAPPING_SHEET}' header {header}, "
+                             f"expected {SPAWN_POINT_MAPPING_HEADER}")
+
+        records, codes = [], set()
+        for row_number, row in enumerate(rows, start=2):
+            # skip blank rows left at the end of the sheet
+            if not any(row):
+                continue
+
+            if len(row) < len(SPAWN_POINT_MAPPING_HEADER):
+                raise ValueError(f"row {row_number} of '{SPAWN_POINT_MAPPING_SHEET}' is incomplete: {row}")
+
+            code, spawn_point_name, map_file, spawn_point_id = row[:len(SPAWN_POINT_MAPPING_HEADER)]
+            if not isinstance(code, int) or not isinstance(spawn_point_id, int):
+                raise ValueError(f"row {row_number}: code and spawn point id must be integers: {row}")
+
+            if code == UNIMPLEMENTED_TRANSITION_CODE or code in codes:
+                raise ValueError(f"row {row_number}: transition code {code} is reserved or duplicated")
+
+            if not os.path.isfile(os.path.join(MAPS_FILE_PATH, map_file)):
+                raise ValueError(f"row {row_number}: map file {map_file} does not exist in {MAPS_FILE_PATH}")
+
+            codes.add(code)
+            records.append([code, str(spawn_point_name), map_file, spawn_point_id])
+
+        return records
+
+    def get_source_signature(self) -> dict:
+        stat = os.stat(self.mapping_path)
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def get_source_hash(self) -> str:
+        with open(self.mapping_path, "rb") as mapping_file:
+            return hashlib.sha1(mapping_file.read()).hexdigest()
+
+    def load_cache(self) -> Optional[list[list]]:
+        """ Returns the cached records, or None if there is no cache or the spreadsheet has changed since it was
+            written. A changed mtime alone does not invalidate the cache as long as the file contents are the same.
+        """
+        if self.cache_path is None or not os.path.isfile(self.cache_path):
+            return None
+
+        try:
+            with open(self.cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+        if cache.get("version") != CACHE_FORMAT_VERSION:
+            return None
+
+        if cache.get("signature") != self.get_source_signature():
+            if cache.get("hash") != self.get_source_hash():
+                return None
+
+            # contents unchanged, refresh the signature so the hash is not recomputed next time
+            self.write_cache(cache["records"])
+
+        return cache["records"]
+
+    def write_cache(self, records: list[list]):
+        if self.cache_path is None:
+            return
+
+        cache = {"version": CACHE_FORMAT_VERSION, "signature": self.get_source_signature(),
+                 "hash": self.get_source_hash(), "records": records}
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with open(self.cache_path, "w") as cache_file:
+            json.dump(cache, cache_file)
+
+    def register_map(self, map_file: str, tmx_data):
+        """ Makes an already loaded map available for spawn point object lookups """
+        self.maps[map_file] = tmx_data
+
+    def unregister_map(self, map_file: str):
+        """ Called when the level of a map is evicted so the registry does not keep its map data alive """
+        self.maps.pop(map_file, None)
+
+    def get_mapping(self, transition_code: int) -> Optional[SpawnPointMapping]:
+        """ None for unimplemented and unknown transition codes """
+        return self.mappings.get(transition_code)
+
+    def get_spawn_point_id(self, transition_code: int) -> int:
+        mapping = self.get_mapping(transition_code)
+        return mapping.spawn_point_id if mapping else UNIMPLEMENTED_TRANSITION_CODE
+
+    def get_level_code(self, transition_code: int) -> Optional[int]:
+        mapping = self.get_mapping(transition_code)
+        return mapping.level_code if mapping else None
+
+    def get_spawn_point_object(self, transition_code: int):
+        mapping = self.get_mapping(transition_code)
+        if mapping is None:
+            return None
+
+        map_data = self.maps.get(mapping.map_file)
+        if map_data is None:
+            # only happens for maps without a built level, which are not kept
+            from pytmx.util_pygame import load_pygame
+            map_data = load_pygame(os.path.join(MAPS_FILE_PATH, mapping.map_file))
+
+        return map_data.get_object_by_id(mapping.spawn_point_id)
+
+
+transition_registry = None
+
+
+def get_transition_registry() -> TransitionRegistry:
+    """ Returns the shared registry, loading it on first use """
+    global transition_registry
+    if transition_registry is None:
+        transition_registry = TransitionRegistry(cache_path=TRANSITION_CACHE_FILE_PATH if USE_TRANSITION_CACHE else None)
+        transition_registry.load()
+
+    return transition_registry
@@ -0,0 +1,144 @@
+import pygame
+from typing import Optional
+from settings import *
+from profiler import profiler
+from eventBus import EventBus, event_bus, WAKE_ENTITY, WakeEntity
+
+NEAR, FAR, ASLEEP = "near", "far", "asleep"
+TIERS = (NEAR, FAR, ASLEEP)
+# profiler counter of each tier, summed per frame
+TIER_COUNTERS = {NEAR: "updated near", FAR: "updated far", ASLEEP: "asleep"}
+
+
+def needs_update(sprite: pygame.sprite.Sprite) -> bool:
+    """ Sprites that do not override Sprite.update (tiles, hit boxes, crowd members) have nothing to update """
+    return type(sprite).update is not pygame.sprite.Sprite.update
+
+
+def get_view_distance(rect: pygame.Rect, view_rect: pygame.Rect) -> int:
+    """ Distance in pixels along the furthest axis between a rect and the view, 0 if they overlap """
+    return max(view_rect.left - rect.right, rect.left - view_rect.right,
+               view_rect.top - rect.bottom, rect.top - view_rect.bottom, 0)
+
+
+class UpdateScheduler:
+    """ Updates the sprites of a group that have an update method, static sprites are never visited. Every interval
+        steps the sprites are put in a tier by their distance from the view: near ones are updated every step, far ones
+        once per interval with the number of steps they cover (see Entity.update), and the ones beyond sleep_distance
+        are not updated until they come closer again or are woken by wake (or a WAKE_ENTITY event). Updates of the
+        far sprites are spread over the steps of the interval. shutdown must be called once the scheduler is no longer
+        used, it is subscribed to WAKE_ENTITY until then.
+    """
+    def __init__(self, near_distance: int = UPDATE_NEAR_DISTANCE, sleep_distance: int = UPDATE_SLEEP_DISTANCE,
+                 interval: int = UPDATE_FAR_INTERVAL, bus: EventBus = event_bus):
+        self.near_distance = near_distance
+        self.sleep_distance = sleep_distance
+        self.interval = interval
+        self.step = 0
+
+        # sprite -> step it was last updated at, in the order the sprites were added so near sprites are updated in
+        # the same order as by Group.update
+        self.last_updates = {}
+        # near sprites as an insertion ordered set
+        self.near = {}
+        # far sprites split into one bucket per step of the interval
+        self.far_buckets = [[] for _ in range(interval)]
+        self.sleeping = set()
+        # sprite -> step until which it is updated every step wherever it is
+        self.woken = {}
+
+        # sprites updated in each tier during the last step (asleep: sprites not updated), and in total
+        self.counts = dict.fromkeys(TIERS, 0)
+        self.totals = dict.fromkeys(TIERS, 0)
+
+        self.event_bus = bus
+        self.event_bus.subscribe(WAKE_ENTITY, self.on_wake_entity)
+
+    def shutdown(self):
+        self.event_bus.unsubscribe(WAKE_ENTITY, self.on_wake_entity)
+
+    def __len__(self) -> int:
+        return len(self.last_updates)
+
+    def add(self, sprite: pygame.sprite.Sprite):
+        # near until the next time the tiers are assigned
+        self.last_updates[sprite] = self.step - 1
+        self.near[sprite] = None
+
+    def remove(self, sprite: pygame.sprite.Sprite):
+        """ Removed sprites are dropped from the tier lists the next time the tiers are assigned """
+        self.last_updates.pop(sprite, None)
+        self.woken.pop(sprite, None)
+        self.sleeping.discard(sprite)
+
+    def wake(self, sprite: pygame.sprite.Sprite, steps: int = UPDATE_WAKE_STEPS):
+        """ Updates a sprite every step for at least the given number of steps, from the next step on """
+        if sprite not in self.last_updates:
+            return
+
+        self.woken[sprite] = self.step + steps
+        if sprite in self.sleeping:
+            # the time spent asleep is not caught up with
+            self.sleeping.discard(sprite)
+            self.last_updates[sprite] = self.step - 1
+        self.near[sprite] = None
+
+    def on_wake_entity(self, event: WakeEntity):
+        """ Entities that are not in the group of this scheduler are ignored """
+        self.wake(event.entity)
+
+    def assign_tiers(self, view_rect: Optional[pygame.Rect]):
+        self.woken = {sprite: until for sprite, until in self.woken.items() if until > self.step}
+        near, far, sleeping = {}, [], set()
+        for sprite in self.last_updates:
+            distance = get_view_distance(sprite.rect, view_rect) if view_rect is not None else 0
+            if distance <= self.near_distance or sprite in self.woken:
+                near[sprite] = None
+            elif distance <= self.sleep_distance:
+                far.append(sprite)
+            else:
+                sleeping.add(sprite)
+
+        for sprite in self.sleeping - sleeping:
+            # woken by proximity, the time spent asleep is not caught up with
+            if sprite in self.last_updates:
+                self.last_updates[sprite] = self.step - 1
+
+        self.near = near
+        self.far_buckets = [far[offset::self.interval] for offset in range(self.interval)]
+        self.sleeping = sleeping
+
+    def update(self, view_rect: Optional[pygame.Rect] = None):
+        """ Advances the sprites by one simulation step, every sprite is near while there is no view """
+        if self.step % self.interval == 0:
+            self.assign_tiers(view_rect)
+
+        near_count = far_count = 0
+        # sprites may be added while the others are updated
+        for sprite in list(self.near):
+            last_update = self.last_updates.get(sprite)
+            if last_update is not None:
+                self.update_sprite(sprite, last_update)
+                near_count += 1
+
+        for sprite in self.far_buckets[self.step % self.interval]:
+            # sprites that joined the near tier since the tiers were assigned are already up to date
+            last_update = self.last_updates.get(sprite)
+            if last_update is not None and last_update < self.step:
+                self.update_sprite(sprite, last_update)
+                far_count += 1
+
+        self.step += 1
+        self.counts = {NEAR: near_count, FAR: far_count, ASLEEP: len(self.sleeping)}
+        for tier, count in self.counts.items():
+            self.totals[tier] += count
+            profiler.count(TIER_COUNTERS[tier], count)
+
+    def update_sprite(self, sprite: pygame.sprite.Sprite, last_update: int):
+        """ Sprites only updated every step never have to handle more than one step at once """
+        steps = self.step - last_update
+        self.last_updates[sprite] = self.step
+        if steps == 1:
+            sprite.update()
+        else:
+            sprite.update(steps)
@@ -0,0 +1,466 @@
+""" Streaming world mode for large maps. mapCompiler.py stream splits a compiled map into a manifest (layer list, tile
+    atlas and spawn points) and one file per chunk of STREAM_CHUNK_SIZE x STREAM_CHUNK_SIZE tiles holding the tile
+    ids, collision boxes, transitions and spawn points of that part of the map. A StreamedLevel only keeps the chunks
+    around the player: they are read on a worker thread and turned into sprites when they join the level's groups on
+    the main thread, so the tile memory does not depend on the size of the map. The collision boxes of the whole map are
+    also kept in the manifest, so crowds and navigation see the obstacles of the chunks that are not loaded.
+"""
+import os
+import json
+import shutil
+import hashlib
+import pygame
+import numpy as np
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import NamedTuple, Optional
+from xml.etree import ElementTree
+from settings import *
+from tile import Tile
+from tileLayer import TileLayer
+from hitbox import HitBox
+from transitionBox import TransitionBox
+from spawnPoint import SpawnPoint
+from level import Level
+from crowd import ObstacleGrid
+from mapLoader import CompiledMap, CompiledTileLayer, CompiledObject, CompiledObjectGroup, load_atlas, \
+    read_cache_metadata, get_source_hashes, load_map_data, convert_map_images
+from profiler import profiler
+
+STREAM_FORMAT_VERSION = 3
+STREAM_MANIFEST_FILE_NAME = "manifest.npz"
+# object groups that are also kept whole in the manifest: spawn points are looked up by id before their chunk is loaded
+# and the crowd obstacle grid and the navigation grid cover the whole map
+RESIDENT_OBJECT_GROUPS = ["Spawn_Points", "Collision_Objects"]
+
+
+def get_stream_path(map_path: str) -> str:
+    """ Maps with the same file name in different folders get different streams """
+    map_name = os.path.splitext(os.path.basename(map_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(map_path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(STREAM_CACHE_FILE_PATH, f"{map_name}_{path_hash}")
+
+
+def get_chunk_file_name(chunk_position: tuple[int, int]) -> str:
+    return "chunk_{}_{}.npz".format(*chunk_position)
+
+
+def get_object_data(map_object) -> dict:
+    return {"id": map_object.id, "name": map_object.name, "type": map_object.type, "x": map_object.x,
+            "y": map_object.y, "width": map_object.width, "height": map_object.height,
+            "properties": dict(map_object.properties)}
+
+
+def write_stream(map_data: CompiledMap, stream_path: str, sources: dict[str, str],
+                 chunk_size: int = STREAM_CHUNK_SIZE):
+    """ Splits a compiled (or generated) map into the chunk files of a stream. Objects belong to the chunk containing
+        their top left corner, chunks without any tiles or objects are not written.
+    """
+    if chunk_size % FLOOR_CHUNK_SIZE:
+        raise ValueError(f"the chunk size must be a multiple of FLOOR_CHUNK_SIZE ({FLOOR_CHUNK_SIZE})")
+
+    columns, rows = -(-map_data.width // chunk_size), -(-map_data.height // chunk_size)
+    chunk_pixels = chunk_size * TILE_SIZE
+    chunk_arrays = defaultdict(dict)
+    chunk_objects = defaultdict(lambda: defaultdict(list))
+
+    layers = []
+    for index, layer in enumerate(map_data.layers):
+        if isinstance(layer, CompiledTileLayer):
+            layers.append({"type": "tile", "name": layer.name, "visible": bool(layer.visible)})
+            for row in range(rows):
+                for column in range(columns):
+                    tile_ids = layer.data[row * chunk_size:(row + 1) * chunk_size,
+                                          column * chunk_size:(column + 1) * chunk_size]
+                    if tile_ids.any():
+                        chunk_arrays[(column, row)][f"layer_{index}"] = tile_ids
+
+        elif isinstance(layer, CompiledObjectGroup):
+            objects = [get_object_data(map_object) for map_object in layer]
+            for object_data in objects:
+                column = min(max(int(object_data["x"] * SCALE // chunk_pixels), 0), columns - 1)
+                row = min(max(int(object_data["y"] * SCALE // chunk_pixels), 0), rows - 1)
+                chunk_objects[(column, row)][str(index)].append(object_data)
+
+            layers.append({"type": "objects", "name": layer.name, "visible": bool(layer.visible)})
+            if layer.name in RESIDENT_OBJECT_GROUPS:
+                layers[-1]["objects"] = objects
+
+    # written next to the previous stream and swapped in once complete
+    temporary_path = stream_path + ".tmp"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+
+    chunk_positions = sorted(chunk_arrays.keys() | chunk_objects.keys())
+    for chunk_position in chunk_positions:
+        objects = json.dumps(chunk_objects.get(chunk_position, {})).encode("utf-8")
+        with open(os.path.join(temporary_path, get_chunk_file_name(chunk_position)), "wb") as chunk_file:
+            np.savez(chunk_file, objects=np.frombuffer(objects, dtype=np.uint8),
+                     **chunk_arrays.get(chunk_position, {}))
+
+    atlas_pixels = np.frombuffer(pygame.image.tobytes(map_data.atlas, "RGBA"), dtype=np.uint8)
+    metadata = {"version": STREAM_FORMAT_VERSION, "tile_size": TILE_SIZE, "chunk_size": chunk_size,
+                "sources": sources, "width": map_data.width, "height": map_data.height,
+                "tile_count": len(map_data.opaque), "opaque": map_data.opaque, "tile_keys": map_data.tile_keys,
+                "layers": layers,
+                "chunks": [list(chunk_position) for chunk_position in chunk_positions]}
+    with open(os.path.join(temporary_path, STREAM_MANIFEST_FILE_NAME), "wb") as manifest_file:
+        np.savez(manifest_file, metadata=np.frombuffer(json.dumps(metadata).encode("utf-8"), dtype=np.uint8),
+                 atlas=atlas_pixels.reshape(map_data.atlas.get_height(), map_data.atlas.get_width(), 4))
+
+    shutil.rmtree(stream_path, ignore_errors=True)
+    os.replace(temporary_path, stream_path)
+
+
+def read_stream_metadata(stream_path: str) -> Optional[dict]:
+    try:
+        with np.load(os.path.join(stream_path, STREAM_MANIFEST_FILE_NAME)) as manifest:
+            return read_cache_metadata(manifest)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def is_stream_fresh(map_path: str, stream_path: str) -> bool:
+    """ Same test as mapLoader.is_cache_fresh, streams split with a different chunk size are stale too """
+    metadata = read_stream_metadata(stream_path)
+    if metadata is None or metadata.get("version") != STREAM_FORMAT_VERSION or \
+            metadata.get("tile_size") != TILE_SIZE or metadata.get("chunk_size") != STREAM_CHUNK_SIZE:
+        return False
+
+    try:
+        return metadata["sources"] == get_source_hashes(map_path)
+    except (OSError, ElementTree.ParseError):
+        return False
+
+
+class StreamedMap(CompiledMap):
+    """ Manifest of a streamed map. Has no tile layers and only the objects of RESIDENT_OBJECT_GROUPS, the rest of the
+        map is loaded chunk by chunk.
+    """
+    def __init__(self, filename: str, stream_path: str, metadata: dict, atlas: pygame.Surface,
+                 images: list[Optional[pygame.Surface]]):
+        layers = [CompiledObjectGroup(layer["name"], layer["visible"],
+                                      [CompiledObject(object_data) for object_data in layer.get("objects", [])])
+                  for layer in metadata["layers"] if layer["type"] == "objects"]
+        super().__init__(filename, metadata["width"], metadata["height"], layers, atlas, metadata["opaque"], images,
+                         metadata["tile_keys"])
+        self.stream_path = stream_path
+        self.chunk_size = metadata["chunk_size"]
+        self.layer_info = metadata["layers"]
+        self.chunk_positions = {tuple(chunk_position) for chunk_position in metadata["chunks"]}
+
+    def get_chunk_path(self, chunk_position: tuple[int, int]) -> str:
+        return os.path.join(self.stream_path, get_chunk_file_name(chunk_position))
+
+
+def load_streamed_map(stream_path: str, map_path: str) -> StreamedMap:
+    """ Loads the manifest of a stream, like parse_tmx the images still have to be converted on the main thread """
+    with np.load(os.path.join(stream_path, STREAM_MANIFEST_FILE_NAME)) as manifest:
+        metadata = read_cache_metadata(manifest)
+        atlas = manifest["atlas"]
+
+    atlas_surface, images = load_atlas(atlas, metadata["tile_count"])
+    return StreamedMap(map_path, stream_path, metadata, atlas_surface, images)
+
+
+def load_level_data(map_path: str) -> CompiledMap:
+    """ Loads the manifest of a map's stream when it is up to date and the whole map otherwise. Safe to call from a
+        worker thread, the images still have to be converted with convert_map_images.
+    """
+    if USE_STREAMING:
+        stream_path = get_stream_path(map_path)
+        if is_stream_fresh(map_path, stream_path):
+            return load_streamed_map(stream_path, map_path)
+
+    return load_map_data(map_path)
+
+
+class ChunkData(NamedTuple):
+    """ Contents of a chunk file as read on the loader thread, no surfaces or sprites """
+    chunk_position: tuple[int, int]
+    # (layer name, tile id array) of the floor layers
+    floor_layers: list
+    # (layer name, tile positions in pixels, tile ids) of the other tile layers
+    tile_layers: list
+    # (object group name, CompiledObject) of the chunk's objects
+    objects: list
+
+
+class StreamedChunk:
+    """ Floor layers and sprites of one chunk, built on the main thread when the chunk joins the level's groups """
+    def __init__(self, chunk_position: tuple[int, int], world_rect: pygame.Rect):
+        self.chunk_position = chunk_position
+        self.world_rect = world_rect
+        self.floor_layers = []
+        self.tiles = []
+        self.obstacles = []
+        self.transitions = []
+        self.spawn_points = []
+
+    def get_bytes(self) -> int:
+        return sum(layer.get_bytes() for layer in self.floor_layers)
+
+
+def read_chunk(map_data: StreamedMap, chunk_position: tuple[int, int]) -> ChunkData:
+    """ Reads a chunk file, runs on the loader thread """
+    chunk_data = ChunkData(chunk_position, [], [], [])
+    if chunk_position not in map_data.chunk_positions:
+        return chunk_data
+
+    with np.load(map_data.get_chunk_path(chunk_position)) as chunk_file:
+        arrays = {name: chunk_file[name] for name in chunk_file.files}
+    objects = json.loads(arrays.pop("objects").tobytes().decode("utf-8"))
+
+    column, row = chunk_position
+    origin = (column * map_data.chunk_size, row * map_data.chunk_size)
+    for index, layer in enumerate(map_data.layer_info):
+        if layer["type"] == "tile":
+            tile_ids = arrays.get(f"layer_{index}")
+            if tile_ids is None or not layer["visible"]:
+                continue
+
+            if layer["name"] in FLOOR_LAYERS:
+                chunk_data.floor_layers.append((layer["name"], tile_ids))
+                continue
+
+            rows, columns = np.nonzero(tile_ids)
+            positions = zip(((origin[0] + columns) * TILE_SIZE).tolist(), ((origin[1] + rows) * TILE_SIZE).tolist())
+            chunk_data.tile_layers.append((layer["name"], list(positions), tile_ids[rows, columns].tolist()))
+            continue
+
+        chunk_data.objects.extend((layer["name"], CompiledObject(object_data))
+                                  for object_data in objects.get(str(index), []))
+
+    return chunk_data
+
+
+def build_chunk(map_data: StreamedMap, chunk_data: ChunkData,
+                surfaces: list[Optional[pygame.Surface]]) -> StreamedChunk:
+    """ Builds the floor layers and sprites of a chunk the same way Level.create_map does, runs on the main thread
+        because the tiles scale their surfaces through the asset manager
+    """
+    column, row = chunk_data.chunk_position
+    chunk_pixels = map_data.chunk_size * TILE_SIZE
+    chunk = StreamedChunk(chunk_data.chunk_position, pygame.Rect(column * chunk_pixels, row * chunk_pixels,
+                                                                 chunk_pixels, chunk_pixels))
+    origin = (column * map_data.chunk_size, row * map_data.chunk_size)
+    for name, tile_ids in chunk_data.floor_layers:
+        chunk.floor_layers.append(TileLayer(name, tile_ids, surfaces, origin))
+
+    for name, positions, tile_ids in chunk_data.tile_layers:
+        chunk.tiles.extend(Tile(position, surfaces[tile_id], [], name)
+                           for position, tile_id in zip(positions, tile_ids))
+
+    for group_name, map_object in chunk_data.objects:
+        position = (map_object.x, map_object.y)
+        size = (map_object.width, map_object.height)
+        if group_name == "Collision_Objects":
+            chunk.obstacles.append(HitBox(position, size, []))
+        elif group_name == "Transition_Objects":
+            chunk.transitions.append(TransitionBox(position, size, [], map_object.transition_code))
+        elif group_name == "Spawn_Points":
+            chunk.spawn_points.append(SpawnPoint(position, [], map_object.id))
+
+    return chunk
+
+
+class StreamedFloorLayer:
+    """ TileLayer interface over the floor layers of the loaded chunks. Floor chunks never straddle two stream chunks
+        so blitting each stream chunk's layers in turn keeps the layer order.
+    """
+    name = "streamed floor"
+
+    def __init__(self, chunks: dict[tuple[int, int], StreamedChunk]):
+        self.chunks = chunks
+
+    def __len__(self) -> int:
+        return sum(len(layer) for chunk in self.chunks.values() for layer in chunk.floor_layers)
+
+    def draw(self, surface: pygame.Surface, world_area: pygame.Rect, offset: tuple[int, int], scale: int = 1) -> int:
+        return sum(layer.draw(surface, world_area, offset, scale) for chunk in self.chunks.values()
+                   if chunk.world_rect.colliderect(world_area) for layer in chunk.floor_layers)
+
+    def get_surfaces(self) -> dict[int, pygame.Surface]:
+        surfaces = {}
+        for chunk in self.chunks.values():
+            for layer in chunk.floor_layers:
+                surfaces.update(layer.get_surfaces())
+        return surfaces
+
+    def get_bytes(self) -> int:
+        return sum(chunk.get_bytes() for chunk in self.chunks.values())
+
+
+class ChunkStreamer:
+    """ Keeps the chunks around a position loaded. Chunks are requested from a worker thread as soon as they are
+        within STREAM_RADIUS chunks, so they are normally ready long before they come into view. A chunk that is
+        needed before its load has finished is loaded on the main thread instead, which is counted in stalls.
+    """
+    def __init__(self, map_data: StreamedMap, surfaces: list[Optional[pygame.Surface]],
+                 groups: list[pygame.sprite.Group]):
+        self.map_data = map_data
+        self.surfaces = surfaces
+        self.visible_sprites, self.obstacle_sprites, self.transition_sprites, self.spawn_points = groups
+        self.chunk_pixels = map_data.chunk_size * TILE_SIZE
+        self.columns = -(-map_data.width // map_data.chunk_size)
+        self.rows = -(-map_data.height // map_data.chunk_size)
+
+        # loaded chunks keyed by (chunk column, chunk row) and the loads still running
+        self.chunks = {}
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chunk-streamer")
+        self.floor_layer = StreamedFloorLayer(self.chunks)
+        self.stalls = 0
+
+    def get_chunk_position(self, position: tuple[float, float]) -> tuple[int, int]:
+        return int(position[0] // self.chunk_pixels), int(position[1] // self.chunk_pixels)
+
+    def get_chunks_in_radius(self, position: tuple[float, float], radius: int) -> list[tuple[int, int]]:
+        """ Chunks of the map within radius chunks of the chunk containing position, nearest first """
+        centre_column, centre_row = self.get_chunk_position(position)
+        chunk_positions = [(column, row)
+                           for row in range(max(centre_row - radius, 0), min(centre_row + radius + 1, self.rows))
+                           for column in range(max(centre_column - radius, 0),
+                                               min(centre_column + radius + 1, self.columns))]
+        chunk_positions.sort(key=lambda chunk: max(abs(chunk[0] - centre_column), abs(chunk[1] - centre_row)))
+        return chunk_positions
+
+    def get_chunks_overlapping(self, rect: pygame.Rect) -> list[tuple[int, int]]:
+        first_column, first_row = max(rect.left // self.chunk_pixels, 0), max(rect.top // self.chunk_pixels, 0)
+        last_column = min((rect.right - 1) // self.chunk_pixels, self.columns - 1)
+        last_row = min((rect.bottom - 1) // self.chunk_pixels, self.rows - 1)
+        return [(column, row) for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)]
+
+    def request(self, chunk_position: tuple[int, int]):
+        if chunk_position not in self.chunks and chunk_position not in self.pending:
+            self.pending[chunk_position] = self.executor.submit(read_chunk, self.map_data, chunk_position)
+
+    def load_now(self, chunk_position: tuple[int, int]):
+        """ Loads and adds a chunk on the calling thread unless it is already loaded """
+        if chunk_position in self.chunks:
+            return
+
+        future: Optional[Future] = self.pending.pop(chunk_position, None)
+        if future is not None and not future.cancel():
+            # already being read
+            chunk_data = future.result()
+        else:
+            chunk_data = read_chunk(self.map_data, chunk_position)
+        self.add_chunk(chunk_data)
+
+    def load_around(self, position: tuple[float, float]):
+        """ Loads every chunk within STREAM_RADIUS of a position right away, e.g. when the player is placed in the
+            level
+        """
+        for chunk_position in self.get_chunks_in_radius(position, STREAM_RADIUS):
+            self.load_now(chunk_position)
+
+    def add_chunk(self, chunk_data: ChunkData):
+        chunk = build_chunk(self.map_data, chunk_data, self.surfaces)
+        self.chunks[chunk.chunk_position] = chunk
+        self.visible_sprites.add(chunk.tiles)
+        self.obstacle_sprites.add(chunk.obstacles)
+        self.transition_sprites.add(chunk.transitions)
+        self.spawn_points.add(chunk.spawn_points)
+        if chunk.floor_layers:
+            self.visible_sprites.invalidate_floor(chunk.world_rect)
+
+    def remove_chunk(self, chunk_position: tuple[int, int]):
+        chunk = self.chunks.pop(chunk_position)
+        self.visible_sprites.remove(chunk.tiles)
+        self.obstacle_sprites.remove(chunk.obstacles)
+        self.transition_sprites.remove(chunk.transitions)
+        self.spawn_points.remove(chunk.spawn_points)
+        if chunk.floor_layers:
+            self.visible_sprites.invalidate_floor(chunk.world_rect)
+
+    def update(self, position: tuple[float, float], required_area: pygame.Rect):
+        """ Called once per update with the player's position. Makes sure the chunks overlapping required_area are
+            loaded, requests the chunks within STREAM_RADIUS, adds at most STREAM_MAX_CHUNKS_PER_UPDATE finished loads
+            and evicts the chunks further than STREAM_EVICT_RADIUS.
+        """
+        for chunk_position in self.get_chunks_overlapping(required_area):
+            if chunk_position not in self.chunks:
+                self.stalls += 1
+                self.load_now(chunk_position)
+
+        for chunk_position in self.get_chunks_in_radius(position, STREAM_RADIUS):
+            self.request(chunk_position)
+
+        centre_column, centre_row = self.get_chunk_position(position)
+
+        def is_out_of_range(chunk_position: tuple[int, int]) -> bool:
+            return max(abs(chunk_position[0] - centre_column), abs(chunk_position[1] - centre_row)) > \
+                STREAM_EVICT_RADIUS
+
+        added = 0
+        for chunk_position, future in list(self.pending.items()):
+            if added == STREAM_MAX_CHUNKS_PER_UPDATE:
+                break
+
+            if future.done():
+                del self.pending[chunk_position]
+                # the player may have moved away while the chunk was loading
+                if not is_out_of_range(chunk_position):
+                    self.add_chunk(future.result())
+                    added += 1
+
+        for chunk_position in [chunk_position for chunk_position in self.chunks if is_out_of_range(chunk_position)]:
+            self.remove_chunk(chunk_position)
+        for chunk_position in [chunk_position for chunk_position in self.pending if is_out_of_range(chunk_position)]:
+            if self.pending[chunk_position].cancel():
+                del self.pending[chunk_position]
+
+
+class StreamedLevel(Level):
+    """ Level whose map is streamed around the player instead of being loaded whole, at most
+        (2 * STREAM_EVICT_RADIUS + 1) ** 2 chunks are in memory however large the map is
+    """
+    def __init__(self, map_path: str, player=None, tmx_data: StreamedMap = None):
+        if tmx_data is None:
+            tmx_data = load_streamed_map(get_stream_path(map_path), map_path)
+            convert_map_images(tmx_data)
+
+        self.streamer = None
+        super().__init__(map_path, player, tmx_data)
+
+    def create_map(self):
+        self.streamer = ChunkStreamer(self.tmx_data, self.tile_surfaces, self.get_level_groups())
+        self.floor_layers = [self.streamer.floor_layer]
+        self.visible_sprites.set_floor_layers(self.floor_layers)
+
+    def get_spawn_point(self, spawn_point_id: int) -> Optional[SpawnPoint]:
+        # the spawn points of the manifest are known before their chunk is loaded
+        spawn_point_object = self.tmx_data.objects_by_id.get(spawn_point_id)
+        if spawn_point_object is not None:
+            self.streamer.load_around((spawn_point_object.x * SCALE, spawn_point_object.y * SCALE))
+
+        return super().get_spawn_point(spawn_point_id)
+
+    def set_player(self, player):
+        super().set_player(player)
+        self.streamer.load_around(player.rect.center)
+
+    def shutdown(self):
+        super().shutdown()
+        self.streamer.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_obstacle_grid(self) -> ObstacleGrid:
+        # the obstacle group only holds the loaded chunks, the crowd may be anywhere on the map
+        return ObstacleGrid.from_map_objects(self.tmx_data.get_layer_by_name("Collision_Objects"))
+
+    def get_sprite_counts(self) -> dict[str, int]:
+        sprite_counts = super().get_sprite_counts()
+        sprite_counts["chunks"] = len(self.streamer.chunks)
+        return sprite_counts
+
+    def update(self):
+        if self.player is not None:
+            with profiler.scope("streaming"):
+                # the camera can trail the player by up to one step while rendering is interpolated
+                self.streamer.update(self.player.rect.center,
+                                     self.get_view_rect().inflate(INTERPOLATION_MAX_DISTANCE * 2,
+                                                                  INTERPOLATION_MAX_DISTANCE * 2))
+
+        super().update()
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code")
+# the game's modules import each other from the code folder and definitions.py from the project root
+sys.path[:0] = [os.path.dirname(CODE_DIR), CODE_DIR]
+# and so do the game processes started by the tests
+os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(CODE_DIR), os.environ.get("PYTHONPATH")]))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+
+@pytest.fixture(scope="session")
+def display():
+    """ Images are converted for the display so it has to exist before any level or entity is created """
+    import pygame
+    from settings import WIDTH, HEIGHT
+
+    pygame.init()
+    yield pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.quit()
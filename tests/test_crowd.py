@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from settings import TEST_PLAYER_IMAGE_FILE_PATH
+from animation import animation_clock
+from entity import Entity
+from crowd import Crowd, create_world
+
+
+def run_side_by_side(entity_count: int, frames: int, obstacle_count: int, map_size: int, seed: int):
+    """ Runs Entity objects and a crowd side by side with the same directions, yields the frame, the entities and the
+        crowd after every frame
+    """
+    obstacle_sprites, positions = create_world(entity_count, obstacle_count, map_size, seed)
+    crowd = Crowd(obstacle_sprites, [], seed=seed)
+    crowd.add(positions)
+    entities = [Entity(position, TEST_PLAYER_IMAGE_FILE_PATH, [], obstacle_sprites) for position in positions]
+
+    rng = np.random.default_rng(seed)
+    for frame in range(frames):
+        # mostly axis aligned and diagonal directions, some arbitrary ones
+        directions = rng.integers(-1, 2, size=(entity_count, 2)).astype(np.float64)
+        arbitrary = rng.random(entity_count) < 0.1
+        directions[arbitrary] = rng.uniform(-1, 1, size=(int(arbitrary.sum()), 2))
+
+        animation_clock.tick()
+        crowd.set_directions(directions)
+        crowd.animate()
+        crowd.move()
+        crowd.write_back()
+
+        for entity, direction in zip(entities, directions.tolist()):
+            entity.direction.update(direction)
+            if direction[0]:
+                entity.status = "right" if direction[0] > 0 else "left"
+            elif direction[1]:
+                entity.status = "down" if direction[1] > 0 else "up"
+            entity.get_status()
+            entity.animate()
+            entity.move(entity.speed)
+
+        yield frame, entities, crowd
+
+
+@pytest.mark.parametrize("entity_count, frames, obstacle_count, map_size, seed", [
+    (100, 200, 2000, 64, 0),
+    # crowded map, most moves end in a collision
+    (100, 200, 4000, 24, 1),
+])
+def test_crowd_matches_entities(display, entity_count, frames, obstacle_count, map_size, seed):
+    """ Crowd members end every frame where Entity.move and Entity.collision put the same entities """
+    for frame, entities, crowd in run_side_by_side(entity_count, frames, obstacle_count, map_size, seed):
+        assert [tuple(member.rect) for member in crowd.members] == [tuple(entity.rect) for entity in entities], \
+            f"positions differ after frame {frame}"
+        assert [crowd.statuses[status] for status in crowd.status] == [entity.status for entity in entities], \
+            f"statuses differ after frame {frame}"
+        assert all(member.image is entity.image for member, entity in zip(crowd.members, entities)), \
+            f"images differ after frame {frame}"
+
+    assert frame == frames - 1
@@ -0,0 +1,71 @@
+import os
+import random
+from types import SimpleNamespace
+from xml.etree import ElementTree
+import numpy as np
+import pytest
+from settings import MAPS_FILE_PATH, STARTING_LEVEL_CODE
+from level import Level
+from hotReload import HotReloader, MapCopy, get_level_state, read_layer_data, reload_level
+
+ROUNDS = 5
+
+
+@pytest.fixture
+def map_copy():
+    copy = MapCopy(os.path.join(MAPS_FILE_PATH, f"{STARTING_LEVEL_CODE}.tmx"))
+    yield copy
+    copy.remove()
+
+
+def edit_map(map_copy: MapCopy, layer_names: list[str], rng: random.Random, round_number: int):
+    """ Sets and erases tiles in every layer, moves an object of every group and replaces a collision object """
+    for name in layer_names:
+        gids = read_layer_data(map_copy.get_layer(name))
+        used_gids = np.unique(gids).tolist()
+        for _ in range(rng.randint(1, 20)):
+            map_copy.set_tile(name, rng.randrange(gids.shape[1]), rng.randrange(gids.shape[0]), rng.choice(used_gids))
+
+    for group_name in ("Collision_Objects", "Transition_Objects", "Spawn_Points"):
+        group = map_copy.get_layer(group_name)
+        objects = list(group)
+        if not objects:
+            continue
+        moved = rng.choice(objects)
+        moved.set("x", str(float(moved.get("x")) + rng.randint(-32, 32)))
+        if group_name == "Collision_Objects":
+            group.remove(rng.choice(objects))
+            added = ElementTree.SubElement(group, "object", dict(rng.choice(objects).attrib))
+            added.set("id", str(1000 + round_number))
+            added.set("y", str(float(added.get("y")) + 16))
+
+    map_copy.save()
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_reload_matches_rebuild(display, map_copy, seed):
+    """ After every round of random edits the reloaded level matches a level built from the edited map """
+    rng = random.Random(seed)
+    level = Level(map_copy.path)
+    layer_names = [layer.name for layer in level.tmx_data.visible_layers if hasattr(layer, "data")]
+    for round_number in range(ROUNDS):
+        edit_map(map_copy, layer_names, rng, round_number)
+        assert reload_level(level)
+        expected_state, state = get_level_state(Level(map_copy.path)), get_level_state(level)
+        for key in expected_state:
+            assert state[key] == expected_state[key], f"{key} differ from the rebuilt level in round {round_number}"
+
+
+def test_unreadable_map_warns(display, map_copy):
+    """ A map Tiled has not finished writing is reported and the level is left as it was """
+    level = Level(map_copy.path)
+    state = get_level_state(level)
+    level_handler = SimpleNamespace(levels=SimpleNamespace(level_paths={STARTING_LEVEL_CODE: map_copy.path}),
+                                    offscreen_simulation=None)
+    hot_reloader = HotReloader(level_handler)
+    with open(map_copy.path, "w") as map_file:
+        map_file.write("<map")
+
+    with pytest.warns(RuntimeWarning, match="not reloaded"):
+        hot_reloader.reload_level(STARTING_LEVEL_CODE, level)
+    assert get_level_state(level) == state
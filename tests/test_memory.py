@@ -0,0 +1,12 @@
+from settings import MEMORY_LEVEL_BUDGET_MB, MEMORY_TOTAL_BUDGET_MB
+from memoryReport import get_memory_report, check_budgets
+
+
+def test_levels_within_memory_budgets(display):
+    """ Surface bytes of every bundled level and of everything loaded together, shared surfaces counted once """
+    report = get_memory_report()
+    assert report["levels"]
+    for level_code, level_report in report["levels"].items():
+        assert level_report["total"] <= MEMORY_LEVEL_BUDGET_MB * 2 ** 20, f"level {level_code} is over budget"
+    assert report["total"] <= MEMORY_TOTAL_BUDGET_MB * 2 ** 20
+    assert check_budgets(report, MEMORY_LEVEL_BUDGET_MB, MEMORY_TOTAL_BUDGET_MB) == []
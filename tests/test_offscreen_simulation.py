@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from crowd import CrowdSimulation
+from offscreenSimulation import OffscreenSimulation, create_crowd_level
+
+LEVEL_COUNT = 3
+CROWD_COUNT = 300
+
+
+@pytest.mark.parametrize("ticks", [0, 600])
+def test_worker_crowds_match_in_process_crowds(display, ticks):
+    """ Crowds run through the worker processes end where the same steps taken in this process put them """
+    simulation = OffscreenSimulation()
+    levels = {level_code: create_crowd_level(CROWD_COUNT, level_code) for level_code in range(1, LEVEL_COUNT + 1)}
+    references = {level_code: create_crowd_level(CROWD_COUNT, level_code) for level_code in levels}
+    try:
+        simulation.update(levels, 0)
+        simulation.wait()
+        for tick in range(ticks):
+            simulation.update(levels, 0)
+            # wait for the jobs now and then so every path (finished or running jobs) is taken
+            if tick % 7 == 0:
+                simulation.wait()
+
+        for level_code, level in levels.items():
+            reference = references[level_code].crowd
+            for _ in range(simulation.sync(level_code)):
+                reference.step(simulation.interval)
+
+            for name in CrowdSimulation.STATE_ARRAYS:
+                assert np.array_equal(getattr(level.crowd, name), getattr(reference, name)), \
+                    f"level {level_code}: {name} differs from the crowd stepped in this process"
+    finally:
+        simulation.shutdown()
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from saveState import Autosaver, CROWD_ARRAYS, SaveStateError, capture, create_level_handler, decode, encode
+from inputReplay import ScriptedInput
+
+TICKS = 300
+CROWD_COUNT = 200
+SCRIPT = [[40, ["d"]], [30, ["s"]], [20, []], [40, ["a", "w"]], [30, ["w"]], [10, ["d"]], [60, ["s"]]] * 4
+
+
+def get_state(level_handler) -> tuple:
+    crowd = level_handler.current_level.crowd
+    crowd_state = (crowd.x.tolist(), crowd.y.tolist(), crowd.frame_index.tolist()) if crowd is not None else None
+    return (level_handler.current_level_code, level_handler.player.rect.topleft, level_handler.player.status,
+            level_handler.player.image, crowd_state)
+
+
+def test_snapshot_round_trip(display):
+    """ A decoded snapshot holds what was encoded """
+    level_handler = create_level_handler(CROWD_COUNT)
+    snapshot = capture(level_handler)
+    decoded = decode(encode(snapshot))
+    level_handler.shutdown()
+
+    assert decoded.level_code == snapshot.level_code
+    assert decoded.player == snapshot.player
+    assert decoded.saved_at == snapshot.saved_at
+    assert decoded.animation_time == snapshot.animation_time
+    assert decoded.crowd.statuses == snapshot.crowd.statuses
+    assert decoded.crowd.rng_state == snapshot.crowd.rng_state
+    for name, _ in CROWD_ARRAYS:
+        np.testing.assert_array_equal(decoded.crowd.arrays[name], snapshot.crowd.arrays[name], err_msg=name)
+
+
+def test_decode_rejects_other_data():
+    with pytest.raises(SaveStateError):
+        decode(b"not a save state")
+
+
+def test_resumed_run_matches_original(display):
+    """ Saves half way through a scripted run, resuming from the save gives the same second half """
+    level_handler = create_level_handler(CROWD_COUNT)
+    player_input = ScriptedInput(SCRIPT)
+    level_handler.player.set_input_source(player_input.get_pressed)
+    for _ in range(TICKS):
+        level_handler.update()
+
+    data = encode(capture(level_handler))
+    original_states = []
+    for _ in range(TICKS):
+        level_handler.update()
+        original_states.append(get_state(level_handler))
+    level_handler.shutdown()
+
+    resumed_handler = create_level_handler(CROWD_COUNT, decode(data))
+    resumed_input = ScriptedInput(SCRIPT)
+    resumed_input.frame = TICKS
+    resumed_handler.player.set_input_source(resumed_input.get_pressed)
+    for tick, original_state in enumerate(original_states):
+        resumed_handler.update()
+        assert get_state(resumed_handler) == original_state, f"resumed state differs at tick {TICKS + tick}"
+    resumed_handler.shutdown()
+
+
+def test_failed_autosave_warns(display, tmp_path):
+    """ A failed autosave is reported as a warning and does not stop the game """
+    level_handler = create_level_handler(0)
+    # the snapshot should be written into a file instead of a folder
+    blocking_file = tmp_path / "saves"
+    blocking_file.write_bytes(b"")
+    autosaver = Autosaver(str(blocking_file / "autosave.sav"))
+    assert autosaver.save(level_handler)
+    with pytest.warns(RuntimeWarning, match="autosave failed"):
+        autosaver.flush()
+    level_handler.shutdown()
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+from startupTrace import run_game
+from conftest import CODE_DIR
+
+# milestones of main.py --startup-trace in the order they are reached
+MILESTONES = ["interpreter", "imports", "display", "first level built", "level handler", "first frame",
+              "background loading finished"]
+# imported by Game once the window is open
+DEFERRED_MODULES = ["level", "levelHandler", "levelCache", "crowd", "navigation", "worldStreamer", "mapLoader",
+                    "pytmx", "saveState", "offscreenSimulation", "hotReload"]
+
+
+def test_heavy_imports_deferred():
+    """ Importing main.py loads none of the level modules, they are imported after the display milestone """
+    code = f"import sys, main; print(sorted(set({DEFERRED_MODULES!r}) & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=CODE_DIR, check=True)
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
+def test_startup_trace_milestones():
+    """ main.py --startup-trace reports every milestone once, in startup order. The time to the first frame is
+        checked against STARTUP_BUDGET_MS by python startupTrace.py, wall clock times are too noisy for a test.
+    """
+    milestones = run_game(os.path.join(CODE_DIR, "main.py"), "dummy")
+    assert list(milestones) == MILESTONES
+    times = list(milestones.values())
+    assert times == sorted(times)